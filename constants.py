@@ -10,6 +10,24 @@ CHUNK_WIDTH_IN_BLOCKS = 16
 CHUNK_HEIGHT_IN_BLOCKS = 128
 REGION_WIDTH_IN_CHUNKS = 32
 
+# Chunk block and data arrays are indexed [x][z][y]
+CHUNK_SHAPE = (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS, CHUNK_HEIGHT_IN_BLOCKS)
+CHUNK_DTYPE = 'uint8'
+
+# Default limits for chunk caches (None means unlimited.) Each cached chunk takes up 64KiB.
+CACHE_CAPACITY_IN_CHUNKS = 1024
+CACHE_CAPACITY_IN_BYTES = None
+
+# Default limits for DSLayerMask2d's caches (None means unlimited.) Each cached chunk heightmap takes up 2KiB,
+# and each region's chunk corner heights about 9KiB.
+HEIGHT_CACHE_CAPACITY_IN_CHUNKS = 4096
+CORNER_CACHE_CAPACITY_IN_REGIONS = 64
+EDGE_CACHE_CAPACITY_IN_EDGES = 1024 # scanning strips of up to 340 chunks, each edge is only generated once
+
+# Default limit for how many regions' spawn points a LandmarkGenerator keeps (None means unlimited.) Each region
+# takes up about 40 bytes per spawn point, plus up to a few hundred KiB for its chunk index.
+SPAWN_CACHE_CAPACITY_IN_REGIONS = 64
+
 # Block ID constants
 try:
     from pymclevel import materials
@@ -7,8 +7,10 @@ Diamond-square algorithm for creating fractal cloud maps in 2D and 3D.
 
 import random
 import math
+import numpy
+from noise import *
 
-__all__ = ["diamondsquare1D", "diamondsquare2D"]
+__all__ = ["diamondsquare1D", "diamondsquare1Dbatch", "diamondsquare2D", "diamondsquare2Dbatch"]
 
 """
 diamondsquare1D
@@ -19,62 +21,89 @@ diamondsquare1D
     random value so that each time we reduce the size of the random displacement. 1.0 will not reduce
     the random displacement at all. 0.5 will reduce it by half each iteration.
 - initdepth is the initial depth into the recursion that we begin at. We can cut down on noise using this.
+- statelessrng: if True, draw random values from the noise module instead of seeding the random module.
+    This gives a different (but just as repeatable) result, and leaves the random module alone.
+
+arr can be a list or a 1D numpy array, and is filled in place. Either way, the filled array is also
+returned as a numpy array of floats. Like diamondsquare2D, we fill in waves rather than recursing;
+see diamondsquare1Dplan().
 """
 
-def diamondsquare1D( arr, seed = None, volatility = 0.5, initdepth = 0):
+def diamondsquare1D( arr, seed = None, volatility = 0.5, initdepth = 0, statelessrng = False):
 
     if not (0.0 <= volatility and volatility <= 1.0): raise Exception, 'volatility is out of bounds:' + str(volatility)
     if not (0 <= initdepth): raise Exception, 'initdepth is out of bounds:' + str( initdepth)
 
+    if isinstance(arr, numpy.ndarray) and arr.dtype == float and arr.flags.c_contiguous:
+        values = arr
+    else:
+        values = numpy.array(arr, dtype = float)
+    if values.ndim != 1: raise Exception, 'arr must be a 1D array'
+    diamondsquare1Dbatch(values[numpy.newaxis], seed, volatility, initdepth, statelessrng)
+
+    if values is not arr:
+        if isinstance(arr, numpy.ndarray):
+            arr[...] = values
+        else:
+            arr[:] = values.tolist()
+    return values
+
+def diamondsquare1Dbatch( arrs, seed = None, volatility = 0.5, initdepth = 0, statelessrng = False):
     """
-    recurse:
-
-    each ix is an integer for accessing the elements of the array.
-
-    Left is towards the beginning of the array, right is towards the end of the array. ( I really should have called these startx and endx or something )
+    Fill a whole stack of equally long edges at once: arrs is a contiguous numpy array of floats,
+    indexed [i][ix], with each edge's endpoints in arrs[i][0] and arrs[i][-1]. seed is either one seed
+    for every edge, or a list of seeds, one per edge. Comes out exactly as if we'd called
+    diamondsquare1D on each arrs[i] (with its own seed) in turn. Returns arrs.
     """
-    def recurse( left, right, depth):
-        # Check to make sure that we need to recurse because there may be unfilled values.
-        if ( abs(left - right) < 2 ):
-            #print "Size-rejected area", (left,right)
-            return
-        # do a midpoint recursion on the data.
-        #print "recursing between", left, "and", right
-
-        # Get the center coordinates (used in both steps)        
-        centerix = int(math.floor( (left + right) / 2))
-        volatilityscale = pow(volatility, depth);
-        randadd = (random.random() - 0.5) * volatilityscale
-
-        # Midpoint step: well, midpoint (durr)
-        if ( arr[centerix] < 0.0 ):
-            avg = (arr[left] + arr[right]) / 2.0
-            arr[centerix] = min( max(avg + randadd, 0.0), 1.0)
-            #print "filling midpoint", (centerix), "with", arr[centerix], "given", arr[left], "and", arr[right]    
-
-        # Recursive step: left
-        recurse( left, centerix, depth + 1 )
-        # Recursive step: right
-        recurse( centerix, right, depth + 1 )
-
-    # truly random values for the corners
-    random.seed(seed)
-    # Initialize the corners with random values if they're empty.
-    if( arr[len(arr)-1] < 0.0 ): arr[len(arr)-1] = random.random()
-    if( arr[0] < 0.0 ):          arr[0] = random.random()
-
-    # Seed the random number generator:
-    cornerseed = arr[len(arr)-1]*37*37 + arr[0]*37*37*37
-    if (seed == None):
-        # When no seed is provided, seed the randomness using the corner values. In this way, if you have two 2D diamond-square spaces
-        # you want to generate side-by-side, and want them to seam correctly, generate their shared edge and 
-        # just leave seed == None for both edges.
-        random.seed(cornerseed)
+    if not (0.0 <= volatility and volatility <= 1.0): raise Exception, 'volatility is out of bounds:' + str(volatility)
+    if not (0 <= initdepth): raise Exception, 'initdepth is out of bounds:' + str( initdepth)
+    if not (isinstance(arrs, numpy.ndarray) and arrs.dtype == float and arrs.flags.c_contiguous and arrs.ndim == 2):
+        raise Exception, 'arrs must be a contiguous 2D array of floats'
+
+    count, length = arrs.shape
+    if isinstance(seed, (list, tuple, numpy.ndarray)):
+        seeds = list(seed.tolist() if isinstance(seed, numpy.ndarray) else seed)
+        if len(seeds) != count: raise Exception, 'need one seed per edge, got ' + str(len(seeds)) + ' for ' + str(count)
     else:
-        random.seed(seed + cornerseed);
-    
-    # Initiate the recursion
-    recurse( 0, len(arr)-1, initdepth )
+        seeds = None
+    plan = diamondsquare1Dplan(length)
+
+    if statelessrng:
+        if seeds is None:
+            seedarg = seed
+        else:
+            seedarg = numpy.array(seeds)
+        # Initialize the corners with random values if they're empty.
+        for ix, corner in enumerate([length - 1, 0]):
+            arrs[:, corner] = numpy.where( arrs[:, corner] < 0.0, hashrandom(seedarg, NOISE_DSCORNERS, ix), arrs[:, corner] )
+        if seeds is not None:
+            seedarg = seedarg[:, numpy.newaxis]
+        # The displacements depend on the corners too, so shared edges seam up.
+        randoms = hashrandom(seedarg, NOISE_DSFILL, arrs[:, length - 1, numpy.newaxis], arrs[:, 0, numpy.newaxis], numpy.arange(plan.randomcount))
+    else:
+        randoms = numpy.empty( (count, plan.randomcount) )
+        for i in xrange(count):
+            edge = arrs[i]
+            edgeseed = seed if seeds is None else seeds[i]
+            # truly random values for the corners
+            random.seed(edgeseed)
+            # Initialize the corners with random values if they're empty.
+            if( edge[length-1] < 0.0 ): edge[length-1] = random.random()
+            if( edge[0] < 0.0 ):        edge[0] = random.random()
+
+            # Seed the random number generator:
+            cornerseed = float(edge[length-1])*37*37 + float(edge[0])*37*37*37
+            if (edgeseed == None):
+                # When no seed is provided, seed the randomness using the corner values. In this way, if you have two 2D diamond-square spaces
+                # you want to generate side-by-side, and want them to seam correctly, generate their shared edge and 
+                # just leave seed == None for both edges.
+                random.seed(cornerseed)
+            else:
+                random.seed(edgeseed + cornerseed);
+            randoms[i] = drawrandoms(plan.randomcount)
+
+    fillwaves(arrs, plan, randoms, volatility, initdepth)
+    return arrs
 
 
 """
@@ -84,112 +113,236 @@ diamondsquare2D
     (direction doesn't really matter since we're only using averages.)
     We're going to mutate the fuck out of this array. Any value that is negative will be rewritten
     with a value between 0 and 1. Any value you initialize will affect the surrounding geometry.
+    arr can be a list of lists or a 2D numpy array. Either way, the filled array is also returned
+    as a numpy array of floats.
 - seed is anything!
 - volatility is a numer that should range from 1.0 to 0.5. This is the fraction we multiply by the
     random value so that each time we reduce the size of the random displacement. 1.0 will not reduce
     the random displacement at all. 0.5 will reduce it by half each iteration.
+- statelessrng: if True, draw random values from the noise module instead of seeding the random module.
+    This gives a different (but just as repeatable) result, and leaves the random module alone.
+
+Rather than recursing, we fill the array in waves: every midpoint whose neighbours are already
+filled gets filled at once. See diamondsquare2Dplan().
 """
 
-def diamondsquare2D( arr, seed = None, volatility = 0.5, initdepth = 0):
+def diamondsquare2D( arr, seed = None, volatility = 0.5, initdepth = 0, statelessrng = False):
        
     if not (0.0 <= volatility and volatility <= 1.0): raise Exception, 'volatility is out of bounds:' + str(volatility)
     if not (0 <= initdepth): raise Exception, 'initdepth is out of bounds:' + str( initdepth)
 
+    if isinstance(arr, numpy.ndarray) and arr.dtype == float and arr.flags.c_contiguous:
+        heights = arr
+    else:
+        heights = numpy.array(arr, dtype = float)
+    if heights.ndim != 2: raise Exception, 'arr must be a 2D array'
+    diamondsquare2Dbatch(heights[numpy.newaxis], seed, volatility, initdepth, statelessrng)
+
+    if heights is not arr:
+        if isinstance(arr, numpy.ndarray):
+            arr[...] = heights
+        else:
+            for row, values in zip(arr, heights.tolist()):
+                row[:] = values
+    return heights
+
+def diamondsquare2Dbatch( arrs, seed = None, volatility = 0.5, initdepth = 0, statelessrng = False):
     """
-    recurse:
- 
+    Fill a whole stack of equally sized 2D arrays at once: arrs is a contiguous numpy array of floats,
+    indexed [i][row][col], and comes out exactly as if we'd called diamondsquare2D on each arrs[i] in turn.
+    Returns arrs.
     """
-    def recurse( top, bottom, right, left, depth):
-        #print arr
-        # Check to make sure that we need to recurse because there may be unfilled values.
-        if ( abs(bottom - top) < 2 and abs(left - right) < 2 ):
-            #print "Size-rejected area", (top,right), "to", (bottom, left)
-            return
-        #print "recursing on area", (top,right), "to", (bottom, left)
-        
-        # do a diamond-square recursion on the data. Square step doesn't average all four corners
-        # of the diamond, just uses the midpoint of the corners. I wonder what this will affect.
-
-        # Get the center coordinates (used in both steps)        
-        centerix = ( int(math.floor( (top + bottom) / 2)), int(math.floor( (right + left) / 2)) )
-        volatilityscale = pow(volatility, depth);
-        toprandadd = (random.random() - 0.5) * volatilityscale
-        bottomrandadd = (random.random() - 0.5) * volatilityscale
-        rightrandadd = (random.random() - 0.5) * volatilityscale
-        leftrandadd = (random.random() - 0.5) * volatilityscale
-        centerrandadd = (random.random() - 0.5) * volatilityscale
-
-        # Square Step: top
-        if ( arr[top][centerix[1]] < 0.0 ):
-            topavg = (arr[top][left] + arr[top][right]) / 2.0
-            arr[top][centerix[1]] = min( max( topavg + toprandadd, 0.0 ), 1.0 )
-            #print "filling top", (top, centerix[1]), "with", arr[top][centerix[1]], "given", arr[top][left], "and", arr[top][right]         
-
-        # Square Step: bottom
-        if ( arr[bottom][centerix[1]] < 0.0 ):
-            bottomavg = (arr[bottom][left] + arr[bottom][right]) / 2.0
-            arr[bottom][centerix[1]] = min( max( bottomavg + bottomrandadd, 0.0 ), 1.0 )
-            #print "filling bottom", (bottom, centerix[1]), "with", arr[bottom][centerix[1]], "given", arr[bottom][left], "and", arr[bottom][right]    
-
-        # Square Step: right
-        if ( arr[centerix[0]][right] < 0.0 ):
-            rightavg = (arr[top][right] + arr[bottom][right]) / 2.0
-            arr[centerix[0]][right] = min( max( rightavg + rightrandadd, 0.0 ), 1.0 )
-            #print "filling right", (centerix[0], right), "with", arr[centerix[0]][right], "given", arr[top][right], "and",arr[bottom][right]
-
-        # Square Step: left
-        if ( arr[centerix[0]][left] < 0.0 ):
-            leftavg = (arr[top][left] + arr[bottom][left]) / 2.0
-            arr[centerix[0]][left] = min( max( leftavg + leftrandadd, 0.0 ), 1.0 )
-            #print "filling left", (centerix[0], left), "with", arr[centerix[0]][left], "given", arr[top][left], "and",arr[bottom][left]
-
-        # Diamond step: center point (comes after     
-        if ( arr[centerix[0]][centerix[1]] < 0.0 ):
-            centeravg = ( arr[top][left] + arr[top][right] + arr[bottom][left] + arr[bottom][right] ) / 4.0
-            arr[centerix[0]][centerix[1]] = min( max( centeravg + centerrandadd, 0.0 ), 1.0 )
-            
-            #print "filling center", (centerix[0], centerix[1]), "with", arr[centerix[0]][centerix[1]], "given", arr[top][left], \
-            #      arr[top][right], arr[bottom][left], "and", arr[bottom][right]            
-
-        # Recursive step: top right
-        recurse( top, centerix[0], right, centerix[1], depth + 1 )
-            
-        # Recursive step: top left
-        recurse( top, centerix[0], centerix[1], left, depth + 1 )
-        
-        # Recursive step: bottom right
-        recurse( centerix[0], bottom, right, centerix[1], depth + 1 )
-            
-        # Recursive step: bottom left
-        recurse( centerix[0], bottom, centerix[1], left, depth + 1 )
-
-    
-
-    #print arr
-    random.seed(seed)
-    # Initialize the corners with random values if they're empty.
-    if( arr[len(arr)-1][len(arr[0])-1] < 0.0 ): arr[len(arr)-1][len(arr[0])-1] = random.random()
-    if( arr[0][len(arr[0])-1] < 0.0 ): arr[0][len(arr[0])-1] = random.random()
-    if( arr[len(arr)-1][0] < 0.0 ): arr[len(arr)-1][0] = random.random()
-    if( arr[0][0] < 0.0 ): arr[0][0] = random.random()
-
-    cornerseed = (arr[len(arr)-1][len(arr[0])-1]) + (arr[0][len(arr[0])-1])*37 + (arr[len(arr)-1][0])*37*37 + (arr[0][0])*37*37*37
-    #print "Corner values are:", arr[bottom][left], arr[top][left], arr[bottom][right], arr[top][right]
-    if (seed == None):
-        # When no seed is provided, seed the randomness using the corner values. In this way, if you have two 3D diamond-square spaces
-        # you want to generate side-by-side, and want them to seam correctly, generate the shared surface and
-        # just leave seed == None for both surfaces.
-        random.seed( cornerseed )
-        #print "seed for this recursion is", cornerseed
+    if not (0.0 <= volatility and volatility <= 1.0): raise Exception, 'volatility is out of bounds:' + str(volatility)
+    if not (0 <= initdepth): raise Exception, 'initdepth is out of bounds:' + str( initdepth)
+    if not (isinstance(arrs, numpy.ndarray) and arrs.dtype == float and arrs.flags.c_contiguous and arrs.ndim == 3):
+        raise Exception, 'arrs must be a contiguous 3D array of floats'
+
+    count, rows, cols = arrs.shape
+    flat = arrs.reshape(count, rows * cols)
+    corners = [ rows * cols - 1, cols - 1, (rows - 1) * cols, 0 ] # bottom left, top left, bottom right, top right
+    plan = diamondsquare2Dplan(rows, cols)
+
+    if statelessrng:
+        # Initialize the corners with random values if they're empty.
+        for ix, corner in enumerate(corners):
+            flat[flat[:, corner] < 0.0, corner] = hashrandom(seed, NOISE_DSCORNERS, ix)
+        # The displacements depend on the corners too, so shared surfaces seam up.
+        randoms = hashrandom(seed, NOISE_DSFILL, *([flat[:, corner, numpy.newaxis] for corner in corners] + [numpy.arange(plan.randomcount)]))
     else:
-        random.seed( seed + cornerseed );
-        #print "seed for this recursion is", seed + cornerseed
-    
-    # Initiate the recursion
-    recurse( 0 ,len(arr)-1, 0, len(arr[0])-1, initdepth )
-        
-            
+        randoms = numpy.empty( (count, plan.randomcount) )
+        for i in xrange(count):
+            heights = flat[i]
+            random.seed(seed)
+            # Initialize the corners with random values if they're empty.
+            for corner in corners:
+                if( heights[corner] < 0.0 ): heights[corner] = random.random()
+
+            cornerseed = float(heights[corners[0]]) + float(heights[corners[1]])*37 + float(heights[corners[2]])*37*37 + float(heights[corners[3]])*37*37*37
+            if (seed == None):
+                # When no seed is provided, seed the randomness using the corner values. In this way, if you have two 3D diamond-square spaces
+                # you want to generate side-by-side, and want them to seam correctly, generate the shared surface and
+                # just leave seed == None for both surfaces.
+                random.seed( cornerseed )
+            else:
+                random.seed( seed + cornerseed );
+            randoms[i] = drawrandoms(plan.randomcount)
+
+    fillwaves(flat, plan, randoms, volatility, initdepth)
+    return arrs
+
+def fillwaves(flat, plan, randoms, volatility, initdepth):
+    """
+    Fill in a stack of flattened arrays, indexed [i][flat index], following plan one wave of midpoints
+    at a time. randoms[i] holds the random values drawn for flat[i], in the order the plan wants them.
+    """
+    volatilityscales = numpy.array([ pow(volatility, initdepth + depth) for depth in xrange(plan.depthcount) ])
+    unfilled = flat < 0.0 # anything we were handed is left alone
+    for (targets, operands, randomix, depths) in plan.waves:
+        avg = flat[:, operands[0]]
+        for operand in operands[1:]:
+            avg = avg + flat[:, operand]
+        avg /= float(len(operands))
+        randadd = (randoms[:, randomix] - 0.5) * volatilityscales[depths]
+        values = numpy.minimum( numpy.maximum( avg + randadd, 0.0 ), 1.0 )
+        flat[:, targets] = numpy.where( unfilled[:, targets], values, flat[:, targets] )
+
+def drawrandoms(count):
+    """
+    Draw count values from the random module's generator, just like calling random.random() count times,
+    but all at once. numpy's RandomState runs the same Mersenne Twister and turns its output into floats
+    the same way, so we hand it our state, draw, and take the state back afterwards.
+    """
+    if count < 2048: # cheaper than swapping states around
+        return numpy.array([ random.random() for i in xrange(count) ])
+    state = random.getstate()
+    generator = numpy.random.RandomState()
+    generator.set_state( ('MT19937', numpy.array(state[1][:-1], dtype = numpy.uint32), state[1][-1]) )
+    randoms = generator.random_sample(count)
+    newstate = generator.get_state()
+    random.setstate( (state[0], tuple(newstate[1].tolist()) + (int(newstate[2]),), None) )
+    return randoms
+
+class DiamondSquarePlan(object):
+    """
+    The order in which diamondsquare1D or diamondsquare2D fills in an array of a given shape, grouped into waves.
+
+    Each wave is a tuple of (targets, operands, randomix, depths): the flat indices of the cells the
+    wave fills, a list of index arrays of the cells to average for each of them, which random value
+    each target gets displaced by, and how deep in the subdivision each target is. Every cell a wave
+    reads from was filled by an earlier wave (or was one of the four corners.)
+    """
+    waves = None
+    randomcount = None # how many random values the fill draws
+    depthcount = None # how many levels of subdivision there are
+
+diamondsquareplans = {} # plans we've already worked out, by shape
+
+def diamondsquare1Dplan(length):
+    """
+    Work out the DiamondSquarePlan for an edge of the given length.
 
+    Just like diamondsquare2Dplan, but the recursion draws one random value per segment.
+    """
+    if (length,) in diamondsquareplans:
+        return diamondsquareplans[(length,)]
+
+    wave = [-1] * length # wave in which each element gets filled
+    wave[0] = wave[length - 1] = 0
+    fills = {} # wave -> lists of targets, operands, random indices and depths
+    calls = 0
+    depthcount = 0
+    stack = [ (0, length - 1, 0) ]
+    while stack:
+        left, right, depth = stack.pop()
+        # Check to make sure that we need to recurse because there may be unfilled values.
+        if ( abs(left - right) < 2 ):
+            continue
+        centerix = (left + right) // 2
+        if wave[centerix] < 0:
+            wave[centerix] = 1 + max(wave[left], wave[right])
+            if not wave[centerix] in fills:
+                fills[wave[centerix]] = ( [], [[], []], [], [] )
+            targets, operandlists, randomix, depths = fills[wave[centerix]]
+            targets.append(centerix)
+            operandlists[0].append(left)
+            operandlists[1].append(right)
+            randomix.append(calls)
+            depths.append(depth)
+        calls += 1
+        depthcount = max(depthcount, depth + 1)
+        # Recursive steps, pushed in reverse so they come off the stack as left, right.
+        stack.append( (centerix, right, depth + 1) )
+        stack.append( (left, centerix, depth + 1) )
+
+    plan = DiamondSquarePlan()
+    plan.randomcount = calls
+    plan.depthcount = depthcount
+    plan.waves = []
+    for key in sorted(fills):
+        targets, operandlists, randomix, depths = fills[key]
+        plan.waves.append( (numpy.array(targets), [numpy.array(operandlist) for operandlist in operandlists],
+                            numpy.array(randomix), numpy.array(depths)) )
+    diamondsquareplans[(length,)] = plan
+    return plan
+
+def diamondsquare2Dplan(rows, cols):
+    """
+    Work out the DiamondSquarePlan for a rows x cols array.
 
-        
-    
+    The classic recursion visits regions depth first, drawing five random values per region and
+    filling each midpoint the first time a region reaches it. We walk through the regions in the same
+    order once per shape, noting which region fills each cell and with which random value, so that
+    the actual fill can be done a wave at a time and still come out exactly the same.
+    """
+    if (rows, cols) in diamondsquareplans:
+        return diamondsquareplans[(rows, cols)]
+
+    wave = [-1] * (rows * cols) # wave in which each cell gets filled, by flat index
+    for corner in [0, cols - 1, (rows - 1) * cols, rows * cols - 1]:
+        wave[corner] = 0
+    fills = {} # (wave, number of operands) -> lists of targets, operands, random indices and depths
+    calls = 0
+    depthcount = 0
+    stack = [ (0, rows - 1, 0, cols - 1, 0) ]
+    while stack:
+        top, bottom, right, left, depth = stack.pop()
+        # Check to make sure that we need to recurse because there may be unfilled values.
+        if ( abs(bottom - top) < 2 and abs(left - right) < 2 ):
+            continue
+        centerrow, centercol = (top + bottom) // 2, (right + left) // 2
+        topleft, topright, bottomleft, bottomright = top * cols + left, top * cols + right, bottom * cols + left, bottom * cols + right
+        steps = [ ( top * cols + centercol, (topleft, topright) ), # Square step: top
+                  ( bottom * cols + centercol, (bottomleft, bottomright) ), # Square step: bottom
+                  ( centerrow * cols + right, (topright, bottomright) ), # Square step: right
+                  ( centerrow * cols + left, (topleft, bottomleft) ), # Square step: left
+                  ( centerrow * cols + centercol, (topleft, topright, bottomleft, bottomright) ) ] # Diamond step: center
+        for step, (target, operands) in enumerate(steps):
+            if wave[target] >= 0: continue
+            wave[target] = 1 + max( [wave[operand] for operand in operands] )
+            key = (wave[target], len(operands))
+            if not key in fills:
+                fills[key] = ( [], [[] for operand in operands], [], [] )
+            targets, operandlists, randomix, depths = fills[key]
+            targets.append(target)
+            for operandlist, operand in zip(operandlists, operands):
+                operandlist.append(operand)
+            randomix.append(calls * 5 + step)
+            depths.append(depth)
+        calls += 1
+        depthcount = max(depthcount, depth + 1)
+        # Recursive steps, pushed in reverse so they come off the stack as top right, top left, bottom right, bottom left.
+        stack.append( (centerrow, bottom, centercol, left, depth + 1) )
+        stack.append( (centerrow, bottom, right, centercol, depth + 1) )
+        stack.append( (top, centerrow, centercol, left, depth + 1) )
+        stack.append( (top, centerrow, right, centercol, depth + 1) )
+
+    plan = DiamondSquarePlan()
+    plan.randomcount = calls * 5
+    plan.depthcount = depthcount
+    plan.waves = []
+    for key in sorted(fills):
+        targets, operandlists, randomix, depths = fills[key]
+        plan.waves.append( (numpy.array(targets), [numpy.array(operandlist) for operandlist in operandlists],
+                            numpy.array(randomix), numpy.array(depths)) )
+    diamondsquareplans[(rows, cols)] = plan
+    return plan
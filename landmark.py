@@ -9,8 +9,11 @@ Landmark generation - interspersed landmarks on the terrain
 import random
 import math
 import copy
-#import numpy
+import numpy
 from layer import *
+from layer import findSurface
+from noise import *
+from lrucache import LRUCache
 from constants import *
 
 
@@ -18,13 +21,74 @@ from constants import *
 # Base Classes: Landmark and LandmarkGenerator
 #########################################################################
 
+class Stamp(object):
+    """
+    A 3D pattern of blocks, indexed ( x,z,y ), compiled once so that it can be stamped onto chunks with a
+    couple of array operations.
+
+    blocks is a dense array of the block IDs, and mask says which of them actually get written: anything
+    that was MAT_TRANSPARENT in the pattern leaves the chunk alone. cells holds the ( x,z,y ) coordinates of
+    those solid blocks and cellids their IDs. The pattern can be nested lists (rows may be ragged; anything
+    missing counts as transparent) or a numpy array.
+    """
+    blocks = None
+    mask = None
+    cells = None
+    cellids = None
+
+    def __init__(self, pattern):
+        if isinstance(pattern, numpy.ndarray):
+            ids = pattern
+        else:
+            sizex = len(pattern)
+            sizez = max( [len(row) for row in pattern] + [0] )
+            sizey = max( [len(col) for row in pattern for col in row] + [0] )
+            ids = numpy.empty( (sizex, sizez, sizey), dtype = int )
+            ids.fill(MAT_TRANSPARENT)
+            for x, row in enumerate(pattern):
+                for z, col in enumerate(row):
+                    ids[x, z, :len(col)] = col
+        assert( ids.ndim == 3 )
+        self.mask = (ids != MAT_TRANSPARENT)
+        self.blocks = numpy.where(self.mask, ids, 0).astype(CHUNK_DTYPE)
+        self.cells = numpy.nonzero(self.mask)
+        self.cellids = self.blocks[self.mask]
+
+    def stampToBlocks(self, outputblocks, offsetx, offsetz, offsety):
+        """
+        Write the stamp into a chunk's block array, with the stamp's lower-north-east corner offset from
+        the chunk's by offsetx, offsetz and offsety. Whatever falls outside the chunk is clipped off.
+        """
+        # the overlapping range, in chunk-space.
+        bounds = [ (max(0, offset), min(outputsize, offset + stampsize))
+                   for (offset, outputsize, stampsize) in zip( (offsetx, offsetz, offsety), outputblocks.shape, self.blocks.shape ) ]
+        if any( start >= stop for (start, stop) in bounds ): return
+        outslices = tuple( slice(start, stop) for (start, stop) in bounds )
+        inslices = tuple( slice(start - offset, stop - offset) for ((start, stop), offset) in zip( bounds, (offsetx, offsetz, offsety) ) )
+        numpy.copyto( outputblocks[outslices], self.blocks[inslices], where = self.mask[inslices] )
+
+    def getScatter(self, shape, offsetx, offsetz, offsety):
+        """
+        The stamp's solid blocks, offset like in stampToBlocks() and clipped to a block array of the given
+        shape, as (flat indices into that array, block IDs). Handy for stamping lots of things at once.
+        """
+        x, z, y = [ cells + offset for (cells, offset) in zip( self.cells, (offsetx, offsetz, offsety) ) ]
+        inside = (0 <= x) & (x < shape[0]) & (0 <= z) & (z < shape[1]) & (0 <= y) & (y < shape[2])
+        return numpy.ravel_multi_index( (x[inside], z[inside], y[inside]), shape ), self.cellids[inside]
+
+
 class Landmark(Filter):
     """
     A chunk generator for a single landmark somewhere in the world.
 
-    Override editChunk() to create your own landmarks.
-    Override __copy__() if you keep pointers to data as member variables in your subclasses, since LandmarkGenerator WILL
-    copy instances of your subclass.
+    Override editChunk() to create your own landmarks. If your landmark needs to look at other chunks, read them
+    from self.inputlayer: when LandmarkGenerator draws a landmark, that's the terrain with the landmarks before
+    it already drawn.
+
+    LandmarkGenerator doesn't make a Landmark for every spawn point; it keeps them in a SpawnTable and asks the
+    landmark in its landmarklist to drawSpawn() each one. Override drawSpawn() too if you can draw straight
+    from the table. Otherwise we make a copy of the landmark every time a spawn point gets drawn, so override
+    __copy__() if you keep pointers to data as member variables in your subclasses.
     """
     seed = None
     x = None
@@ -73,27 +137,29 @@ class Landmark(Filter):
         else:
             return False
 
-    def findHighestGround(self, airid = MAT_AIR):
-        # Find our actual Y at the x,z spawn coordinates.
+    def findHighestGround(self, airid = MAT_AIR, inputlayer = None, x = None, z = None):
+        # Find our actual Y at the x,z spawn coordinates (ours, unless we're told otherwise.)
         # but before that, we need the correct chunk.
-        originchunkx = self.x / CHUNK_WIDTH_IN_BLOCKS
-        originchunkz = self.z / CHUNK_WIDTH_IN_BLOCKS
-        originchunk = self.inputlayer.getChunk(originchunkx, originchunkz).blocks
-        # now that we have the correct origin chunk, let's search for the tree's ground height.
-        downrange = range( 0, CHUNK_HEIGHT_IN_BLOCKS - 1 )
-        downrange.reverse()
-        actualy = None
-        actualyid = None
-        chunkoffsetx = self.x % CHUNK_WIDTH_IN_BLOCKS
-        chunkoffsetz = self.z % CHUNK_WIDTH_IN_BLOCKS
-        for y in downrange:
-            actualyid = originchunk[chunkoffsetx][chunkoffsetz][y]
-            if actualyid != airid:
-                actualy = y + 1
-                break
+        if inputlayer is None:
+            inputlayer = self.inputlayer
+        if x is None: x = self.x
+        if z is None: z = self.z
+        originchunkx = x / CHUNK_WIDTH_IN_BLOCKS
+        originchunkz = z / CHUNK_WIDTH_IN_BLOCKS
+        originchunk = inputlayer.getChunk(originchunkx, originchunkz)
+        originblocks = originchunk.readBlocks()
+        # now that we have the correct origin chunk, let's look up the tree's ground height.
+        chunkoffsetx = x % CHUNK_WIDTH_IN_BLOCKS
+        chunkoffsetz = z % CHUNK_WIDTH_IN_BLOCKS
+        col = originblocks[chunkoffsetx, chunkoffsetz]
+        groundy = CHUNK_HEIGHT_IN_BLOCKS - 1
+        if airid == MAT_AIR:
+            groundy = originchunk.getSurface()[chunkoffsetx, chunkoffsetz]
+        if groundy >= CHUNK_HEIGHT_IN_BLOCKS - 1: # we never look at the very top block
+            groundy = findSurface(col, airid, 0, CHUNK_HEIGHT_IN_BLOCKS - 2)
         # Set proper return value
-        if actualy == None: return None
-        else: return (actualy, actualyid)
+        if groundy < 0: return None
+        else: return (int(groundy) + 1, int(col[groundy]))
 
     def stampToChunk(self, inputstamp, outputchunk, offsetx, offsetz, offsety):
         """
@@ -102,20 +168,12 @@ class Landmark(Filter):
         Stamp a 3D array of blocks onto the output chunk
         The offset parameters represent the offset of inputarray's lower-north-east corner
         to the current chunk's lower-north-east corner
-        """
-        # Write the static array into the map. # TODO: MAKE THIS A FUNCTION
-        # offsets of lower north-east corner of the array relative to corner block.
 
-        # iterate between the overlapping range, in chunk-space.
-        for outx in xrange( max(0, offsetx), min(CHUNK_WIDTH_IN_BLOCKS, offsetx + len(inputstamp) ) ):
-            # get the current coordinate in input-space.
-            inx = outx - offsetx
-            for outz in xrange( max(0, offsetz), min(CHUNK_WIDTH_IN_BLOCKS, offsetz + len(inputstamp[inx]) ) ):
-                inz = outz - offsetz
-                for outy in xrange( max(0, offsety), min(CHUNK_HEIGHT_IN_BLOCKS, offsety + len(inputstamp[inx][inz]) ) ):
-                    iny = outy - offsety
-                    if (inputstamp[inx][inz][iny] != MAT_TRANSPARENT):
-                        outputchunk[outx][outz][outy] = inputstamp[inx][inz][iny]
+        inputstamp should be a Stamp. Nested lists work too, but get compiled into one every time.
+        """
+        if not isinstance(inputstamp, Stamp):
+            inputstamp = Stamp(inputstamp)
+        inputstamp.stampToBlocks(outputchunk, offsetx, offsetz, offsety)
 
 
     def editChunk(self, cornerblockx, cornerblockz, terrainchunk):
@@ -134,6 +192,20 @@ class Landmark(Filter):
                 terrainblocks[relx][relz][i] = MAT_WOOD
             terrainblocks[relx][relz][self.y] = MAT_WATER
         
+    def drawSpawn(self, spawns, ix, cornerblockx, cornerblockz, terrainchunk, inputlayer):
+        """
+        Draw spawn point ix of a SpawnTable into the chunk, as a landmark of our type.
+
+        By default we make a copy of ourselves at the spawn point, reading from inputlayer, and have it
+        editChunk(). The copy is thrown away afterwards (all that's kept is whether it cancelled drawing), so
+        we don't hold on to a Landmark for every spawn point. Override this to skip the copy.
+        """
+        lm = copy.copy(self)
+        lm.setPos( int(spawns.x[ix]), int(spawns.z[ix]), int(spawns.y[ix]) )
+        lm.inputlayer = inputlayer # just the copy's, so other threads drawing with us aren't affected
+        lm.editChunk(cornerblockx, cornerblockz, terrainchunk)
+        spawns.drawcancelled[ix] = lm.drawcancelled
+
     def getChunk(self, cx, cz):
         """
         Output a chunk for processing. Do not override! use editChunk instead
@@ -149,37 +221,143 @@ class Landmark(Filter):
         return outputchunk
 
 
-class LandmarkGenerator(Filter):
+class LandmarkChain(Layer):
     """
-    A chunk generator for a random smattering of landmarks throughout the worldde
+    The chunks from inputlayer, with the first count spawn points from a list of spawns drawn onto them
+    in order. spawns is a list of (SpawnTable, start, stop) ranges of spawn points.
+
+    This gives exactly what you'd get by making a Landmark for each spawn point and chaining them together
+    as filters with setInputLayer(), but in a single pass over each chunk and without linking anything
+    up, so the same spawns can be drawn by several threads at once. A landmark which looks at other
+    chunks sees them with the spawns before it already drawn, just like it would in a chain.
+    """
+    inputlayer = None
+    spawns = None
+    count = None
+    def __init__(self, inputlayer, spawns, count = None):
+        if count is None:
+            count = sum( stop - start for (table, start, stop) in spawns )
+        self.inputlayer = inputlayer
+        self.spawns = spawns
+        self.count = count
+
+    def getChunk(self, cx, cz):
+        terrainchunk = self.inputlayer.getChunk(cx, cz)
+        cornerblockx = cx * CHUNK_WIDTH_IN_BLOCKS
+        cornerblockz = cz * CHUNK_WIDTH_IN_BLOCKS
+        position = 0 # how many spawns into the list we are
+        for (table, start, stop) in self.spawns:
+            if position >= self.count: break
+            stop = min(stop, start + self.count - position)
+            for ix in table.getSpawnsDrawnInChunk(start, stop, cx, cz):
+                lmtype = table.landmarklist[ table.typeix[ix] ]
+                lmtype.drawSpawn(table, ix, cornerblockx, cornerblockz, terrainchunk, LandmarkChain(self.inputlayer, self.spawns, position + ix - start))
+            position += stop - start
+        return terrainchunk
+
+
+class SpawnTable(object):
+    """
+    The landmarks spawned in a region, kept as arrays rather than as a Landmark apiece.
+
+    x, z, y and typeix (an index into landmarklist) are arrays with an entry for each spawn point, sorted by
+    the chunk each one spawned in (x, then z) and otherwise in the order they were spawned. originchunks
+    maps each origin chunk to the (start, stop) range of its spawns. viewrange is each spawn's landmark's
+    viewrange, and drawcancelled is set for spawns which have given up on drawing.
+    """
+    landmarklist = None
+    x = None
+    z = None
+    y = None
+    typeix = None
+    viewrange = None
+    drawcancelled = None
+    originchunks = None
+
+    def __init__(self, landmarklist, x, z, y, typeix):
+        x, z, y, typeix = [ numpy.asarray(values, dtype = int) for values in (x, z, y, typeix) ]
+        originchunkx = numpy.floor_divide(x, CHUNK_WIDTH_IN_BLOCKS)
+        originchunkz = numpy.floor_divide(z, CHUNK_WIDTH_IN_BLOCKS)
+        order = numpy.lexsort( (originchunkz, originchunkx) ) # a stable sort, so spawn order is kept within a chunk
+        self.landmarklist = landmarklist
+        self.x, self.z, self.y, self.typeix = x[order], z[order], y[order], typeix[order]
+        self.viewrange = numpy.array( [lmtype.viewrange for lmtype in landmarklist], dtype = int )[self.typeix]
+        self.drawcancelled = numpy.zeros( len(order), dtype = bool )
+        self.originchunks = {}
+        originchunkx, originchunkz = originchunkx[order].tolist(), originchunkz[order].tolist()
+        start = 0
+        for ix in xrange( 1, len(order) + 1 ):
+            if ix == len(order) or originchunkx[ix] != originchunkx[start] or originchunkz[ix] != originchunkz[start]:
+                self.originchunks[ (originchunkx[start], originchunkz[start]) ] = (start, ix)
+                start = ix
+
+    def __len__(self):
+        return len(self.x)
+
+    def getSpawnsDrawnInChunk(self, start, stop, cx, cz):
+        """
+        Which of spawns start to stop reach into chunk cx, cz and haven't been cancelled? (see
+        Landmark.isLandmarkInChunk) Returns a list of their indices.
+        """
+        cornerblockx = cx * CHUNK_WIDTH_IN_BLOCKS
+        cornerblockz = cz * CHUNK_WIDTH_IN_BLOCKS
+        x, z, viewrange = self.x[start:stop], self.z[start:stop], self.viewrange[start:stop]
+        drawn = ( (self.drawcancelled[start:stop] == False) &
+                  (cornerblockx - viewrange <= x) & (x < cornerblockx + CHUNK_WIDTH_IN_BLOCKS + viewrange) &
+                  (cornerblockz - viewrange <= z) & (z < cornerblockz + CHUNK_WIDTH_IN_BLOCKS + viewrange) )
+        return (numpy.flatnonzero(drawn) + start).tolist()
+
+    def getLandmark(self, ix):
+        """
+        Make a standalone Landmark for spawn point ix, for when you really do want one.
+        """
+        lm = copy.copy( self.landmarklist[ self.typeix[ix] ] )
+        lm.setPos( int(self.x[ix]), int(self.z[ix]), int(self.y[ix]) )
+        return lm
+
+
+class LandmarkSpawner(object):
+    """
+    Where the landmarks of a LandmarkGenerator spawn, region by region, and which of them touch each chunk.
+    This is everything about a LandmarkGenerator but the drawing, so it doesn't need an input layer.
+
+    Each region gets density spawn points, between rangebottom and rangetop, each one a landmark picked from
+    landmarklist. If statelessrng is True, spawn points are hashed from the seed with the noise module rather
+    than drawn from the random module, so each region's spawns can be worked out independently.
+
+    Once a region's spawns are generated, they're indexed under every chunk within the maximum viewrange
+    (rounded up to whole chunks) of where they spawned, so finding the landmarks touching a chunk is a
+    dictionary lookup however big the landmarks are. We keep the spawns and indexes of the
+    regioncachecapacity most recently used regions (None for no limit), and generate a region again if
+    it's needed after that. Its spawns come out the same, but which of them cancelled drawing is forgotten.
     """
     seed = None
     landmarklist = None
     density = None
-    layermask = None
+    rangebottom = None
+    rangetop = None
+    statelessrng = None
 
-    # { dict where key is (rx, rz) and value is {dict where key is (cx, cz) and value is [list of Landmarks ] } }
+    # { LRUCache where key is (rx, rz) and value is the region's SpawnTable }
     worldspawns = None 
+    # { LRUCache where key is (rx, rz) and value is {dict where key is (cx, cz) and value is (tuple of (originchunkx, originchunkz, start, stop))} }
+    # for every chunk within reach of the landmarks spawned in the region.
+    regionfootprints = None
 
-    def __init__(self, inputlayer, seed, landmarklist = [Landmark], density = 200, layermask = None, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS):
+    def __init__(self, seed, landmarklist = [Landmark], density = 200, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS, statelessrng = False,
+                 regioncachecapacity = SPAWN_CACHE_CAPACITY_IN_REGIONS):
         # Input landmark list needs to be doublechecked.
         for lmtype in landmarklist:
             if not issubclass(type(lmtype), Landmark): raise TypeError, "landmarklist must only contain Landmark objects."
-        # We need to enforce that a cachefilter is placed before the handmark generator, for performance purposes.
-        if not issubclass(type(inputlayer), CacheFilter):
-            #print "LandmarkGenerator works much faster with a cachefilter at its input, since it requests chunks multiple times."
-            #print "Screw it, I'm adding one because the performance boost is eightfold."
-            inputlayer = CacheFilter(inputlayer)
-        Filter.__init__(self, inputlayer)
         self.seed = seed
         self.density = density
         self.rangetop = rangetop
         self.rangebottom = rangebottom
-        self.layermask = layermask
         self.landmarklist = landmarklist
+        self.statelessrng = statelessrng
         # This data structure has a lot of indexing structure so we can find relevant points quickly
-        self.worldspawns = {} 
-        self.layermask = layermask
+        self.worldspawns = LRUCache(regioncachecapacity)
+        self.regionfootprints = LRUCache(regioncachecapacity)
 
     def getMaxViewRange(self):
         mvr = 0
@@ -189,80 +367,211 @@ class LandmarkGenerator(Filter):
 
     def getSpawnsInRegion(self, rx, rz):
         # Generate each spawn point and store in regionspawns, otherwise we just get the cached spawnpoints.
-        if not (rx, rz) in self.worldspawns:
-            # Seed the random number gen with all 64 bits of region coordinate data by using both seed and jumpahead
-            random.seed( self.seed ^ ((rx & 0xFFFF0000) | (rz & 0x0000FFFF)) )
-            random.jumpahead( ((rx & 0xFFFF0000) | (rz & 0x0000FFFF)) ) 
+        table = self.worldspawns.get( (rx, rz) )
+        if table is None:
             # First number should be number of points in region
             numspawns = self.density
             rangetop = self.rangetop
             rangebottom = self.rangebottom
-
-            self.worldspawns[ (rx,rz) ] = {}
-            currentregion = self.worldspawns[ (rx,rz) ]
-            for ix in xrange(numspawns):
-                blockx = random.randint( 0, CHUNK_WIDTH_IN_BLOCKS * REGION_WIDTH_IN_CHUNKS - 1 ) + rx * CHUNK_WIDTH_IN_BLOCKS * REGION_WIDTH_IN_CHUNKS
-                blockz = random.randint( 0, CHUNK_WIDTH_IN_BLOCKS * REGION_WIDTH_IN_CHUNKS - 1 ) + rz * CHUNK_WIDTH_IN_BLOCKS * REGION_WIDTH_IN_CHUNKS
-                blocky = random.randint( max(0, rangebottom), min(CHUNK_HEIGHT_IN_BLOCKS - 1, rangetop) ) 
-                currchunkx = blockx / CHUNK_WIDTH_IN_BLOCKS
-                currchunkz = blockz / CHUNK_WIDTH_IN_BLOCKS
-                # We store the points for each chunk indexed by chunk
-                if not (currchunkx, currchunkz) in currentregion:
-                    currentregion[ (currchunkx, currchunkz) ] = []
-                # We make a landmark for each point
-                lmtypeix = random.randint(0, len(self.landmarklist) - 1)
-                lmtype = self.landmarklist[lmtypeix] 
-                #lm = lmtype(self.seed, self.terrainlayer, blockx, blockz, blocky)
-                lm = copy.copy(lmtype)
-                lm.setPos(blockx, blockz, blocky)
-                # Lastly we append the landmark to the chunk
-                currentregion[ (currchunkx, currchunkz) ].append( lm )
-        return self.worldspawns[ (rx,rz) ]
+            regionwidth = CHUNK_WIDTH_IN_BLOCKS * REGION_WIDTH_IN_CHUNKS
+
+            if self.statelessrng:
+                # Hash every spawn point in the region at once.
+                ix = numpy.arange(numspawns)
+                spawnsx = hashrandint(self.seed, NOISE_SPAWNX, 0, regionwidth - 1, rx, rz, ix) + rx * regionwidth
+                spawnsz = hashrandint(self.seed, NOISE_SPAWNZ, 0, regionwidth - 1, rx, rz, ix) + rz * regionwidth
+                spawnsy = hashrandint(self.seed, NOISE_SPAWNY, max(0, rangebottom), min(CHUNK_HEIGHT_IN_BLOCKS - 1, rangetop), rx, rz, ix)
+                typeix = hashrandint(self.seed, NOISE_SPAWNTYPE, 0, len(self.landmarklist) - 1, rx, rz, ix)
+            else:
+                # Seed the random number gen with all 64 bits of region coordinate data by using both seed and jumpahead
+                random.seed( self.seed ^ ((rx & 0xFFFF0000) | (rz & 0x0000FFFF)) )
+                random.jumpahead( ((rx & 0xFFFF0000) | (rz & 0x0000FFFF)) ) 
+                spawns = []
+                for ix in xrange(numspawns):
+                    blockx = random.randint( 0, regionwidth - 1 ) + rx * regionwidth
+                    blockz = random.randint( 0, regionwidth - 1 ) + rz * regionwidth
+                    blocky = random.randint( max(0, rangebottom), min(CHUNK_HEIGHT_IN_BLOCKS - 1, rangetop) ) 
+                    lmtypeix = random.randint(0, len(self.landmarklist) - 1)
+                    spawns.append( (blockx, blockz, blocky, lmtypeix) )
+                spawnsx, spawnsz, spawnsy, typeix = zip(*spawns) if spawns else ([], [], [], [])
+
+            table = SpawnTable(self.landmarklist, spawnsx, spawnsz, spawnsy, typeix)
+            self.worldspawns[ (rx,rz) ] = table
+        return table
         
 
     def getSpawnsInChunk(self, cx, cz):
         """
-        Gets the spawn points for the selected chunk (reading from the appropriate region cache) 
+        Gets the spawn points for the selected chunk (reading from the appropriate region cache), as a
+        (SpawnTable, start, stop) range, or None if there aren't any.
         """
         rx = cx / REGION_WIDTH_IN_CHUNKS
         rz = cz / REGION_WIDTH_IN_CHUNKS
         regionspawns = self.getSpawnsInRegion(rx, rz)
-        if (cx, cz) in regionspawns:
-            return regionspawns[ (cx,cz) ]
+        if (cx, cz) in regionspawns.originchunks:
+            start, stop = regionspawns.originchunks[ (cx,cz) ]
+            return (regionspawns, start, stop)
         else:
             return None
         
 
+    def getChunkViewRange(self):
+        """
+        The maximum view range, rounded up to the nearest chunk multiple.
+        """
+        return (self.getMaxViewRange() + CHUNK_WIDTH_IN_BLOCKS - 1) / CHUNK_WIDTH_IN_BLOCKS # ceiling div
+
+    def getRegionFootprints(self, rx, rz):
+        """
+        Index the spawns in a region by every chunk within reach of their origin chunks, including chunks
+        in neighbouring regions.
+
+        A landmark only gets drawn on the chunks it actually touches (see isLandmarkInChunk), but the
+        ones before it in a chunk's list are what a landmark sees when it looks at other chunks (see
+        LandmarkChain), so we keep all of them.
+        """
+        footprints = self.regionfootprints.get( (rx, rz) )
+        if footprints is None:
+            chunkviewrange = self.getChunkViewRange()
+            footprints = {}
+            for (originchunkx, originchunkz), (start, stop) in self.getSpawnsInRegion(rx, rz).originchunks.iteritems():
+                entry = (originchunkx, originchunkz, start, stop)
+                for chunkx in xrange( originchunkx - chunkviewrange, originchunkx + chunkviewrange + 1 ):
+                    for chunkz in xrange( originchunkz - chunkviewrange, originchunkz + chunkviewrange + 1 ):
+                        if not (chunkx, chunkz) in footprints:
+                            footprints[ (chunkx, chunkz) ] = []
+                        footprints[ (chunkx, chunkz) ].append(entry)
+            footprints = dict( (chunk, tuple(entries)) for (chunk, entries) in footprints.iteritems() )
+            self.regionfootprints[ (rx, rz) ] = footprints
+        return footprints
+
     def getSpawnsTouchingChunk(self, cx, cz):
         """
-        Gets the spawns within the maximum view range for this landmark generator, rounded up
-        to the nearest chunk multiple (for speed of moving the data around.) The landmark generator
-        can check on its own whether it's within rendering range of the chunk.
+        Gets the spawns within the maximum view range of our landmarks, rounded up
+        to the nearest chunk multiple, in the order they get drawn: by origin chunk (x, then z), then in
+        the order they were spawned. They come as a list of (SpawnTable, start, stop) ranges, with ranges
+        that run on from each other merged. Whoever draws them can check on their own whether they're
+        within rendering range of the chunk.
+
+        The list is worked out from the region footprints every time we're asked, rather than kept for
+        every chunk we've ever seen.
         """
-        mvr = self.getMaxViewRange()
-        chunkviewrange = (mvr + CHUNK_WIDTH_IN_BLOCKS - 1) / CHUNK_WIDTH_IN_BLOCKS # ceiling div
+        # Only regions within reach can have spawns touching us; usually that's just our own.
+        chunkviewrange = self.getChunkViewRange()
+        entries = []
+        for rx in xrange( (cx - chunkviewrange) / REGION_WIDTH_IN_CHUNKS, (cx + chunkviewrange) / REGION_WIDTH_IN_CHUNKS + 1 ):
+            for rz in xrange( (cz - chunkviewrange) / REGION_WIDTH_IN_CHUNKS, (cz + chunkviewrange) / REGION_WIDTH_IN_CHUNKS + 1 ):
+                table = self.getSpawnsInRegion(rx, rz)
+                entries.extend( (originchunkx, originchunkz, table, start, stop)
+                                for (originchunkx, originchunkz, start, stop) in self.getRegionFootprints(rx, rz).get( (cx, cz), () ) )
+        entries.sort( key = lambda entry: entry[:2] )
         spawnlist = []
-        for chunkrow in xrange( cx - chunkviewrange, cx + chunkviewrange + 1):
-            for chunkcol in xrange( cz - chunkviewrange, cz + chunkviewrange + 1):
-                chunkspawns = self.getSpawnsInChunk( chunkrow, chunkcol )
-                if chunkspawns != None: spawnlist.extend( chunkspawns )
+        for (originchunkx, originchunkz, table, start, stop) in entries:
+            # neighbouring origin chunks are often next to each other in the table, too.
+            if spawnlist and spawnlist[-1][0] is table and spawnlist[-1][2] == start:
+                spawnlist[-1] = (table, spawnlist[-1][1], stop)
+            else:
+                spawnlist.append( (table, start, stop) )
         return spawnlist
 
+
+class LandmarkGenerator(Filter, LandmarkSpawner):
+    """
+    A chunk generator for a random smattering of landmarks throughout the worldde
+
+    Unless the input is already a CacheFilter, we put one in front of it. cachecapacity and
+    cachemaxbytes limit the size of that cache (see CacheFilter.) Where the landmarks go is up to
+    LandmarkSpawner; see there for the rest of the arguments.
+    """
+    layermask = None
+
+    def __init__(self, inputlayer, seed, landmarklist = [Landmark], density = 200, layermask = None, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS,
+                 cachecapacity = CACHE_CAPACITY_IN_CHUNKS, cachemaxbytes = CACHE_CAPACITY_IN_BYTES, statelessrng = False,
+                 regioncachecapacity = SPAWN_CACHE_CAPACITY_IN_REGIONS):
+        LandmarkSpawner.__init__(self, seed, landmarklist, density, rangebottom, rangetop, statelessrng, regioncachecapacity)
+        # We need to enforce that a cachefilter is placed before the handmark generator, for performance purposes.
+        if not issubclass(type(inputlayer), CacheFilter):
+            #print "LandmarkGenerator works much faster with a cachefilter at its input, since it requests chunks multiple times."
+            #print "Screw it, I'm adding one because the performance boost is eightfold."
+            inputlayer = CacheFilter(inputlayer, cachecapacity, cachemaxbytes)
+        Filter.__init__(self, inputlayer)
+        self.layermask = layermask
+
     def getChunk(self, cx, cz):
         """
-        Add the landmarks to the existing terrain
+        Add the landmarks to the existing terrain: fetch the chunk once, and draw every landmark touching it in turn.
         """
-        # We build a graph of landmarks, then get a chunk from the entire graph.
-        graph = self.inputlayer
         landmarks = self.getSpawnsTouchingChunk(cx,cz)
-        if landmarks == None:
-            return self.inputlayer.getChunk( cx, cz )
-        for mark in landmarks:
-            # insert this landmark at the end of the graph    
-            mark.setInputLayer( graph )
-            graph = mark
-        
-        return graph.getChunk( cx, cz )
+        return LandmarkChain(self.inputlayer, landmarks).getChunk( cx, cz )
+
+
+class OreGenerator(Filter):
+    """
+    Every kind of ore in one filter: deposits of several ores scattered throughout the world, all placed in
+    a single pass over each chunk.
+
+    orespecs is a table with a dictionary for each ore, holding what you'd otherwise give a LandmarkGenerator
+    of CubicOreLandmarks: ore, seed, density (how much of a deposit is ore), sizex, sizez, sizey, spawns (how
+    many deposits per region), rangebottom and rangetop. Anything but ore may be left out.
+
+    The ores come out exactly as they would from a chain of LandmarkGenerators, one per ore in the order given
+    and with the same seeds: where deposits overlap, the last one drawn wins. Ore deposits never look at other
+    chunks, so we don't need a CacheFilter in front of us, and each input chunk is only fetched once.
+
+    Each ore keeps the spawn points of its regioncachecapacity most recently used regions (see
+    LandmarkSpawner), and nothing else, so memory use stays put however much of the world we generate.
+    """
+    orespecs = None
+    statelessrng = None
+    # where each ore's deposits spawn.
+    spawners = None
+
+    specdefaults = {"seed": 0, "density": 0.33, "sizex": 2, "sizez": 2, "sizey": 2, "spawns": 200,
+                    "rangebottom": 0, "rangetop": CHUNK_HEIGHT_IN_BLOCKS}
+
+    def __init__(self, inputlayer, orespecs, statelessrng = False, regioncachecapacity = SPAWN_CACHE_CAPACITY_IN_REGIONS):
+        Filter.__init__(self, inputlayer)
+        self.orespecs = []
+        self.spawners = []
+        for spec in orespecs:
+            if not "ore" in spec: raise RuntimeError, "every ore spec needs an ore"
+            for key in spec:
+                if key != "ore" and not key in self.specdefaults: raise RuntimeError, "unknown ore spec setting: %s" % key
+            fullspec = dict(self.specdefaults)
+            fullspec.update(spec)
+            lmtype = CubicOreLandmark(None, ore = fullspec["ore"], sizex = fullspec["sizex"], sizez = fullspec["sizez"], sizey = fullspec["sizey"],
+                                      density = fullspec["density"], statelessrng = statelessrng)
+            self.orespecs.append(fullspec)
+            self.spawners.append( LandmarkSpawner(fullspec["seed"], landmarklist = [lmtype], density = fullspec["spawns"],
+                                                  rangebottom = fullspec["rangebottom"], rangetop = fullspec["rangetop"],
+                                                  statelessrng = statelessrng, regioncachecapacity = regioncachecapacity) )
+        self.statelessrng = statelessrng
+
+    def getChunk(self, cx, cz):
+        """
+        Gather the blocks of every deposit touching the chunk, in drawing order, and write them all at once.
+        """
+        terrainchunk = self.inputlayer.getChunk(cx, cz)
+        shape = terrainchunk.readBlocks().shape
+        cornerblockx = cx * CHUNK_WIDTH_IN_BLOCKS
+        cornerblockz = cz * CHUNK_WIDTH_IN_BLOCKS
+        indices = []
+        blockids = []
+        for spawner in self.spawners:
+            lmtype = spawner.landmarklist[0]
+            for (table, start, stop) in spawner.getSpawnsTouchingChunk(cx, cz):
+                drawn = table.getSpawnsDrawnInChunk(start, stop, cx, cz)
+                if drawn:
+                    cellindices, cellids = lmtype.getSpawnsScatter(table, drawn, cornerblockx, cornerblockz, shape)
+                    indices.append(cellindices)
+                    blockids.append(cellids)
+        if not indices: return terrainchunk
+        indices = numpy.concatenate(indices)
+        blockids = numpy.concatenate(blockids)
+        # Keep only the last write to each block, like drawing the deposits one after another would.
+        last = len(indices) - 1 - numpy.unique( indices[::-1], return_index = True )[1]
+        terrainchunk.blocks.flat[ indices[last] ] = blockids[last]
+        return terrainchunk
 
 
 
@@ -306,6 +615,8 @@ class StaticTreeLandmark(Landmark):
                     [MAT_TRANSPARENT, MAT_TRANSPARENT, MAT_TRANSPARENT, MAT_LEAVES, MAT_TRANSPARENT, MAT_TRANSPARENT]]
                     ]
 
+    treestamp = Stamp(statictree)
+
     viewrange = max( len(statictree), len(statictree[0]) ) / 2
 
     """
@@ -314,25 +625,34 @@ class StaticTreeLandmark(Landmark):
         """
         Place the tree in this chunk!
         """
+        if not self.placeTree(self.x, self.z, cornerblockx, cornerblockz, terrainchunk, self.inputlayer):
+            self.drawcancelled = True
+
+    def drawSpawn(self, spawns, ix, cornerblockx, cornerblockz, terrainchunk, inputlayer):
+        if not self.placeTree(int(spawns.x[ix]), int(spawns.z[ix]), cornerblockx, cornerblockz, terrainchunk, inputlayer):
+            spawns.drawcancelled[ix] = True
 
+    def placeTree(self, x, z, cornerblockx, cornerblockz, terrainchunk, inputlayer):
+        """
+        Place a tree at x, z in this chunk, if there's dirt or grass to put it on. Returns False if there isn't.
+        """
         # Find our actual Y: place us on the ground.
-        ground = self.findHighestGround()
+        ground = self.findHighestGround(inputlayer = inputlayer, x = x, z = z)
 
         if ground == None:
-            self.drawcancelled = True
-            return 
+            return False
         if ground[1] != MAT_DIRT and ground[1] != MAT_GRASS:
-            self.drawcancelled = True
-            return
+            return False
         
         actualy = ground[0]
         # Write the static array into the map. # TODO: MAKE THIS A FUNCTION
         # offsets of lower north-east corner of the array relative to corner block.
-        offsetx = self.x - cornerblockx - self.viewrange
-        offsetz = self.z - cornerblockz - self.viewrange
+        offsetx = x - cornerblockx - self.viewrange
+        offsetz = z - cornerblockz - self.viewrange
         offsety = actualy 
 
-        self.stampToChunk( self.statictree, terrainchunk.blocks, offsetx, offsetz, offsety )
+        self.stampToChunk( self.treestamp, terrainchunk.blocks, offsetx, offsetz, offsety )
+        return True
 
 
 class CubicOreLandmark(Landmark):
@@ -342,8 +662,10 @@ class CubicOreLandmark(Landmark):
     sizez = None
     sizey = None
     stamp = None
+    statelessrng = None # True to hash the ore placement with the noise module instead of seeding the random module.
 
-    def __init__(self, inputlayer, seed = 0, ore = MAT_DIAMONDORE, x = 0, z = 0, y = 0, sizex = 2, sizez = 2, sizey = 2, density = 0.33):
+    def __init__(self, inputlayer, seed = 0, ore = MAT_DIAMONDORE, x = 0, z = 0, y = 0, sizex = 2, sizez = 2, sizey = 2, density = 0.33,
+                 statelessrng = False):
         
         Landmark.__init__(self, inputlayer, seed, x, z, y)
         self.ore = ore
@@ -353,28 +675,62 @@ class CubicOreLandmark(Landmark):
         self.viewrange = max(sizex, sizez) / 2
         self.stamp = None
         self.density = density
+        self.statelessrng = statelessrng
 
     def editChunk(self, cornerblockx, cornerblockz, terrainchunk):
         """
         Edit the input chunk and add ores.
         """
-        if self.stamp == None:
-            self.stamp = [[[MAT_TRANSPARENT for vert in xrange(self.sizey)] for col in xrange(self.sizez)] for row in xrange(self.sizex)]
-            # Add shit to the stamp here!
-            random.seed( self.seed ^ (( (self.x << 16) & 0xFFFF0000) | ( self.z & 0x0000FFFF)) )
-            random.jumpahead( self.y )
-            for row in self.stamp:
-                for col in row:
-                    for ix in xrange(len(col)) :
-                        if random.random() < self.density:
-                            col[ix] = self.ore
+        if self.stamp is None:
+            self.stamp = self.makeStamp(self.x, self.z, self.y)
         offsetx = self.x - cornerblockx
         offsetz = self.z - cornerblockz
         offsety = self.y
         self.stampToChunk( self.stamp, terrainchunk.blocks, offsetx, offsetz, offsety )
 
+    def drawSpawn(self, spawns, ix, cornerblockx, cornerblockz, terrainchunk, inputlayer):
+        # The stamp is cheap to make again, so we don't keep one for every spawn point.
+        x, z, y = int(spawns.x[ix]), int(spawns.z[ix]), int(spawns.y[ix])
+        self.stampToChunk( self.makeStamp(x, z, y), terrainchunk.blocks, x - cornerblockx, z - cornerblockz, y )
+
+    def getSpawnsScatter(self, spawns, ixs, cornerblockx, cornerblockz, shape):
+        """
+        The ore blocks of spawn points ixs of a SpawnTable, clipped to a block array of the given shape with its
+        corner at cornerblockx, cornerblockz, as (flat indices into that array, block IDs). See Stamp.getScatter.
+
+        With statelessrng we hash every deposit at once rather than making a Stamp for each.
+        """
+        if self.statelessrng:
+            x, z, y = [ values[ixs].reshape( (-1, 1, 1, 1) ) for values in (spawns.x, spawns.z, spawns.y) ]
+            cells = numpy.indices( (self.sizex, self.sizez, self.sizey) )
+            ores = hashrandom(self.seed, NOISE_ORE, x, z, y, cells[0], cells[1], cells[2]) < self.density
+            # where each deposit's ore blocks land, in chunk-space.
+            outx, outz, outy = [ numpy.broadcast_to(cells + offset, ores.shape)[ores] for (cells, offset) in
+                                 zip( cells, (x - cornerblockx, z - cornerblockz, y) ) ]
+            inside = (0 <= outx) & (outx < shape[0]) & (0 <= outz) & (outz < shape[1]) & (0 <= outy) & (outy < shape[2])
+            indices = numpy.ravel_multi_index( (outx[inside], outz[inside], outy[inside]), shape )
+            return indices, numpy.repeat( numpy.array(self.ore, dtype = CHUNK_DTYPE), len(indices) )
+        scatters = [ self.makeStamp(x, z, y).getScatter(shape, x - cornerblockx, z - cornerblockz, y)
+                     for (x, z, y) in zip( spawns.x[ixs].tolist(), spawns.z[ixs].tolist(), spawns.y[ixs].tolist() ) ]
+        return numpy.concatenate( [indices for (indices, blockids) in scatters] ), numpy.concatenate( [blockids for (indices, blockids) in scatters] )
+
+    def makeStamp(self, x, z, y):
+        """
+        Work out which blocks of an ore deposit at x, z, y are ore, as a Stamp.
+        """
+        if self.statelessrng:
+            cells = numpy.indices( (self.sizex, self.sizez, self.sizey) )
+            randoms = hashrandom(self.seed, NOISE_ORE, x, z, y, cells[0], cells[1], cells[2])
+        else:
+            random.seed( self.seed ^ (( (x << 16) & 0xFFFF0000) | ( z & 0x0000FFFF)) )
+            random.jumpahead( y )
+            # one random value per block, row by row, column by column.
+            randoms = numpy.array( [random.random() for ix in xrange(self.sizex * self.sizez * self.sizey)] ).reshape( (self.sizex, self.sizez, self.sizey) )
+        return Stamp( numpy.where(randoms < self.density, self.ore, MAT_TRANSPARENT) )
+
     def __copy__(self):
-        newcopy = CubicOreLandmark(self.inputlayer, self.seed, self.ore, self.x, self.z, self.y, self.sizex, self.sizez, self.sizey, self.density)
+        newcopy = CubicOreLandmark(self.inputlayer, self.seed, self.ore, self.x, self.z, self.y, self.sizex, self.sizez, self.sizey, self.density,
+                                   self.statelessrng)
         newcopy.stamp = copy.deepcopy(self.stamp)
         return newcopy
         
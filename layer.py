@@ -9,12 +9,16 @@ Generator for map-relevant datasets: layers!
 import random
 import math
 import copy
+import numpy
 
 from diamondsquare import * # generates plasma noise
+from noise import * # stateless random numbers
+from lrucache import LRUCache
 from constants import * # stores such cool constants as CHUNK_WIDTH_IN_BLOCKS and MAT_AIR
 
-__all__ = ["Layer", "Filter", "WaterLevelFilter", "TopSoilFilter", "SnowCoverFilter", "CacheFilter",
-            "LayerMask2d", "MaskFilter2d", "BlendMaskFilter2d", "ThresholdMaskFilter2d", "DSLayerMask2d", 
+__all__ = ["Layer", "Filter", "InPlaceFilter", "WaterLevelFilter", "RemapFilter", "fuseRemapFilters", "TopSoilFilter", "SnowCoverFilter", "CacheFilter",
+            "FusedFilter", "compilePipeline",
+            "LayerMask2d", "MaskFilter2d", "MaskExpression", "BlendMaskFilter2d", "ThresholdMaskFilter2d", "CacheMaskFilter2d", "DSLayerMask2d", 
             "HeightMaskRenderFilter"]
 
 #########################################################################
@@ -24,18 +28,34 @@ __all__ = ["Layer", "Filter", "WaterLevelFilter", "TopSoilFilter", "SnowCoverFil
 class Chunk(object):
     """
     Implements a single chunk. Contains block ID's, data, entities, etc.
+
+    blocks and data are contiguous numpy arrays of type CHUNK_DTYPE and shape CHUNK_SHAPE,
+    indexed [x][z][y] (or [x, z, y], which is faster.)
+
+    Chunks handed out by Chunk.view() share their arrays with the original chunk until one of
+    them touches .blocks or .data, at which point that array is copied (copy-on-write.) If you
+    only need to look at the blocks, use readBlocks() and readData() so that nothing gets copied.
+
+    getSurface() gives the height of the highest non-air block in each column. It is only searched
+    for when nobody has told the chunk what it is: fetching .blocks for writing forgets the surface,
+    so filters which write blocks and know how the surface changed should hand it back with
+    setSurface() when they're done.
     """
     cx = None
     cz = None
-    blocks = None
-    data = None
+    blocksshared = False # True if our block array may also belong to another chunk
+    datashared = False # True if our data array may also belong to another chunk
     
     def __init__(self, cx, cz, fillmaterial=MAT_AIR):
         if type(cx) != int or type(cz) != int: raise RuntimeError, "chunk coordinates must be of type int"
+        self._blocks = None
+        self._data = None
+        self._surface = None
         # Passing None to fillmaterial allows us to create an empty chunk, without even block or data arrays. Saves on overhead.
         if fillmaterial != None:
-            self.blocks = [[[fillmaterial for vert in xrange(CHUNK_HEIGHT_IN_BLOCKS)] for row in xrange(CHUNK_WIDTH_IN_BLOCKS)] for col in xrange(CHUNK_WIDTH_IN_BLOCKS)]
-            self.data = [[[0 for vert in xrange(CHUNK_HEIGHT_IN_BLOCKS)] for row in xrange(CHUNK_WIDTH_IN_BLOCKS)] for col in xrange(CHUNK_WIDTH_IN_BLOCKS)]
+            self.blocks = numpy.empty(CHUNK_SHAPE, dtype = CHUNK_DTYPE)
+            self.blocks.fill(fillmaterial)
+            self.data = numpy.zeros(CHUNK_SHAPE, dtype = CHUNK_DTYPE)
         self.cx = cx
         self.cz = cz
 
@@ -46,15 +66,131 @@ class Chunk(object):
         #newchunk.data = copy.deepcopy(self.data)
         #return newchunk
 
+    def getBlocks(self):
+        """
+        Get the block array for writing. Copies the array first if another chunk shares it.
+        """
+        if self.blocksshared:
+            self._blocks = self._blocks.copy()
+            self.blocksshared = False
+        self._surface = None # the caller may change any block, so we can't trust the surface anymore.
+        return self._blocks
+
+    def setBlocks(self, blocks):
+        self._blocks = blocks
+        self.blocksshared = False
+        self._surface = None
+
+    def getData(self):
+        """
+        Get the data array for writing. Copies the array first if another chunk shares it.
+        """
+        if self.datashared:
+            self._data = self._data.copy()
+            self.datashared = False
+        return self._data
+
+    def setData(self, data):
+        self._data = data
+        self.datashared = False
+
+    blocks = property(getBlocks, setBlocks)
+    data = property(getData, setData)
+
+    def readBlocks(self):
+        """
+        Get a read-only view of the block array without copying it.
+        """
+        view = self._blocks.view()
+        view.flags.writeable = False
+        return view
+
+    def readData(self):
+        """
+        Get a read-only view of the data array without copying it.
+        """
+        view = self._data.view()
+        view.flags.writeable = False
+        return view
+
+    def getSurface(self):
+        """
+        Get the height of the highest non-air block in each column as a read-only 16x16 array,
+        indexed [x][z]. Columns which are all air have a height of -1.
+        """
+        if self._surface is None:
+            self.setSurface( findSurface(self._blocks) )
+        return self._surface
+
+    def setSurface(self, surface):
+        """
+        Tell the chunk the height of the highest non-air block in each column, after writing blocks.
+        """
+        surface = numpy.array(surface, dtype = int)
+        surface.flags.writeable = False
+        self._surface = surface
+
+    def view(self):
+        """
+        Get a cheap copy-on-write handle to this chunk. Both this chunk and the handle will
+        copy their arrays the first time they're written to.
+        """
+        self.blocksshared = True
+        self.datashared = True
+        return copy.copy(self)
+
+    def getNBytes(self):
+        nbytes = 0
+        if self._blocks is not None: nbytes += self._blocks.nbytes
+        if self._data is not None: nbytes += self._data.nbytes
+        return nbytes
+
+    nbytes = property(getNBytes)
+
     def copy(self):
         newchunk = copy.copy(self)
-        xlen = len(self.blocks)
-        zlen = len(self.blocks[0])
-        ylen = len(self.blocks[0][0])
-        newchunk.blocks = [[ list(self.blocks[x][z]) for z in xrange( zlen )] for x in xrange( xlen )] 
-        newchunk.data = [[ list(self.data[x][z]) for z in xrange( zlen )] for x in xrange( xlen )] 
+        newchunk.blocks = self._blocks.copy()
+        newchunk.data = self._data.copy()
         return newchunk
 
+def findSurface(blocks, airid = MAT_AIR, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS - 1):
+    """
+    Find the height of the highest block that isn't airid in each column of blocks (columns run along 
+    the last axis), searching only between rangebottom and rangetop (endpoint inclusive.)
+    Columns without any such block get a height of -1.
+    """
+    rangebottom = max(rangebottom, 0)
+    rangetop = min(rangetop, blocks.shape[-1] - 1)
+    solid = blocks[..., rangebottom:rangetop + 1] != airid
+    if solid.shape[-1] == 0:
+        return numpy.zeros(blocks.shape[:-1], dtype = int) - 1
+    surface = rangetop - numpy.argmax(solid[..., ::-1], axis = -1)
+    return numpy.where(solid.any(axis = -1), surface, -1)
+
+def findGround(blocks, airid = MAT_AIR, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS - 1, surface = None):
+    """
+    For every column of blocks that has an airid block at rangetop, find the first block that isn't airid
+    working downward from rangetop (but no lower than rangebottom.) Returns an array of heights, one per
+    column, with -1 for columns that are solid at rangetop or have nothing but air in range.
+
+    If you already know the surface of blocks (see Chunk.getSurface()), pass it in to save a search.
+    """
+    if airid == MAT_AIR and surface is not None:
+        ground = surface
+    else:
+        ground = findSurface(blocks, airid)
+    floating = ground > rangetop
+    if floating.any(): # something is floating above rangetop, so search below it.
+        ground = numpy.where(floating, findSurface(blocks, airid, rangebottom, rangetop), ground)
+    ground = numpy.where(ground < rangebottom, -1, ground)
+    return numpy.where(blocks[..., rangetop] == airid, ground, -1)
+
+def pickColumns(blocks, heights):
+    """
+    Pick out one block from each column of blocks: the one at heights (which has one entry per column.)
+    """
+    return blocks[ tuple(numpy.indices(heights.shape)) + (heights,) ]
+
 class Layer(object):
     """
     Implements a layer of minecraft blocks 
@@ -62,6 +198,21 @@ class Layer(object):
     def getChunk(self, cx, cz):
         return Chunk(cx, cz)
 
+    def getChunks(self, cx0, cz0, cx1, cz1):
+        """
+        Get the blocks of every chunk from (cx0, cz0) up to (but not including) (cx1, cz1) as one array,
+        indexed [cx - cx0, cz - cz0, x, z, y]. Only the block arrays come back, not data or surfaces.
+
+        This asks getChunk() for each chunk in turn. Subclasses which can do better by working on the
+        whole rectangle at once should override it.
+        """
+        if cx1 < cx0 or cz1 < cz0: raise RuntimeError, "chunk rectangle must not be inside out"
+        blocks = numpy.empty( (cx1 - cx0, cz1 - cz0) + CHUNK_SHAPE, dtype = CHUNK_DTYPE )
+        for cx in xrange(cx0, cx1):
+            for cz in xrange(cz0, cz1):
+                blocks[cx - cx0, cz - cz0] = self.getChunk(cx, cz).readBlocks()
+        return blocks
+
 class Filter(Layer):
     """
     Implements a layer which draws chunk block from its input and outputs chunk block data.
@@ -94,7 +245,40 @@ class Filter(Layer):
         self.inputlayer = inputlayer
 
 
-class WaterLevelFilter(Filter):
+class InPlaceFilter(Filter):
+    """
+    A filter which edits each chunk it pulls from its input, without looking at any other chunks.
+
+    Override InPlaceFilter.processChunk() rather than getChunk(). That lets compilePipeline() run
+    several of these filters back to back on one chunk, without going through their input layers.
+    Override processChunks() too if your filter can edit a whole stack of chunks at once.
+    """
+    def getChunk(self, cx, cz):
+        return self.processChunk( self.inputlayer.getChunk(cx, cz) )
+
+    def getChunks(self, cx0, cz0, cx1, cz1):
+        return self.processChunks( self.inputlayer.getChunks(cx0, cz0, cx1, cz1), cx0, cz0 )
+
+    def processChunk(self, chunk):
+        """
+        Sample filter: return the chunk untouched.
+        """
+        return chunk
+
+    def processChunks(self, blocks, cx0, cz0):
+        """
+        Edit a stack of chunk blocks from Layer.getChunks() in place, and return it. blocks[0, 0] belongs
+        to chunk (cx0, cz0). By default we run processChunk() on each chunk of the stack in turn.
+        """
+        for ix in xrange(blocks.shape[0]):
+            for iz in xrange(blocks.shape[1]):
+                chunk = Chunk(cx0 + ix, cz0 + iz, fillmaterial = None)
+                chunk.blocks = blocks[ix, iz]
+                chunk.data = numpy.zeros(CHUNK_SHAPE, dtype = CHUNK_DTYPE)
+                blocks[ix, iz] = self.processChunk(chunk).readBlocks()
+        return blocks
+
+class WaterLevelFilter(InPlaceFilter):
     """
     A filter that does a find-replace of all blocks within a certain height range (endpoint inclusive)
     """
@@ -109,18 +293,177 @@ class WaterLevelFilter(Filter):
         self.findid = findid
         self.replaceid = replaceid
 
-    def getChunk(self, cx, cz):
-        chunk = self.inputlayer.getChunk(cx, cz)
+    def processChunk(self, chunk):
+        surface = chunk.getSurface()
+        surface = self.processBlocks(chunk.blocks, surface)
+        if surface is not None: chunk.setSurface(surface)
+        return chunk
+
+    def processChunks(self, blocks, cx0, cz0):
+        self.processBlocks(blocks, None)
+        return blocks
+
+    def processBlocks(self, blocks, surface):
+        """
+        Do the find-replace on blocks in place. blocks may be one chunk's blocks or a whole stack of them.
+        Returns the new surface of blocks, or None if we can't tell what it is without searching.
+        """
         findid = self.findid
         replaceid = self.replaceid
-        for row in chunk.blocks:
-            for col in row:
-                for ix in xrange(self.rangebottom, min( len(col), self.rangetop + 1) ):
-                    if col[ix] == findid:
-                        col[ix] = self.replaceid
-        return chunk 
+        # One masked store over the whole slab of blocks between rangebottom and rangetop
+        slab = blocks[..., max(self.rangebottom, 0):min(max(self.rangetop + 1, 0), CHUNK_HEIGHT_IN_BLOCKS)]
+        slab[slab == findid] = replaceid
+        # Keep the surface up to date. Replacing air fills the whole range with solid blocks.
+        if replaceid == MAT_AIR or surface is None: return None
+        if findid == MAT_AIR and slab.shape[-1] > 0:
+            surface = numpy.maximum(surface, min(self.rangetop, CHUNK_HEIGHT_IN_BLOCKS - 1))
+        return surface
+
+    def getRemapRules(self):
+        """
+        Get this filter's find-replace as a list of RemapFilter rules.
+        """
+        return [ (self.rangebottom, self.rangetop, self.findid, self.replaceid) ]
+
+class RemapFilter(InPlaceFilter):
+    """
+    A filter that applies a list of find-replace rules, each within its own height range (endpoint inclusive.)
+
+    rules is a list of (rangebottom, rangetop, findid, replaceid) tuples, applied in order, so
+    RemapFilter(layer, [ruleA, ruleB]) gives the same chunk as two WaterLevelFilters applying ruleA, then ruleB.
+
+    The rules are compiled into one lookup table per band of heights. Bands where only a few block types
+    change are written with one masked store per (findid, replaceid) pair, spanning every band that
+    shares it. Bands where lots of block types change are pushed through their lookup table in one pass.
+    """
+    rules = None
+    tables = None # list of (bottom, top, lookup table), top exclusive.
+    stores = None # list of (bottom, top, height mask or None, findid, replaceid), top exclusive.
+    clearsblocks = None # True if any rule turns a solid block into air
+    filledtop = None # the highest height at which a rule turns air solid
+    def __init__(self, inputlayer, rules):
+        super(RemapFilter, self).__init__(inputlayer)
+        self.rules = list(rules)
+        # Cut the chunk into bands wherever a rule starts or stops
+        edges = set([0, CHUNK_HEIGHT_IN_BLOCKS])
+        for (rangebottom, rangetop, findid, replaceid) in self.rules:
+            edges.add( min(max(rangebottom, 0), CHUNK_HEIGHT_IN_BLOCKS) )
+            edges.add( min(max(rangetop + 1, 0), CHUNK_HEIGHT_IN_BLOCKS) )
+        edges = sorted(edges)
+        identity = numpy.arange(256, dtype = CHUNK_DTYPE)
+        self.tables = []
+        storeheights = {} # { (findid, replaceid): boolean array over all heights }
+        self.clearsblocks = False
+        self.filledtop = -1
+        for bottom, top in zip(edges[:-1], edges[1:]):
+            # Chain every rule that covers this band into a single lookup table.
+            lut = identity.copy()
+            for (rangebottom, rangetop, findid, replaceid) in self.rules:
+                if rangebottom <= bottom and top - 1 <= rangetop:
+                    lut[lut == findid] = replaceid
+            changed = numpy.flatnonzero(lut != identity)
+            if len(changed) == 0: continue
+            # Turning air solid fills a whole band, but turning solid blocks to air could expose anything below.
+            if (lut[ identity != MAT_AIR ] == MAT_AIR).any():
+                self.clearsblocks = True
+            elif lut[MAT_AIR] != MAT_AIR:
+                self.filledtop = max(self.filledtop, top - 1)
+            if len(changed) > 4:
+                self.tables.append( (bottom, top, lut) )
+                continue
+            for findid in changed:
+                key = (int(findid), int(lut[findid]))
+                if not key in storeheights:
+                    storeheights[key] = numpy.zeros(CHUNK_HEIGHT_IN_BLOCKS, dtype = bool)
+                storeheights[key][bottom:top] = True
+        self.stores = []
+        for (findid, replaceid), heights in sorted(storeheights.items()):
+            inrange = numpy.flatnonzero(heights)
+            bottom, top = inrange[0], inrange[-1] + 1
+            heightmask = heights[bottom:top]
+            if heightmask.all(): heightmask = None
+            self.stores.append( (bottom, top, heightmask, findid, replaceid) )
+
+    def getRemapRules(self):
+        return list(self.rules)
+
+    def processChunk(self, chunk):
+        if not self.stores and not self.tables: return chunk
+        surface = chunk.getSurface()
+        surface = self.processBlocks(chunk.blocks, surface)
+        if surface is not None: chunk.setSurface(surface)
+        return chunk
 
-class TopSoilFilter(Filter):
+    def processChunks(self, blocks, cx0, cz0):
+        self.processBlocks(blocks, None)
+        return blocks
+
+    def processBlocks(self, blocks, surface):
+        """
+        Apply the rules to blocks in place. blocks may be one chunk's blocks or a whole stack of them.
+        Returns the new surface of blocks, or None if we can't tell what it is without searching.
+        """
+        # Find everything first, so one replacement can't be picked up by the next.
+        masks = []
+        for (bottom, top, heightmask, findid, replaceid) in self.stores:
+            mask = blocks[..., bottom:top] == findid
+            if heightmask is not None: mask &= heightmask
+            masks.append(mask)
+        for (bottom, top, heightmask, findid, replaceid), mask in zip(self.stores, masks):
+            blocks[..., bottom:top][mask] = replaceid
+        for (bottom, top, lut) in self.tables:
+            slab = blocks[..., bottom:top]
+            lut.take(slab, out = slab)
+        # Keep the surface up to date.
+        if self.clearsblocks or surface is None: return None
+        return numpy.maximum(surface, self.filledtop)
+
+def isRemapFilter(layer):
+    """
+    Can layer be folded into a RemapFilter?
+    """
+    return isinstance(layer, (WaterLevelFilter, RemapFilter))
+
+def mergeRemapFilters(inputlayer, run):
+    """
+    Make a single RemapFilter reading from inputlayer which does the work of run, a list of
+    WaterLevelFilters and RemapFilters in pipeline order (upstream first.)
+    """
+    rules = []
+    for remapper in run:
+        rules.extend( remapper.getRemapRules() )
+    return RemapFilter(inputlayer, rules)
+
+def fuseRemapFilters(layer):
+    """
+    Collapse every run of adjacent WaterLevelFilters and RemapFilters in the pipeline ending at layer
+    into a single RemapFilter, so N passes over each chunk become one.
+
+    The pipeline is rewired in place. Returns the new end of the pipeline, which is a new filter if
+    layer itself was part of a run.
+    """
+    output = layer
+    downstream = None
+    node = layer
+    while isinstance(node, Layer):
+        if isRemapFilter(node):
+            run = []
+            while isRemapFilter(node):
+                run.append(node)
+                node = node.inputlayer
+            if len(run) > 1:
+                fused = mergeRemapFilters(node, run[::-1]) # upstream filters go first
+                if downstream is None: output = fused
+                else: downstream.setInputLayer(fused)
+                downstream = fused
+            else:
+                downstream = run[0]
+            continue
+        downstream = node
+        node = getattr(node, "inputlayer", None)
+    return output
+
+class TopSoilFilter(InPlaceFilter):
     """
     A filter for replacing the top layer of a material with another
     """
@@ -132,6 +475,7 @@ class TopSoilFilter(Filter):
     airid = None
     def __init__(self, inputlayer, rangebottom = 0, rangetop = CHUNK_HEIGHT_IN_BLOCKS - 1, findid = MAT_STONE, replaceid = MAT_DIRT, thickness = 4, airid = MAT_AIR):
         super(TopSoilFilter, self).__init__(inputlayer)
+        if findid == airid: raise RuntimeError, "findid must not be the same as airid"
         self.rangebottom = rangebottom
         self.rangetop = rangetop
         self.findid = findid
@@ -139,37 +483,43 @@ class TopSoilFilter(Filter):
         self.thickness = thickness
         self.airid = airid
 
-    def getChunk(self, cx, cz):
-        chunk = self.inputlayer.getChunk(cx, cz)
+    def processChunk(self, chunk):
         if self.thickness == 0: return chunk # passthru if we're not adding anything for some reason
-        airid = self.airid
-        findid = self.findid
-        replaceid = self.replaceid
-        thickness = self.thickness
-        rangetop = self.rangetop
-        rangebottom = self.rangebottom
-        workingrange = range(self.rangebottom, self.rangetop + 1)
-        workingrange.reverse()
-        for row in chunk.blocks:
-            for col in row: # for all vertical columns:
-                # first block must be an air block
-                if col[rangetop] != airid: continue
-                # work downward and replace only self.thickness of the blocks.
-                for hix in workingrange:
-                    element = col[hix]
-                    if element == findid:
-                        if thickness > 0: # replace blocks 
-                            #col[max(hix-thickness+1, 0):hix+1] = replaceid
-                            for i in xrange( max(hix-thickness+1, 0), hix+1 ):
-                                col[i] = replaceid
-                        elif self.thickness < 0: # cake over with blocks
-                            for i in xrange( hix+1, min(hix-thickness+1,CHUNK_HEIGHT_IN_BLOCKS) ):
-                                col[i] = replaceid
-                    if element != airid: break # we search only through the air
-
+        surface = chunk.getSurface()
+        surface = self.processBlocks(chunk.blocks, surface)
+        if surface is not None: chunk.setSurface(surface)
         return chunk # put
 
-class SnowCoverFilter(Filter):
+    def processChunks(self, blocks, cx0, cz0):
+        if self.thickness == 0: return blocks
+        self.processBlocks(blocks, None)
+        return blocks
+
+    def processBlocks(self, blocks, surface):
+        """
+        Lay the top soil on blocks in place. blocks may be one chunk's blocks or a whole stack of them.
+        Returns the new surface of blocks, or None if we can't tell what it is without searching.
+        """
+        replaceid = self.replaceid
+        thickness = self.thickness
+        # the first block we hit working downward from rangetop is the only one we replace.
+        ground = findGround(blocks, self.airid, self.rangebottom, self.rangetop, surface)
+        found = (ground >= 0) & (pickColumns(blocks, ground) == self.findid)
+        # Build the band of blocks to replace in every column at once, and write it in one go.
+        top = ground[..., numpy.newaxis]
+        y = numpy.arange(CHUNK_HEIGHT_IN_BLOCKS)
+        if thickness > 0: # replace blocks
+            band = (top - thickness < y) & (y <= top)
+        else: # cake over with blocks
+            band = (top < y) & (y <= top - thickness)
+            if surface is not None:
+                surface = numpy.maximum(surface, numpy.where(found, numpy.minimum(ground - thickness, CHUNK_HEIGHT_IN_BLOCKS - 1), -1))
+        band &= found[..., numpy.newaxis]
+        blocks[band] = replaceid
+        if replaceid == MAT_AIR: return None
+        return surface
+
+class SnowCoverFilter(InPlaceFilter):
     """
     A filter for replacing the top layer of a material with another
     """
@@ -186,58 +536,153 @@ class SnowCoverFilter(Filter):
         self.thickness = thickness
         self.airid = airid
 
-    def getChunk(self, cx, cz):
-        chunk = self.inputlayer.getChunk(cx, cz)
-
+    def processChunk(self, chunk):
         if self.thickness <= 0: return chunk # passthru if we're not adding anything for some reason
-        # Pull out variables that don't change with iteration
-        airid = self.airid
+        surface = chunk.getSurface()
+        surface = self.processBlocks(chunk.blocks, surface)
+        if surface is not None: chunk.setSurface(surface)
+        return chunk
+
+    def processChunks(self, blocks, cx0, cz0):
+        if self.thickness <= 0: return blocks
+        self.processBlocks(blocks, None)
+        return blocks
+
+    def processBlocks(self, blocks, surface):
+        """
+        Snow over blocks in place. blocks may be one chunk's blocks or a whole stack of them.
+        Returns the new surface of blocks, or None if we can't tell what it is without searching.
+        """
         thickness = self.thickness
         snowid = self.snowid
-        rangetop = self.rangetop
-        rangebottom = self.rangebottom
-        workingrange = range(rangebottom, rangetop + 1)
-        workingrange.reverse()
-        for row in chunk.blocks:
-            for col in row: # for all vertical columns:
-                # first block must be an air block
-                if col[rangetop] != airid: continue
-                # work downward and replace only self.thickness of the blocks.
-                for hix in workingrange:           
-                    if col[hix] != airid:  # we search only through the air
-                        for i in xrange(hix+1, hix+1+thickness):
-                            col[i] = snowid
-                        break
-
-        return chunk
+        # snow goes on top of the first block we hit working downward from rangetop.
+        ground = findGround(blocks, self.airid, self.rangebottom, self.rangetop, surface)
+        found = ground >= 0
+        top = ground[..., numpy.newaxis]
+        y = numpy.arange(CHUNK_HEIGHT_IN_BLOCKS)
+        band = (top < y) & (y <= top + thickness) & found[..., numpy.newaxis]
+        blocks[band] = snowid
+        if snowid == MAT_AIR or surface is None: return None
+        return numpy.maximum(surface, numpy.where(found, numpy.minimum(ground + thickness, CHUNK_HEIGHT_IN_BLOCKS - 1), -1))
 
 class CacheFilter(Filter):
     """
     Implements a caching passthru filter.
 
     If the input chunk has already been requested and cached, we just pull from the cache.
+    The cache holds at most capacity chunks and maxbytes bytes of chunk data (None for no limit),
+    and throws away the least recently used chunks first.
 
     inputlayer must either be a Layer, a subclass of Layer, or None (in which case you will need to
     set the inputlayer later.)
     """
     cache = None
-    def __init__(self, inputlayer):
+    def __init__(self, inputlayer, capacity = CACHE_CAPACITY_IN_CHUNKS, maxbytes = CACHE_CAPACITY_IN_BYTES):
         Filter.__init__(self, inputlayer)
-        self.cache = {}
+        self.cache = LRUCache(capacity, maxbytes)
 
     def getChunk(self, cx, cz):
         """
-        Sample filter: act as a pass-through filter.
+        Pull the chunk from the cache, or from the input layer if we haven't cached it yet.
+
+        We hand out copy-on-write views of the cached chunk, so the cached arrays are only
+        copied if the caller actually writes to them.
+        """
+        cachedchunk = self.cache.get( (cx,cz) )
+        if cachedchunk is None:
+            cachedchunk = self.inputlayer.getChunk(cx, cz)
+            cachedchunk.getSurface() # so every view of the chunk shares the same surface
+            self.cache[ (cx,cz) ] = cachedchunk
+        return cachedchunk.view()
+
+    def getStats(self):
+        """
+        Get the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.getStats()
+
+class FusedFilter(InPlaceFilter):
+    """
+    Runs a list of InPlaceFilters back to back on each chunk pulled from the input layer, without
+    going through the filters' own input layers. compilePipeline() builds these for you.
+    """
+    stages = None
+    def __init__(self, inputlayer, stages):
+        super(FusedFilter, self).__init__(inputlayer)
+        for stage in stages:
+            if not issubclass(type(stage), InPlaceFilter): raise RuntimeError, "stages of a fused filter must be InPlaceFilters"
+        self.stages = list(stages)
+
+    def processChunk(self, chunk):
+        for stage in self.stages:
+            chunk = stage.processChunk(chunk)
+        return chunk
+
+    def processChunks(self, blocks, cx0, cz0):
+        for stage in self.stages:
+            blocks = stage.processChunks(blocks, cx0, cz0)
+        return blocks
+
+def compilePipeline(layer):
+    """
+    Optimize the pipeline ending at layer, and return the new end of the pipeline:
+    - passthrough Filters are removed.
+    - a CacheFilter feeding straight into another CacheFilter is merged with it.
+    - WaterLevelFilters and RemapFilters next to each other are fused into one RemapFilter.
+    - runs of InPlaceFilters are replaced by a single FusedFilter.
+
+    The pipeline is rewired in place, so only use the returned layer afterwards.
+    """
+    # Flatten the pipeline into a list, output first. 
+    chain = []
+    node = layer
+    while issubclass(type(node), Layer):
+        chain.append(node)
+        node = getattr(node, "inputlayer", None)
+    if not chain: raise RuntimeError, "can only compile pipelines of layers"
+
+    def flush(upstream, run):
+        """
+        Connect a run of InPlaceFilters to upstream and return the end of the run.
         """
-        if not (cx, cz) in self.cache:
-            passchunk = self.inputlayer.getChunk(cx, cz)
-            #savechunk = copy.copy(passchunk)
-            savechunk = passchunk.copy()
-            self.cache[ (cx,cz) ] = savechunk
-            return passchunk
-        else:
-            #return copy.copy(self.cache[ (cx,cz) ] )
-            return self.cache[ (cx,cz) ].copy()
+        stages = []
+        remaps = [] # the run of remapping filters we're in the middle of
+        for stage in run + [None]:
+            if isRemapFilter(stage):
+                remaps.append(stage)
+                continue
+            if len(remaps) > 1: stages.append( mergeRemapFilters(None, remaps) )
+            else: stages.extend(remaps)
+            remaps = []
+            if stage is not None: stages.append(stage)
+        if not stages:
+            return upstream
+        if len(stages) == 1:
+            stages[0].setInputLayer(upstream)
+            return stages[0]
+        return FusedFilter(upstream, stages)
+
+    # Rebuild the pipeline from the source onwards.
+    upstream = chain.pop()
+    run = []
+    while chain:
+        node = chain.pop()
+        if type(node) == Filter: continue # passthrough
+        if isinstance(node, InPlaceFilter):
+            run.append(node)
+            continue
+        upstream = flush(upstream, run)
+        run = []
+        if isinstance(node, CacheFilter) and isinstance(upstream, CacheFilter):
+            # one cache is plenty, as long as it's as big as both of them.
+            for limit in ("capacity", "maxbytes"):
+                ours, theirs = getattr(node.cache, limit), getattr(upstream.cache, limit)
+                if ours is None or theirs is None: setattr(upstream.cache, limit, None)
+                else: setattr(upstream.cache, limit, max(ours, theirs))
+            continue
+        node.setInputLayer(upstream)
+        upstream = node
+    return flush(upstream, run)
 
 #########################################################################
 # LayersMask2d and MaskFilter2d: output chunk heightmap data (a chunk-sized 2d array of values from 0.0 to 1.0)
@@ -248,19 +693,70 @@ class LayerMask2d(object):
     A 2d layer mask of height values (between 0.0 and 1.0). Can double as a terrain heightmap.
 
     You can seed this LayerMask2d with initial data, or just leave it blank.
+
+    getChunkHeights() always hands back a CHUNK_WIDTH_IN_BLOCKS x CHUNK_WIDTH_IN_BLOCKS numpy array of
+    floats, indexed [x][z], so masks can be mixed and matched freely. It might be cached (and read-only),
+    so don't write into it; make a copy if you need to change it.
     """
     initialdata = None
     def __init__(self, initialdata = None):
         if initialdata is not None:
             assert( len(initialdata) == CHUNK_WIDTH_IN_BLOCKS)
             assert(len(initialdata[0]) == CHUNK_WIDTH_IN_BLOCKS)
-            self.initialdata = initialdata
+            self.initialdata = numpy.array(initialdata, dtype = float)
+            self.initialdata.flags.writeable = False # we hand it out for every chunk, so nobody gets to change it
 
     def getChunkHeights(self, cx, cz):
         if self.initialdata is not None: 
             return self.initialdata
         return numpy.ones( [CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS] )
 
+    def getChunksHeights(self, cx0, cz0, cx1, cz1):
+        """
+        Get the heightmaps of every chunk from (cx0, cz0) up to (but not including) (cx1, cz1) as one
+        float array, indexed [cx - cx0, cz - cz0, x, z].
+
+        This asks getChunkHeights() for each chunk in turn. Subclasses which can do better by working on
+        the whole rectangle at once should override it.
+        """
+        if cx1 < cx0 or cz1 < cz0: raise RuntimeError, "chunk rectangle must not be inside out"
+        heights = numpy.empty( (cx1 - cx0, cz1 - cz0, CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        for cx in xrange(cx0, cx1):
+            for cz in xrange(cz0, cz1):
+                heights[cx - cx0, cz - cz0] = self.getChunkHeights(cx, cz)
+        return heights
+
+    # Arithmetic on masks doesn't compute anything straight away; it builds a MaskExpression.
+    def __add__(self, other): return MaskExpression(numpy.add, [self, other])
+    def __radd__(self, other): return MaskExpression(numpy.add, [other, self])
+    def __sub__(self, other): return MaskExpression(numpy.subtract, [self, other])
+    def __rsub__(self, other): return MaskExpression(numpy.subtract, [other, self])
+    def __mul__(self, other): return MaskExpression(numpy.multiply, [self, other])
+    def __rmul__(self, other): return MaskExpression(numpy.multiply, [other, self])
+    def __div__(self, other): return MaskExpression(numpy.true_divide, [self, other])
+    def __rdiv__(self, other): return MaskExpression(numpy.true_divide, [other, self])
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+    def __neg__(self): return MaskExpression(numpy.negative, [self])
+
+    def minimum(self, other):
+        """
+        The lower of this mask and other (a mask or a number) at each block.
+        """
+        return MaskExpression(numpy.minimum, [self, other])
+
+    def maximum(self, other):
+        """
+        The higher of this mask and other (a mask or a number) at each block.
+        """
+        return MaskExpression(numpy.maximum, [self, other])
+
+    def clip(self, bottom = 0.0, top = 1.0):
+        """
+        This mask, limited to between bottom and top (masks or numbers.)
+        """
+        return MaskExpression(numpy.clip, [self, bottom, top])
+
 class MaskFilter2d(LayerMask2d):
     """
     Implements a layer which draws data from its inputs and outputs a 2D LayerMask2d.
@@ -278,12 +774,104 @@ class MaskFilter2d(LayerMask2d):
         """
         return self.inputlayer.getChunkHeights(cx, cz)
 
-class BlendMaskFilter2d(LayerMask2d):
+class MaskExpression(LayerMask2d):
+    """
+    A LayerMask2d worked out from other masks (and numbers), like the ones you get by doing arithmetic
+    on masks:
+    >> terrain = (roughterrain * 0.75 + smoothterrain * 0.25).clip(0.0, 1.0)
+
+    Nothing gets computed until you ask for some heights. Then the whole expression is worked out in one
+    go: every mask in it is asked for its heights once, even if it's used in several places, and
+    intermediate results get overwritten in place by the next operation once nothing else needs them.
+    getChunksHeights() works out the expression over a whole rectangle of chunks at once.
+
+    operation is a numpy function (like numpy.add) which is handed the operands' heights (or the operands
+    themselves, for numbers) and an out= array. Subclasses can override getOperands() and applyOperation()
+    to do something fancier. applyOperation() must cope with out being one of its operands.
+    """
+    operation = None
+    operands = None
+    def __init__(self, operation, operands):
+        for operand in operands:
+            assert ( issubclass(type(operand), LayerMask2d) or isinstance(operand, (int, long, float)) )
+        self.operation = operation
+        self.operands = list(operands)
+
+    def getOperands(self):
+        """
+        Get the masks and numbers this expression is worked out from.
+        """
+        return self.operands
+
+    def applyOperation(self, values, out = None):
+        """
+        Work out this expression given its operands' values (arrays of heights for masks, as is for numbers.)
+        """
+        return self.operation(*values, out = out)
+
+    def getChunkHeights(self, cx, cz, out = None):
+        """
+        Work out the expression for a chunk. If out is given, the heights are written into it (and it's returned.)
+        """
+        return self.evaluate(lambda mask: mask.getChunkHeights(cx, cz), out)
+
+    def getChunksHeights(self, cx0, cz0, cx1, cz1, out = None):
+        if cx1 < cx0 or cz1 < cz0: raise RuntimeError, "chunk rectangle must not be inside out"
+        return self.evaluate(lambda mask: mask.getChunksHeights(cx0, cz0, cx1, cz1), out)
+
+    def evaluate(self, getheights, out = None):
+        """
+        Work out the whole expression, calling getheights(mask) for the heights of every mask in it which
+        isn't itself a MaskExpression.
+        """
+        # Find every node in the expression, operands before the expressions using them, and count how many
+        # times each one gets used.
+        order = []
+        uses = {}
+        def visit(node):
+            if id(node) in uses:
+                uses[id(node)] += 1
+                return
+            uses[id(node)] = 1
+            if isinstance(node, MaskExpression):
+                for operand in node.getOperands():
+                    if isinstance(operand, LayerMask2d):
+                        visit(operand)
+            order.append(node)
+        visit(self)
+
+        results = {}
+        scratch = set() # results we made ourselves, and so are free to overwrite
+        for node in order:
+            if not isinstance(node, MaskExpression):
+                results[id(node)] = getheights(node) # might be cached, so never written to
+                continue
+            operands = node.getOperands()
+            values = [ results[id(operand)] if isinstance(operand, LayerMask2d) else operand for operand in operands ]
+            nodeout = None
+            for operand in operands:
+                if isinstance(operand, LayerMask2d):
+                    uses[id(operand)] -= 1
+            if node is self:
+                nodeout = out
+            else:
+                for operand in operands:
+                    if id(operand) in scratch and uses[id(operand)] == 0:
+                        nodeout = results[id(operand)] # nobody else needs it, so overwrite it.
+                        scratch.discard(id(operand))
+                        break
+            results[id(node)] = node.applyOperation(values, nodeout)
+            scratch.add(id(node))
+        return results[id(self)]
+
+class BlendMaskFilter2d(MaskExpression):
     """
     Blends two input LayerMask2ds given either an alphamask or a blendscale.
     
     Blendscale slides the blending between the two layers. If blendscale is closer
     to 0.0, firstlayer is more prominent. if 1.0, secondlayer is more prominent.
+
+    It's a MaskExpression, so it can be mixed in with mask arithmetic, and getChunkHeights() takes an out= array.
     """
     firstlayer = None
     secondlayer = None
@@ -300,29 +888,29 @@ class BlendMaskFilter2d(LayerMask2d):
         self.alphamask = alphamask
         self.blendscale = blendscale
 
-    def getChunkHeights(self, cx, cz):
+    def getOperands(self):
+        if self.alphamask is not None:
+            return [self.firstlayer, self.secondlayer, self.alphamask]
+        return [self.firstlayer, self.secondlayer, self.blendscale]
+
+    def applyOperation(self, values, out = None):
+        return self.blendHeights(values[0], values[1], values[2], out)
+
+    def blendHeights(self, firstheights, secondheights, alpha, out = None):
         """
-        Blend two input LayerMask2ds given either an alphamask or a blendscale.
+        first * (1 - alpha) + second * alpha, for arrays of heights of any shape. alpha may be an array or a float.
         """
-        firstheights = self.firstlayer.getChunkHeights(cx, cz)
-        secondheights = self.secondlayer.getChunkHeights(cx, cz)
-        if self.alphamask is not None:
-            alphaheights = self.alphamask.getChunkHeights(cx, cz)
-            outarr = [[-1.0 for z in xrange(CHUNK_WIDTH_IN_BLOCKS)] for x in xrange(CHUNK_WIDTH_IN_BLOCKS)]
-            for x in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                for z in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                    outarr[x][z] = firstheights[x][z] * (1.0 - alphaheights[x][z]) + secondheights[x][z] * alphaheights[x][z]
-            return outarr
-        else:
-            outarr = [[-1.0 for z in xrange(CHUNK_WIDTH_IN_BLOCKS)] for x in xrange(CHUNK_WIDTH_IN_BLOCKS)]
-            for x in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                for z in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                    outarr[x][z] = firstheights[x][z] * (1.0 - self.blendscale) + secondheights[x][z] * self.blendscale
-            return outarr
-
-class ThresholdMaskFilter2d(LayerMask2d):
-    """
-    Imposes a threshold on the incoming layermask2d.
+        secondpart = numpy.multiply(secondheights, alpha) # before out gets written, in case it's one of the inputs
+        out = numpy.multiply(firstheights, 1.0 - numpy.asarray(alpha, dtype = float), out)
+        out += secondpart
+        return out
+
+class ThresholdMaskFilter2d(MaskExpression):
+    """
+    Imposes a threshold on the incoming layermask2d: 1.0 where it's between thresholdbottom and
+    thresholdtop, 0.0 everywhere else.
+
+    It's a MaskExpression, so it can be mixed in with mask arithmetic.
     """
     inputlayer = None
     thresholdbottom = None
@@ -333,37 +921,101 @@ class ThresholdMaskFilter2d(LayerMask2d):
         self.thresholdbottom = thresholdbottom
         self.thresholdtop = thresholdtop
 
-    def getChunkHeights(self, cx, cz):
+    def getOperands(self):
+        return [self.inputlayer]
+
+    def applyOperation(self, values, out = None):
         """
         Threshold the mask filter
         """
-        heights = self.inputlayer.getChunkHeights(cx, cz)
+        heights = values[0]
         thresher = ( self.thresholdbottom <= heights ) & ( heights <= self.thresholdtop ) # create an indexing array
-        heights[thresher] = 1.0
-        heights[thresher == False] = 0.0
-        return heights
+        if out is None:
+            return thresher.astype(float)
+        out[...] = thresher
+        return out
+
+class CacheMaskFilter2d(MaskFilter2d):
+    """
+    Implements a caching passthru filter for LayerMask2ds.
+
+    Put one in front of a mask that several other masks or filters read from, and the input only gets
+    asked for each chunk's heights once. The cache holds at most capacity chunks' worth of heights (None
+    for no limit), and throws away the least recently used chunks first.
+    """
+    cache = None
+    def __init__(self, inputlayer, capacity = HEIGHT_CACHE_CAPACITY_IN_CHUNKS):
+        MaskFilter2d.__init__(self, inputlayer)
+        self.cache = LRUCache(capacity)
+
+    def getChunkHeights(self, cx, cz):
+        """
+        Pull the heights from the cache, or from the input layer if we haven't cached them yet.
+
+        We hand out read-only views of the cached heights.
+        """
+        heights = self.cache.get( (cx, cz) )
+        if heights is None:
+            heights = self.inputlayer.getChunkHeights(cx, cz)
+            if heights.flags.writeable:
+                heights = heights.copy() # not ours to make read-only
+                heights.flags.writeable = False
+            self.cache[ (cx, cz) ] = heights
+        return heights.view()
+
+    def getStats(self):
+        """
+        Get the hit, miss and eviction counts of the cache.
+        """
+        return self.cache.getStats()
 
 class DSLayerMask2d(LayerMask2d):
 
     """
     Two-dimensional diamond-square heightmap layer.
+
+    With regionmode = True, asking for any chunk generates the heightmap of its whole region
+    (REGION_WIDTH_IN_CHUNKS x REGION_WIDTH_IN_CHUNKS chunks) in one go, and chunks are handed out as
+    read-only views into it. The heights are exactly the same as generating chunk by chunk, it's just
+    a lot quicker if you're going to want most of the region anyway.
+
+    Generated heights are kept in least-recently-used caches: up to chunkcachecapacity chunks' worth of
+    heights (in region mode, that many chunks' worth of whole regions), the chunk corner heights of
+    up to regioncachecapacity regions, and up to edgecachecapacity chunk edges. Any of them may be None
+    for no limit. If you generate chunks in strips, an edge cache 3 * striplength + 2 edges big is enough
+    for every edge to be generated just once.
     """
     
     seed = None
     chunkvolatility = None # diamond-square randomness for a chunk
     regionvolatility = None # diamond-square randomness for a region
     chunkinitdepth = None # initial recursion depth for chunk generation (chunkvolatility**chunkinitdepth for starting chunk volatility)
-    regioncache = None # a dictionary of regions we have already generated.
+    statelessrng = None # True to hash random values with the noise module instead of seeding the random module.
+    regionmode = None # True to generate whole regions at a time.
+    regioncache = None # an LRUCache of the chunk corner heights of regions we have already generated.
+    chunkcache = None # an LRUCache of chunk heights we have already generated, in chunk mode.
+    edgecache = None # an LRUCache of chunk edges we have already generated, in chunk mode.
+    regionheightcache = None # an LRUCache of region heightmaps we have already generated, in region mode.
 
     blockheightoverrides = None
 
-    def __init__(self, seed, chunkvolatility = 0.5, regionvolatility = 0.4, chunkinitdepth = 3):
+    def __init__(self, seed, chunkvolatility = 0.5, regionvolatility = 0.4, chunkinitdepth = 3, statelessrng = False, regionmode = False,
+                 chunkcachecapacity = HEIGHT_CACHE_CAPACITY_IN_CHUNKS, regioncachecapacity = CORNER_CACHE_CAPACITY_IN_REGIONS,
+                 edgecachecapacity = EDGE_CACHE_CAPACITY_IN_EDGES):
         self.seed = seed
         self.chunkvolatility = chunkvolatility
         self.regionvolatility = regionvolatility
         self.chunkinitdepth = chunkinitdepth
+        self.statelessrng = statelessrng
+        self.regionmode = regionmode
 
-        self.regioncache = {}
+        self.regioncache = LRUCache(regioncachecapacity)
+        self.chunkcache = LRUCache(chunkcachecapacity)
+        self.edgecache = LRUCache(edgecachecapacity)
+        regionheightcapacity = None
+        if chunkcachecapacity is not None:
+            regionheightcapacity = max(1, chunkcachecapacity / (REGION_WIDTH_IN_CHUNKS * REGION_WIDTH_IN_CHUNKS))
+        self.regionheightcache = LRUCache(regionheightcapacity)
 
         self.blockheightoverrides = {}
 
@@ -383,69 +1035,109 @@ class DSLayerMask2d(LayerMask2d):
 
         regionsouth = coord[0]
         regionwest = coord[1]
+        if self.statelessrng:
+            return hashrandom(self.seed, NOISE_REGIONCORNER, regionsouth, regionwest)
         random.seed( self.seed ^ ((regionsouth & 0xFFFF0000) | (regionwest & 0x0000FFFF)) )
         random.jumpahead( ((regionwest & 0xFFFF0000) | (regionsouth & 0x0000FFFF)) ) 
 
         corner = random.random()
         return corner
 
+    def getRegionCorners(self, regionsouths, regionwests):
+        """
+        Get the corner heights of lots of regions at once.
+
+        regionsouths and regionwests are arrays (or lists) of region corner coordinates, which are
+        broadcast against each other. Returns an array of corner heights of the same shape, exactly as
+        getregioncorner would give them one at a time. With statelessrng this is a single vectorized
+        hash; otherwise every distinct corner still needs its own reseed, but we only do each one once.
+        """
+        regionsouths, regionwests = numpy.broadcast_arrays( numpy.asarray(regionsouths), numpy.asarray(regionwests) )
+        if regionsouths.size and (regionsouths.dtype.kind not in 'iu' or regionwests.dtype.kind not in 'iu'):
+            raise RuntimeError, "region coordinates must be integers"
+        assert( type(self.seed) == int )
+
+        if self.statelessrng:
+            return numpy.asarray( hashrandom(self.seed, NOISE_REGIONCORNER, regionsouths, regionwests), dtype = float )
+        corners = {}
+        coords = zip( regionsouths.ravel().tolist(), regionwests.ravel().tolist() )
+        for coord in coords:
+            if not coord in corners:
+                corners[coord] = self.getregioncorner(coord)
+        return numpy.array( [corners[coord] for coord in coords], dtype = float ).reshape(regionsouths.shape)
+
     
     def getChunkHeights(self, cx, cz):
         """
-        Get the heightmap for a 16 block x 16 block chunk.        
+        Get the heightmap for a 16 block x 16 block chunk, as a read-only array (it may be cached.)
         """
         chunksouth = cx % REGION_WIDTH_IN_CHUNKS
         chunkwest = cz % REGION_WIDTH_IN_CHUNKS
         regionsouth = int(math.floor(cx / REGION_WIDTH_IN_CHUNKS))
         regionwest = int(math.floor(cz / REGION_WIDTH_IN_CHUNKS))
 
+        if self.regionmode:
+            regionheights = self.getRegionHeights( (regionsouth, regionwest) )
+            return regionheights[chunksouth * CHUNK_WIDTH_IN_BLOCKS:(chunksouth + 1) * CHUNK_WIDTH_IN_BLOCKS,
+                                 chunkwest * CHUNK_WIDTH_IN_BLOCKS:(chunkwest + 1) * CHUNK_WIDTH_IN_BLOCKS]
+
+        heights = self.chunkcache.get( (cx, cz) )
+        if heights is not None:
+            return heights
+
         # Get region chunk corners
         chunkcorners = self.getRegionChunkCornerHeights( (regionsouth, regionwest) )
 
         # Generate chunk data using desired chunk corners
         # using numpy array so we can do a 2D slice to output this array
-        arr = [[-1.0 for col in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)] for row in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)]
-
-        arr[0][0] = chunkcorners[chunksouth][chunkwest]
-        arr[len(arr)-1][0] = chunkcorners[chunksouth + 1][chunkwest]
-        arr[0][len(arr[0])-1] = chunkcorners[chunksouth][chunkwest + 1]
-        arr[len(arr)-1][len(arr[0])-1] = chunkcorners[chunksouth + 1][chunkwest + 1]
-
-        # First, generate edges, in order to seam up chunks.
-        edgearr = [-1.0 for row in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)]
-        edgearr[0] = arr[0][0]
-        edgearr[CHUNK_WIDTH_IN_BLOCKS] = arr[0][CHUNK_WIDTH_IN_BLOCKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth)
-        for i in xrange(CHUNK_WIDTH_IN_BLOCKS + 1): arr[0][i] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)]
-        edgearr[0] = arr[CHUNK_WIDTH_IN_BLOCKS][0]
-        edgearr[CHUNK_WIDTH_IN_BLOCKS] = arr[CHUNK_WIDTH_IN_BLOCKS][CHUNK_WIDTH_IN_BLOCKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth)
-        for i in xrange(CHUNK_WIDTH_IN_BLOCKS + 1): arr[CHUNK_WIDTH_IN_BLOCKS][i] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)]
-        edgearr[0] = arr[0][0]
-        edgearr[CHUNK_WIDTH_IN_BLOCKS] = arr[CHUNK_WIDTH_IN_BLOCKS][0]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth)
-        for i in xrange(CHUNK_WIDTH_IN_BLOCKS + 1): arr[i][0] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(CHUNK_WIDTH_IN_BLOCKS + 1)]
-        edgearr[0] = arr[0][CHUNK_WIDTH_IN_BLOCKS]
-        edgearr[CHUNK_WIDTH_IN_BLOCKS] = arr[CHUNK_WIDTH_IN_BLOCKS][CHUNK_WIDTH_IN_BLOCKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth)
-        for i in xrange(CHUNK_WIDTH_IN_BLOCKS + 1): arr[i][CHUNK_WIDTH_IN_BLOCKS] = edgearr[i]
+        arr = numpy.zeros( (CHUNK_WIDTH_IN_BLOCKS + 1, CHUNK_WIDTH_IN_BLOCKS + 1) ) - 1.0
+
+        # First, generate edges, in order to seam up chunks. Each edge is shared with a neighbouring chunk, so it's cached.
+        southwest = ( (cx, cz), chunkcorners[chunksouth][chunkwest] )
+        northwest = ( (cx + 1, cz), chunkcorners[chunksouth + 1][chunkwest] )
+        southeast = ( (cx, cz + 1), chunkcorners[chunksouth][chunkwest + 1] )
+        northeast = ( (cx + 1, cz + 1), chunkcorners[chunksouth + 1][chunkwest + 1] )
+        edges = self.getChunkEdges( [(southwest, southeast), (northwest, northeast), (southwest, northwest), (southeast, northeast)] )
+        arr[0, :] = edges[0]
+        arr[CHUNK_WIDTH_IN_BLOCKS, :] = edges[1]
+        arr[:, 0] = edges[2]
+        arr[:, CHUNK_WIDTH_IN_BLOCKS] = edges[3]
 
         # Then fill in the rest!
-        diamondsquare2D(arr, seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth)
+        diamondsquare2D(arr, seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth, statelessrng = self.statelessrng)
 
-        outarr = []
-        for i in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            outarr.append( arr[i][0:CHUNK_WIDTH_IN_BLOCKS] )
-
-        return outarr # we slice the first 16 values in each dimension to create an even chunk.
+        # we slice the first 16 values in each dimension to create an even chunk.
+        heights = arr[0:CHUNK_WIDTH_IN_BLOCKS, 0:CHUNK_WIDTH_IN_BLOCKS].copy()
+        heights.flags.writeable = False # so nobody can change the cached copy
+        self.chunkcache[ (cx, cz) ] = heights
+        return heights
 
     
+    def getChunkEdges(self, corners):
+        """
+        Get the heights along the edges between pairs of neighbouring chunk corners, as a list of
+        read-only arrays.
+
+        corners is a list of (start, end) pairs, each a ( (x, z), height ) pair where (x, z) are the world
+        coordinates of the corner in chunks. Both chunks sharing an edge ask for it with the same corners,
+        so we only generate it once and they're guaranteed to seam up. Whichever edges aren't cached yet
+        are generated together with one diamondsquare1Dbatch call.
+        """
+        edges = [ self.edgecache.get( (start[0], end[0]) ) for (start, end) in corners ]
+        missing = [ i for i, edge in enumerate(edges) if edge is None ]
+        if missing:
+            edgearr = numpy.zeros( (len(missing), CHUNK_WIDTH_IN_BLOCKS + 1) ) - 1.0
+            for row, i in enumerate(missing):
+                edgearr[row, 0] = corners[i][0][1]
+                edgearr[row, CHUNK_WIDTH_IN_BLOCKS] = corners[i][1][1]
+            diamondsquare1Dbatch(edgearr, seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth, statelessrng = self.statelessrng)
+            edgearr.flags.writeable = False
+            for row, i in enumerate(missing):
+                start, end = corners[i]
+                edges[i] = edgearr[row]
+                self.edgecache[ (start[0], end[0]) ] = edges[i]
+        return edges
+
     def getRegionChunkCornerHeights(self, regioncoord):
         """
         Get the heightmap for the chunk corners within a region.     
@@ -454,51 +1146,110 @@ class DSLayerMask2d(LayerMask2d):
         regionwest = regioncoord[1]
 
         # Grab from the cache so we don't have to regenerate the region every time.
-        if ( regioncoord in self.regioncache ):
-            return self.regioncache[regioncoord]
+        arr = self.regioncache.get(regioncoord)
+        if arr is not None:
+            return arr
 
         # Generate region chunk corners
         arr = [[-1.0 for col in xrange(REGION_WIDTH_IN_CHUNKS + 1)] for row in xrange(REGION_WIDTH_IN_CHUNKS + 1)]
         
-        arr[0][0] = self.getregioncorner( (regionsouth,regionwest) )
-        arr[len(arr)-1][0] = self.getregioncorner( (regionsouth + 1,regionwest) )
-        arr[0][len(arr[0])-1] = self.getregioncorner( (regionsouth,regionwest + 1) )
-        arr[len(arr)-1][len(arr[0])-1] = self.getregioncorner( (regionsouth + 1,regionwest + 1) )
-
-        # First, generate edges, in order to seam up chunks.
-
-        edgearr = [-1.0 for row in xrange(REGION_WIDTH_IN_CHUNKS + 1)]
-        edgearr[0] = arr[0][0]
-        edgearr[REGION_WIDTH_IN_CHUNKS] = arr[0][REGION_WIDTH_IN_CHUNKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.regionvolatility)
-        for i in xrange(REGION_WIDTH_IN_CHUNKS + 1): arr[0][i] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(REGION_WIDTH_IN_CHUNKS + 1)]
-        edgearr[0] = arr[REGION_WIDTH_IN_CHUNKS][0]
-        edgearr[REGION_WIDTH_IN_CHUNKS] = arr[REGION_WIDTH_IN_CHUNKS][REGION_WIDTH_IN_CHUNKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.regionvolatility)
-        for i in xrange(REGION_WIDTH_IN_CHUNKS + 1): arr[REGION_WIDTH_IN_CHUNKS][i] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(REGION_WIDTH_IN_CHUNKS + 1)]
-        edgearr[0] = arr[0][0]
-        edgearr[REGION_WIDTH_IN_CHUNKS] = arr[REGION_WIDTH_IN_CHUNKS][0]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.regionvolatility)
-        for i in xrange(REGION_WIDTH_IN_CHUNKS + 1): arr[i][0] = edgearr[i]
-
-        edgearr = [-1.0 for row in xrange(REGION_WIDTH_IN_CHUNKS + 1)]
-        edgearr[0] = arr[0][REGION_WIDTH_IN_CHUNKS]
-        edgearr[REGION_WIDTH_IN_CHUNKS] = arr[REGION_WIDTH_IN_CHUNKS][REGION_WIDTH_IN_CHUNKS]
-        diamondsquare1D(edgearr ,seed = self.seed, volatility = self.regionvolatility)
-        for i in xrange(REGION_WIDTH_IN_CHUNKS + 1): arr[i][REGION_WIDTH_IN_CHUNKS] = edgearr[i]
+        corners = self.getRegionCorners( [regionsouth, regionsouth + 1, regionsouth, regionsouth + 1],
+                                         [regionwest, regionwest, regionwest + 1, regionwest + 1] ).tolist()
+        arr[0][0] = corners[0]
+        arr[len(arr)-1][0] = corners[1]
+        arr[0][len(arr[0])-1] = corners[2]
+        arr[len(arr)-1][len(arr[0])-1] = corners[3]
+
+        # First, generate edges, in order to seam up chunks. All four at once: south, north, west, east.
+        last = REGION_WIDTH_IN_CHUNKS
+        edgearr = numpy.zeros( (4, REGION_WIDTH_IN_CHUNKS + 1) ) - 1.0
+        edgearr[:, 0] = [ arr[0][0], arr[last][0], arr[0][0], arr[0][last] ]
+        edgearr[:, last] = [ arr[0][last], arr[last][last], arr[last][0], arr[last][last] ]
+        diamondsquare1Dbatch(edgearr, seed = self.seed, volatility = self.regionvolatility, statelessrng = self.statelessrng)
+        south, north, west, east = edgearr.tolist()
+        arr[0][:] = south
+        arr[last][:] = north
+        for i in xrange(REGION_WIDTH_IN_CHUNKS + 1):
+            arr[i][0] = west[i]
+            arr[i][last] = east[i]
 
         # Then fill in the rest!
-        diamondsquare2D(arr, seed = self.seed, volatility = self.regionvolatility)
+        diamondsquare2D(arr, seed = self.seed, volatility = self.regionvolatility, statelessrng = self.statelessrng)
 
         # cache the region so we can save on processing power later.
         self.regioncache[regioncoord] = arr
 
         return arr
 
+    def getChunksHeights(self, cx0, cz0, cx1, cz1):
+        if not self.regionmode:
+            return LayerMask2d.getChunksHeights(self, cx0, cz0, cx1, cz1)
+        if cx1 < cx0 or cz1 < cz0: raise RuntimeError, "chunk rectangle must not be inside out"
+        heights = numpy.empty( (cx1 - cx0, cz1 - cz0, CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        # Copy over the overlap with each region the rectangle touches.
+        for regionsouth in xrange( cx0 // REGION_WIDTH_IN_CHUNKS, (cx1 - 1) // REGION_WIDTH_IN_CHUNKS + 1 ):
+            for regionwest in xrange( cz0 // REGION_WIDTH_IN_CHUNKS, (cz1 - 1) // REGION_WIDTH_IN_CHUNKS + 1 ):
+                regioncx, regioncz = regionsouth * REGION_WIDTH_IN_CHUNKS, regionwest * REGION_WIDTH_IN_CHUNKS
+                xs = slice( max(cx0, regioncx), min(cx1, regioncx + REGION_WIDTH_IN_CHUNKS) )
+                zs = slice( max(cz0, regioncz), min(cz1, regioncz + REGION_WIDTH_IN_CHUNKS) )
+                # view the region as [chunksouth, chunkwest, x, z]
+                regionheights = self.getRegionHeights( (regionsouth, regionwest) ).reshape(
+                    REGION_WIDTH_IN_CHUNKS, CHUNK_WIDTH_IN_BLOCKS, REGION_WIDTH_IN_CHUNKS, CHUNK_WIDTH_IN_BLOCKS ).swapaxes(1, 2)
+                heights[xs.start - cx0:xs.stop - cx0, zs.start - cz0:zs.stop - cz0] = \
+                    regionheights[xs.start - regioncx:xs.stop - regioncx, zs.start - regioncz:zs.stop - regioncz]
+        return heights
+
+    def getStats(self):
+        """
+        Get the hit, miss and eviction counts of each of our caches (see LRUCache.getStats.)
+        """
+        return {"chunkheights": self.chunkcache.getStats(), "chunkedges": self.edgecache.getStats(),
+                "regioncorners": self.regioncache.getStats(), "regionheights": self.regionheightcache.getStats()}
+
+    def getRegionHeights(self, regioncoord):
+        """
+        Get the heightmap for every block in a region as one read-only array, indexed [x][z].
+
+        Each chunk's heights come out just like getChunkHeights would make them in chunk mode, but
+        every chunk edge is only generated once, and the insides of all the chunks are filled in
+        with a single diamondsquare2Dbatch call.
+        """
+        heights = self.regionheightcache.get(regioncoord)
+        if heights is not None:
+            return heights
+
+        chunkcorners = self.getRegionChunkCornerHeights(regioncoord)
+        width = CHUNK_WIDTH_IN_BLOCKS
+        chunks = REGION_WIDTH_IN_CHUNKS
+        # every chunk in the region, with its bordering row and column: [chunksouth, chunkwest, x, z]
+        arr = numpy.zeros( (chunks, chunks, width + 1, width + 1) ) - 1.0
+
+        # First, generate edges, in order to seam up chunks. Each edge is shared by the two chunks on either side of it.
+        # Edges running along z come first, indexed [chunksouth][chunkwest], then edges running along x, all in one batch.
+        corners = numpy.array(chunkcorners)
+        edgearr = numpy.zeros( ((chunks + 1) * chunks * 2, width + 1) ) - 1.0
+        zedges = edgearr[:(chunks + 1) * chunks].reshape(chunks + 1, chunks, width + 1)
+        xedges = edgearr[(chunks + 1) * chunks:].reshape(chunks, chunks + 1, width + 1)
+        zedges[:, :, 0] = corners[:, :-1]
+        zedges[:, :, width] = corners[:, 1:]
+        xedges[:, :, 0] = corners[:-1, :]
+        xedges[:, :, width] = corners[1:, :]
+        diamondsquare1Dbatch(edgearr, seed = self.seed, volatility = self.chunkvolatility, initdepth = self.chunkinitdepth, statelessrng = self.statelessrng)
+        arr[:, :, 0, :] = zedges[:-1]
+        arr[:, :, width, :] = zedges[1:]
+        arr[:, :, :, 0] = xedges[:, :-1]
+        arr[:, :, :, width] = xedges[:, 1:]
+
+        # Then fill in the rest!
+        diamondsquare2Dbatch(arr.reshape(chunks * chunks, width + 1, width + 1), seed = self.seed, volatility = self.chunkvolatility,
+                             initdepth = self.chunkinitdepth, statelessrng = self.statelessrng)
+
+        # we slice the first 16 values in each dimension of each chunk, then lay the chunks out side by side.
+        heights = arr[:, :, :width, :width].swapaxes(1, 2).reshape(chunks * width, chunks * width)
+        heights.flags.writeable = False
+        self.regionheightcache[regioncoord] = heights
+        return heights
+
 #########################################################################
 # Hybrid filters: convert one output type to another
 #########################################################################
@@ -520,21 +1271,33 @@ class HeightMaskRenderFilter(Layer):
 
     def getChunk(self, cx, cz):
         # 2D array
-        heights = self.inputlayer.getChunkHeights( cx,cz )
-        # 3D array
-        chunk = Chunk(cx, cz)
-        blocks = chunk.blocks
-        blockid = self.blockid
-        rangetop = self.rangetop
-        rangebottom = self.rangebottom
-        rangeheight = self.rangetop - self.rangebottom
-        # Copy height information into 3D block array
-        for row in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            for col in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                # we limit the vertical range in which the heightmap lives.
-                blockheight = int( heights[row][col] * (rangeheight) + rangebottom )
-                blockslice = blocks[row][col]
-                for ix in xrange(blockheight):
-                    blockslice[ix] = blockid
+        heights = numpy.asarray( self.inputlayer.getChunkHeights( cx,cz ), dtype = float )
+        blockheights = self.getBlockHeights(heights)
+        chunk = Chunk(cx, cz, fillmaterial = None)
+        chunk.blocks = self.renderBlocks(blockheights)
+        chunk.data = numpy.zeros(CHUNK_SHAPE, dtype = CHUNK_DTYPE)
+        if self.blockid != MAT_AIR:
+            chunk.setSurface( numpy.clip(blockheights, 0, CHUNK_HEIGHT_IN_BLOCKS) - 1 )
         return chunk
+
+    def getChunks(self, cx0, cz0, cx1, cz1):
+        heights = self.inputlayer.getChunksHeights(cx0, cz0, cx1, cz1)
+        return self.renderBlocks( self.getBlockHeights(heights) )
+
+    def getBlockHeights(self, heights):
+        """
+        Scale heights from the mask (0.0 to 1.0) to block heights.
+        """
+        # we limit the vertical range in which the heightmap lives.
+        rangeheight = self.rangetop - self.rangebottom
+        return ( heights * rangeheight + self.rangebottom ).astype(int)
+
+    def renderBlocks(self, blockheights):
+        """
+        Fill every column of blocks up to its block height. Works on one chunk or a whole stack of them.
+        """
+        # one broadcasted comparison of every column's height against every y
+        y = numpy.arange(CHUNK_HEIGHT_IN_BLOCKS)
+        solid = y < blockheights[..., numpy.newaxis]
+        return numpy.where(solid, numpy.array(self.blockid, dtype = CHUNK_DTYPE), numpy.array(MAT_AIR, dtype = CHUNK_DTYPE))
    
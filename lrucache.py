@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+
+Bounded least-recently-used cache, for chunks and any other data we'd rather not regenerate.
+
+"""
+
+from collections import OrderedDict
+
+__all__ = ["LRUCache"]
+
+class LRUCache(object):
+    """
+    A dictionary-like cache which throws away its least recently used entries once it holds more
+    than capacity entries, or more than maxbytes bytes. Either limit may be None for no limit.
+
+    sizeof(value) tells the cache how many bytes a value takes up. By default we use value.nbytes,
+    which works for numpy arrays and Chunks.
+
+    hits, misses and evictions count lookups and evictions since the cache was created.
+    """
+    capacity = None
+    maxbytes = None
+    sizeof = None
+    nbytes = None # only tracked when maxbytes is set
+    entries = None
+    hits = None
+    misses = None
+    evictions = None
+
+    def __init__(self, capacity = None, maxbytes = None, sizeof = None):
+        if capacity is not None and capacity < 1: raise ValueError("capacity must be at least 1, or None")
+        if maxbytes is not None and maxbytes < 0: raise ValueError("maxbytes must be positive, or None")
+        self.capacity = capacity
+        self.maxbytes = maxbytes
+        if sizeof is None:
+            sizeof = lambda value: value.nbytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        """
+        Check for a key without counting a hit or miss, and without refreshing it.
+        """
+        return key in self.entries
+
+    def __getitem__(self, key):
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        # reinsert to mark as most recently used
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key in self.entries:
+            del self[key]
+        self.entries[key] = value
+        if self.maxbytes is not None:
+            self.nbytes += self.sizeof(value)
+        self.evict()
+
+    def __delitem__(self, key):
+        value = self.entries.pop(key)
+        if self.maxbytes is not None:
+            self.nbytes -= self.sizeof(value)
+
+    def evict(self):
+        """
+        Throw away the least recently used entries until we're within our limits again.
+        The most recent entry is always kept, even if it alone is larger than maxbytes.
+        """
+        while len(self.entries) > 1 and ( (self.capacity is not None and len(self.entries) > self.capacity) or
+                                          (self.maxbytes is not None and self.nbytes > self.maxbytes) ):
+            key, value = self.entries.popitem(last = False)
+            if self.maxbytes is not None:
+                self.nbytes -= self.sizeof(value)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def getStats(self):
+        """
+        Get a dictionary of hit, miss and eviction counts, along with the current size of the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "nbytes": self.nbytes}
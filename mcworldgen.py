@@ -24,6 +24,7 @@ import sys
 # Modules to test
 from diamondsquare import *
 from layer import *
+from layer import Chunk
 from landmark import *
 from saveutils import *
 
@@ -55,18 +56,18 @@ def filtertest(modulename="default"):
     
     pipeline = namedModule(modulename)
     print pipeline, dir(pipeline)
-    tfilter = pipeline.build(worldseed, testworld)
+    tfilter = compilePipeline( pipeline.build(worldseed, testworld) )
 
-    # Generate minecraft level
+    # Generate minecraft level, one strip of chunks per call
     for chunkrow in xrange(-worldsizex, worldsizex):
         print "Generating westward chunk strip", chunkrow
+        starttime = time.clock()     
+        strip = tfilter.getChunks(chunkrow, -worldsizez, chunkrow + 1, worldsizez)
+        endtime = time.clock()
+        totaltime += endtime - starttime
         for chunkcol in xrange(-worldsizez, worldsizez):
-            #print "\n========\nChunk", (chunkrow, chunkcol), "\n========"   
-            
-            starttime = time.clock()     
-            currchunk = tfilter.getChunk(chunkrow, chunkcol)
-            endtime = time.clock()
-            totaltime += endtime - starttime
+            currchunk = Chunk(chunkrow, chunkcol, fillmaterial = None)
+            currchunk.blocks = strip[0, chunkcol + worldsizez]
             setWorldChunk( testworld, currchunk, chunkrow, chunkcol)
     
     saveWorld(testworld)
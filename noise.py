@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""
+
+Stateless noise: random numbers worked out by hashing (seed, purpose, coordinates), rather than by
+seeding the random module and stepping through its stream.
+
+Nothing here touches any shared state, so values can be computed in any order, from any thread, one
+at a time or for whole numpy arrays of coordinates at once, and any single value can be recomputed
+without replaying everything that came before it.
+
+"""
+
+import numpy
+
+__all__ = ["hashrandom", "hashrandint", "NOISE_DSCORNERS", "NOISE_DSFILL", "NOISE_REGIONCORNER",
+           "NOISE_SPAWNX", "NOISE_SPAWNZ", "NOISE_SPAWNY", "NOISE_SPAWNTYPE", "NOISE_ORE"]
+
+# Purposes: what a random value is for. Different purposes give unrelated values for the same coordinates.
+NOISE_DSCORNERS = 1 # unfilled corners of a diamond-square array
+NOISE_DSFILL = 2 # midpoint displacements of a diamond-square array
+NOISE_REGIONCORNER = 3 # corner heights of a DSLayerMask2d region
+NOISE_SPAWNX = 4 # landmark spawn positions within a region
+NOISE_SPAWNZ = 5
+NOISE_SPAWNY = 6
+NOISE_SPAWNTYPE = 7 # which landmark gets spawned
+NOISE_ORE = 8 # ore blocks within a CubicOreLandmark
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+GOLDEN = numpy.uint64(0x9E3779B97F4A7C15)
+
+def mix(h):
+    """
+    The splitmix64 finalizer: scramble every bit of h into every other bit.
+    """
+    h = (h ^ (h >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    h = (h ^ (h >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return h ^ (h >> numpy.uint64(31))
+
+def seedbits(seed):
+    """
+    Turn a seed (anything hashable, like the random module takes) into 64 bits. None counts as 0.
+    """
+    if seed is None: return 0
+    if isinstance(seed, float): return int( numpy.array(seed, dtype = float).view(numpy.uint64) )
+    if isinstance(seed, (int, long)): return seed & MASK64
+    return hash(seed) & MASK64
+
+def seedwords(seed):
+    """
+    Turn a seed, or a numpy array of seeds (one per hash), into 64 bit words.
+    """
+    if isinstance(seed, numpy.ndarray): return coordbits(seed)
+    return numpy.uint64(seedbits(seed))
+
+def coordbits(coord):
+    """
+    Turn a coordinate (or an array of them) into 64 bit words. Floats are hashed by their bits.
+    """
+    coord = numpy.asarray(coord)
+    if coord.dtype.kind == 'f':
+        return coord.astype(float).view(numpy.uint64)
+    return coord.astype(numpy.int64).astype(numpy.uint64)
+
+def hashbits(seed, purpose, *coords):
+    """
+    Hash seed, purpose and coords down to 64 random bits. Coordinates (and the seed) may be numpy
+    arrays, in which case they're broadcast against each other and we return an array of hashes.
+    """
+    with numpy.errstate(over = 'ignore'):
+        h = mix( seedwords(seed) + GOLDEN )
+        h = mix( h ^ (numpy.uint64(purpose) * GOLDEN) )
+        for coord in coords:
+            h = mix( (h + GOLDEN) ^ coordbits(coord) )
+    return h
+
+def hashrandom(seed, purpose, *coords):
+    """
+    A random float in [0.0, 1.0) for the given seed, purpose and coordinates, just like random.random()
+    would give you if you seeded it with all three. Returns a float, or an array of floats if any of
+    the coordinates is an array.
+    """
+    values = (hashbits(seed, purpose, *coords) >> numpy.uint64(11)) * (1.0 / 9007199254740992.0) # 53 bits, like random.random()
+    if numpy.ndim(values) == 0: return float(values)
+    return values
+
+def hashrandint(seed, purpose, low, high, *coords):
+    """
+    A random integer between low and high (endpoint inclusive, like random.randint) for the given seed,
+    purpose and coordinates. Returns an int, or an array of ints if any of the coordinates is an array.
+    """
+    values = low + numpy.floor( numpy.asarray(hashrandom(seed, purpose, *coords)) * (high - low + 1) ).astype(int)
+    if numpy.ndim(values) == 0: return int(values)
+    return values
@@ -42,12 +42,13 @@ def build(worldseed, worldobj):
     # Bottom should be Adminium/Bedrock
     tfilter = WaterLevelFilter(tfilter, rangetop = 0, findid = MAT_STONE, replaceid = MAT_BEDROCK)
     # Add ores
-    tfilter = LandmarkGenerator(tfilter, worldseed + 5, landmarklist = [CubicOreLandmark(None, ore = MAT_COALORE, density = 0.5, sizex = 4, sizez = 4, sizey = 4)], density = 2500 , rangebottom = 1, rangetop = 50)
-    tfilter = LandmarkGenerator(tfilter, worldseed + 6, landmarklist = [CubicOreLandmark(None, ore = MAT_IRONORE, density = 0.5, sizex = 3, sizez = 3, sizey = 3)], density = 6500 , rangebottom = 1, rangetop = 50)
-    tfilter = LandmarkGenerator(tfilter, worldseed + 4, landmarklist = [CubicOreLandmark(None, ore = MAT_GOLDORE, density = 0.5)], density = 2300 , rangebottom = 1, rangetop = 35)
-    tfilter = LandmarkGenerator(tfilter, worldseed + 3, landmarklist = [CubicOreLandmark(None, ore = MAT_LAPISORE, density = 0.5)], density = 1200, rangebottom = 1, rangetop = 32)
-    tfilter = LandmarkGenerator(tfilter, worldseed + 2, landmarklist = [CubicOreLandmark(None, ore = MAT_REDSTONEORE, density = 0.5, sizex = 3, sizez = 3, sizey = 3)], density = 2600, rangebottom = 1, rangetop = 19)
-    tfilter = LandmarkGenerator(tfilter, worldseed + 1, landmarklist = [CubicOreLandmark(None, ore = MAT_DIAMONDORE, density = 0.5)], density = 1400, rangebottom = 1, rangetop = 19)
+    tfilter = OreGenerator(tfilter, [
+        {"ore": MAT_COALORE, "seed": worldseed + 5, "density": 0.5, "sizex": 4, "sizez": 4, "sizey": 4, "spawns": 2500, "rangebottom": 1, "rangetop": 50},
+        {"ore": MAT_IRONORE, "seed": worldseed + 6, "density": 0.5, "sizex": 3, "sizez": 3, "sizey": 3, "spawns": 6500, "rangebottom": 1, "rangetop": 50},
+        {"ore": MAT_GOLDORE, "seed": worldseed + 4, "density": 0.5, "spawns": 2300, "rangebottom": 1, "rangetop": 35},
+        {"ore": MAT_LAPISORE, "seed": worldseed + 3, "density": 0.5, "spawns": 1200, "rangebottom": 1, "rangetop": 32},
+        {"ore": MAT_REDSTONEORE, "seed": worldseed + 2, "density": 0.5, "sizex": 3, "sizez": 3, "sizey": 3, "spawns": 2600, "rangebottom": 1, "rangetop": 19},
+        {"ore": MAT_DIAMONDORE, "seed": worldseed + 1, "density": 0.5, "spawns": 1400, "rangebottom": 1, "rangetop": 19} ])
 
     tfilter = Filter(tfilter) # passthru filter
     tfilter = TopSoilFilter(tfilter, 
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""
+
+Benchmark pyMCWorldGen filters against the per-block python loops they replaced.
+
+The loop versions live here so that the unit tests can check that the fast filters
+still give exactly the same output.
+
+"""
+
+import timeit
+import numpy
+
+from constants import *
+from layer import *
+from layer import Chunk
+from landmark import Landmark, StaticTreeLandmark, CubicOreLandmark, LandmarkGenerator, OreGenerator
+
+#########################################################################
+# Reference implementations: the old per-block loops, working on a chunk's block array.
+#########################################################################
+
+def waterlevelloop(blocks, rangebottom, rangetop, findid, replaceid):
+    for row in blocks:
+        for col in row:
+            for ix in xrange(rangebottom, min( len(col), rangetop + 1) ):
+                if col[ix] == findid:
+                    col[ix] = replaceid
+
+def topsoilloop(blocks, rangebottom, rangetop, findid, replaceid, thickness, airid):
+    if thickness == 0: return
+    workingrange = range(rangebottom, rangetop + 1)
+    workingrange.reverse()
+    for row in blocks:
+        for col in row: # for all vertical columns:
+            # first block must be an air block
+            if col[rangetop] != airid: continue
+            # work downward and replace only thickness of the blocks.
+            for hix in workingrange:
+                element = col[hix]
+                if element == findid:
+                    if thickness > 0: # replace blocks 
+                        for i in xrange( max(hix-thickness+1, 0), hix+1 ):
+                            col[i] = replaceid
+                    elif thickness < 0: # cake over with blocks
+                        for i in xrange( hix+1, min(hix-thickness+1,CHUNK_HEIGHT_IN_BLOCKS) ):
+                            col[i] = replaceid
+                if element != airid: break # we search only through the air
+
+def snowcoverloop(blocks, rangebottom, rangetop, snowid, thickness, airid):
+    if thickness <= 0: return
+    workingrange = range(rangebottom, rangetop + 1)
+    workingrange.reverse()
+    for row in blocks:
+        for col in row: # for all vertical columns:
+            # first block must be an air block
+            if col[rangetop] != airid: continue
+            # work downward and replace only thickness of the blocks.
+            for hix in workingrange:           
+                if col[hix] != airid:  # we search only through the air
+                    for i in xrange(hix+1, hix+1+thickness):
+                        col[i] = snowid
+                    break
+
+def blendloop(firstheights, secondheights, alphaheights):
+    outarr = [[-1.0 for z in xrange(CHUNK_WIDTH_IN_BLOCKS)] for x in xrange(CHUNK_WIDTH_IN_BLOCKS)]
+    for x in xrange(CHUNK_WIDTH_IN_BLOCKS):
+        for z in xrange(CHUNK_WIDTH_IN_BLOCKS):
+            outarr[x][z] = firstheights[x][z] * (1.0 - alphaheights[x][z]) + secondheights[x][z] * alphaheights[x][z]
+    return outarr
+
+def heightmaskrenderloop(heights, blocks, blockid, rangebottom, rangetop):
+    rangeheight = rangetop - rangebottom
+    for row in xrange(CHUNK_WIDTH_IN_BLOCKS):
+        for col in xrange(CHUNK_WIDTH_IN_BLOCKS):
+            blockheight = int( heights[row][col] * (rangeheight) + rangebottom )
+            blockslice = blocks[row][col]
+            for ix in xrange(blockheight):
+                blockslice[ix] = blockid
+
+def stamploop(inputstamp, outputblocks, offsetx, offsetz, offsety):
+    for outx in xrange( max(0, offsetx), min(CHUNK_WIDTH_IN_BLOCKS, offsetx + len(inputstamp) ) ):
+        inx = outx - offsetx
+        for outz in xrange( max(0, offsetz), min(CHUNK_WIDTH_IN_BLOCKS, offsetz + len(inputstamp[inx]) ) ):
+            inz = outz - offsetz
+            for outy in xrange( max(0, offsety), min(CHUNK_HEIGHT_IN_BLOCKS, offsety + len(inputstamp[inx][inz]) ) ):
+                iny = outy - offsety
+                if (inputstamp[inx][inz][iny] != MAT_TRANSPARENT):
+                    outputblocks[outx][outz][outy] = inputstamp[inx][inz][iny]
+
+#########################################################################
+# Benchmarks
+#########################################################################
+
+class TerrainLayer(Layer):
+    """
+    Hands out copies of a single bumpy stone chunk, so we only time the filter under test.
+    """
+    terrain = None
+    def __init__(self):
+        self.terrain = Chunk(0, 0)
+        blocks = self.terrain.blocks
+        for x in xrange(CHUNK_WIDTH_IN_BLOCKS):
+            for z in xrange(CHUNK_WIDTH_IN_BLOCKS):
+                blocks[x, z, 0:50 + (x * 7 + z * 3) % 40] = MAT_STONE
+
+    def getChunk(self, cx, cz):
+        return self.terrain.copy()
+
+def benchmark(name, fast, slow, number = 50, slowname = "loop"):
+    """
+    Time fast() and slow() (each producing a single chunk) and print the per-chunk times.
+    """
+    fasttime = min( timeit.repeat(fast, number = number, repeat = 3) ) / number
+    slowtime = min( timeit.repeat(slow, number = number, repeat = 3) ) / number
+    print "%-24s %10.1f us/chunk  (%s: %10.1f us/chunk, %6.1fx faster)" % (name, fasttime * 1e6, slowname, slowtime * 1e6, slowtime / fasttime)
+
+def bench_waterlevelfilter():
+    terrain = TerrainLayer()
+    wlfilter = WaterLevelFilter(terrain)
+    def slow():
+        chunk = terrain.getChunk(0, 0)
+        waterlevelloop(chunk.blocks, wlfilter.rangebottom, wlfilter.rangetop, wlfilter.findid, wlfilter.replaceid)
+    benchmark("WaterLevelFilter", lambda: wlfilter.getChunk(0, 0), slow)
+
+def bench_topsoilfilter():
+    terrain = TerrainLayer()
+    tsfilter = TopSoilFilter(terrain, rangetop = 85, thickness = 5)
+    def slow():
+        chunk = terrain.getChunk(0, 0)
+        topsoilloop(chunk.blocks, tsfilter.rangebottom, tsfilter.rangetop, tsfilter.findid, tsfilter.replaceid, tsfilter.thickness, tsfilter.airid)
+    benchmark("TopSoilFilter", lambda: tsfilter.getChunk(0, 0), slow)
+
+def bench_snowcoverfilter():
+    terrain = TerrainLayer()
+    scfilter = SnowCoverFilter(terrain, rangebottom = 82, rangetop = 95)
+    def slow():
+        chunk = terrain.getChunk(0, 0)
+        snowcoverloop(chunk.blocks, scfilter.rangebottom, scfilter.rangetop, scfilter.snowid, scfilter.thickness, scfilter.airid)
+    benchmark("SnowCoverFilter", lambda: scfilter.getChunk(0, 0), slow)
+
+def bench_heightmaskrenderfilter():
+    heights = numpy.random.random( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+    hmfilter = HeightMaskRenderFilter(LayerMask2d(heights), rangebottom = 34, rangetop = 94)
+    def slow():
+        chunk = Chunk(0, 0)
+        heightmaskrenderloop(heights, chunk.blocks, hmfilter.blockid, hmfilter.rangebottom, hmfilter.rangetop)
+    benchmark("HeightMaskRenderFilter", lambda: hmfilter.getChunk(0, 0), slow)
+
+def bench_blendmaskfilter():
+    first, second, alpha = [ numpy.random.random( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) ) for i in xrange(3) ]
+    blend = BlendMaskFilter2d(LayerMask2d(first), LayerMask2d(second), alphamask = LayerMask2d(alpha))
+    out = numpy.empty( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+    benchmark("BlendMaskFilter2d", lambda: blend.getChunkHeights(0, 0, out = out), lambda: blendloop(first, second, alpha))
+
+def bench_remapfilter():
+    terrain = TerrainLayer()
+    chained = WaterLevelFilter(terrain, rangebottom = 0, rangetop = 0, findid = MAT_STONE, replaceid = MAT_BEDROCK)
+    chained = WaterLevelFilter(chained, rangebottom = 61, rangetop = 66, findid = MAT_STONE, replaceid = MAT_DIRT)
+    chained = WaterLevelFilter(chained)
+    fused = fuseRemapFilters(chained)
+    benchmark("RemapFilter (3 rules)", lambda: fused.getChunk(0, 0), lambda: chained.getChunk(0, 0), slowname = "chained")
+    # Lots of rules over the same heights get compiled into a single lookup table
+    chained = terrain
+    for findid, replaceid in [(MAT_STONE, MAT_DIRT), (MAT_DIRT, MAT_GRASS), (MAT_AIR, MAT_WATER), (MAT_GRASS, MAT_SNOW),
+                              (MAT_WATER, MAT_LEAVES), (MAT_SNOW, MAT_WOOD)]:
+        chained = WaterLevelFilter(chained, rangebottom = 20, rangetop = 100, findid = findid, replaceid = replaceid)
+    fused = fuseRemapFilters(chained)
+    benchmark("RemapFilter (6 rules)", lambda: fused.getChunk(0, 0), lambda: chained.getChunk(0, 0), slowname = "chained")
+
+def bench_stamptochunk():
+    blocks = Chunk(0, 0).blocks
+    landmark = Landmark(None)
+    # a whole tree, in the middle of the chunk
+    benchmark("Landmark.stampToChunk", lambda: landmark.stampToChunk(StaticTreeLandmark.treestamp, blocks, 3, 3, 70),
+              lambda: stamploop(StaticTreeLandmark.statictree, blocks, 3, 3, 70), number = 500)
+
+# The ores from pipelines/default.py
+defaultorespecs = [ {"ore": MAT_COALORE, "seed": 5, "density": 0.5, "sizex": 4, "sizez": 4, "sizey": 4, "spawns": 2500, "rangebottom": 1, "rangetop": 50},
+                    {"ore": MAT_IRONORE, "seed": 6, "density": 0.5, "sizex": 3, "sizez": 3, "sizey": 3, "spawns": 6500, "rangebottom": 1, "rangetop": 50},
+                    {"ore": MAT_GOLDORE, "seed": 4, "density": 0.5, "spawns": 2300, "rangebottom": 1, "rangetop": 35},
+                    {"ore": MAT_LAPISORE, "seed": 3, "density": 0.5, "spawns": 1200, "rangebottom": 1, "rangetop": 32},
+                    {"ore": MAT_REDSTONEORE, "seed": 2, "density": 0.5, "sizex": 3, "sizez": 3, "sizey": 3, "spawns": 2600, "rangebottom": 1, "rangetop": 19},
+                    {"ore": MAT_DIAMONDORE, "seed": 1, "density": 0.5, "spawns": 1400, "rangebottom": 1, "rangetop": 19} ]
+
+def chainores(inputlayer, orespecs, statelessrng = False):
+    """
+    The ores in orespecs as a chain of LandmarkGenerators, the way OreGenerator's placement is defined.
+    """
+    for spec in orespecs:
+        lmtype = CubicOreLandmark(None, ore = spec["ore"], density = spec.get("density", 0.33), sizex = spec.get("sizex", 2),
+                                  sizez = spec.get("sizez", 2), sizey = spec.get("sizey", 2), statelessrng = statelessrng)
+        inputlayer = LandmarkGenerator(inputlayer, spec.get("seed", 0), landmarklist = [lmtype], density = spec.get("spawns", 200),
+                                       rangebottom = spec.get("rangebottom", 0), rangetop = spec.get("rangetop", CHUNK_HEIGHT_IN_BLOCKS),
+                                       statelessrng = statelessrng)
+    return inputlayer
+
+def bench_oregenerator():
+    # Walk through fresh chunks, or the chain's caches would hand back the same chunk every time.
+    coords = [ (cx, cz) for cx in xrange(1, 31) for cz in xrange(1, 31) ]
+    for statelessrng in [False, True]:
+        oregen = OreGenerator(TerrainLayer(), defaultorespecs, statelessrng = statelessrng)
+        chained = chainores(TerrainLayer(), defaultorespecs, statelessrng = statelessrng)
+        fastcoords, slowcoords = iter(coords), iter(coords)
+        benchmark("OreGenerator%s" % (" (stateless)" if statelessrng else " (6 ores)"), lambda: oregen.getChunk( *fastcoords.next() ),
+                  lambda: chained.getChunk( *slowcoords.next() ), slowname = "chained", number = 100)
+
+benchmarks = [bench_waterlevelfilter, bench_topsoilfilter, bench_snowcoverfilter, bench_heightmaskrenderfilter, bench_blendmaskfilter, bench_remapfilter,
+              bench_stamptochunk, bench_oregenerator]
+
+if __name__ == "__main__":
+    for bench in benchmarks:
+        bench()
@@ -16,6 +16,7 @@ from scipy import *
 from pylab import *
 
 from layer import Chunk
+from constants import CHUNK_SHAPE
 
 __all__ = ["rm_rf", "saveedgeimage", "savechunkimage", "createWorld", "saveWorld", "renderWorld", "getWorldChunk", "setWorldChunk"]
 
@@ -83,10 +84,8 @@ def setWorldChunk(world, inchunk, cx, cz):
     global chunksBeforeNextSave
 
     assert( issubclass(inchunk.__class__, Chunk) )
-    arr = inchunk.blocks
-    assert( len(arr) == 16 )
-    assert( len(arr[0]) == 16 )
-    assert( len(arr[0][0]) == 128 )
+    arr = inchunk.readBlocks()
+    assert( arr.shape == CHUNK_SHAPE )
 
     if not world.containsChunk(cx, cz):
         world.createChunk(cx, cz)
@@ -2,6 +2,7 @@ import test_diamondsquare
 import test_baseclasses # those filthy base classes, they must be TESTED!!!
 import test_baselandmark
 import test_extendedlayers
-
+import test_lrucache
+import test_noise
 
 
@@ -11,31 +11,27 @@ import unittest
 # Dependencies
 import random
 import sys
+import numpy
 from constants import *
 
 # Modules to test
-from layer import Chunk, Layer, Filter
+from layer import Chunk, Layer, Filter, findSurface
 
 def validate_chunk_fields(chunk):
     # validate chunk coordinates
     if type(chunk.cx) != int: raise RuntimeError, "chunk cx not of type int"
     if type(chunk.cz) != int: raise RuntimeError, "chunk cx not of type int"
     # validate chunk blocks
-    if len(chunk.blocks) != CHUNK_WIDTH_IN_BLOCKS: raise RuntimeError, "chunk doesn't have correct number of rows"
-    for rowix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-        if len(chunk.blocks[rowix]) != CHUNK_WIDTH_IN_BLOCKS: raise RuntimeError, "chunk row %d doesn't have correct number of columns" % rowix 
-        for colix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            if len(chunk.blocks[rowix][colix]) != CHUNK_HEIGHT_IN_BLOCKS: raise RuntimeError, "chunk vertical column (%d,%d) doesn't have correct number of blocks" % (rowix, colix) 
-            for heightix in xrange(CHUNK_HEIGHT_IN_BLOCKS):
-                if type(chunk.blocks[rowix][colix][heightix]) != int: raise RuntimeError, "chunk block (%d,%d,%d) is not of type int" % (rowix, colix, heightix)
+    blocks = chunk.readBlocks()
+    if type(blocks) != numpy.ndarray: raise RuntimeError, "chunk blocks are not a numpy array"
+    if blocks.shape != CHUNK_SHAPE: raise RuntimeError, "chunk blocks have shape %s" % str(blocks.shape)
+    if blocks.dtype != CHUNK_DTYPE: raise RuntimeError, "chunk blocks are of type %s" % blocks.dtype
+    if not blocks.flags.c_contiguous: raise RuntimeError, "chunk blocks are not contiguous"
     # validate chunk data
-    if len(chunk.data) != CHUNK_WIDTH_IN_BLOCKS: raise RuntimeError, "chunk doesn't have correct number of rows"
-    for rowix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-        if len(chunk.data[rowix]) != CHUNK_WIDTH_IN_BLOCKS: raise RuntimeError, "chunk row %d doesn't have correct number of columns" % rowix 
-        for colix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            if len(chunk.data[rowix][colix]) != CHUNK_HEIGHT_IN_BLOCKS: raise RuntimeError, "chunk vertical column (%d,%d) doesn't have correct number of blocks" % (rowix, colix) 
-            for heightix in xrange(CHUNK_HEIGHT_IN_BLOCKS):
-                if type(chunk.data[rowix][colix][heightix]) != int: raise RuntimeError, "chunk block (%d,%d,%d) is not of type int" % (rowix, colix, heightix)
+    data = chunk.readData()
+    if type(data) != numpy.ndarray: raise RuntimeError, "chunk data is not a numpy array"
+    if data.shape != CHUNK_SHAPE: raise RuntimeError, "chunk data has shape %s" % str(data.shape)
+    if data.dtype != CHUNK_DTYPE: raise RuntimeError, "chunk data is of type %s" % data.dtype
 
 class ChunkTestCase(unittest.TestCase):
     """
@@ -43,6 +39,8 @@ class ChunkTestCase(unittest.TestCase):
     - it should contain a square, chunk-sized array of blocks and data.
     - it should have valid integer values for cx and cz. 
     - When copied, none of its fields should affect the fields of the original chunk.
+    - Views should share the original chunk's arrays until either one is written to.
+    - Its surface should always match the highest non-air block of each column.
     """
     testobject = None # this gets set in setUp, and tested in the subsequent tests. This allows subclassing of the tested object!
     def setUp(self):
@@ -64,16 +62,39 @@ class ChunkTestCase(unittest.TestCase):
         validate_chunk_fields(chunkcopy)
         chunkcopy.cx += 1
         chunkcopy.cz += 1
-        for rowix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            for colix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                for heightix in xrange(CHUNK_HEIGHT_IN_BLOCKS):
-                    chunkcopy.blocks[rowix][colix][heightix] += 1
-                    chunkcopy.data[rowix][colix][heightix] += 1
-        for rowix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-            for colix in xrange(CHUNK_WIDTH_IN_BLOCKS):
-                for heightix in xrange(CHUNK_HEIGHT_IN_BLOCKS):
-                    self.assertNotEqual(chunkcopy.blocks[rowix][colix][heightix], self.testobject.blocks[rowix][colix][heightix])
-                    self.assertNotEqual(chunkcopy.data[rowix][colix][heightix], self.testobject.data[rowix][colix][heightix])
+        chunkcopy.blocks += 1
+        chunkcopy.data += 1
+        self.assertTrue( (chunkcopy.blocks != self.testobject.blocks).all() )
+        self.assertTrue( (chunkcopy.data != self.testobject.data).all() )
+
+    def test_view(self):
+        chunkview = self.testobject.view()
+        validate_chunk_fields(chunkview)
+        # Reading from a view shouldn't copy anything...
+        self.assertTrue( numpy.may_share_memory(chunkview.readBlocks(), self.testobject.readBlocks()) )
+        self.assertRaises( ValueError, chunkview.readBlocks().fill, 1 )
+        # ...but writing to either side should leave the other one untouched.
+        chunkview.blocks += 1
+        chunkview.data += 1
+        self.assertTrue( (chunkview.readBlocks() != self.testobject.readBlocks()).all() )
+        self.assertTrue( (chunkview.readData() != self.testobject.readData()).all() )
+        otherview = self.testobject.view()
+        self.testobject.blocks += 2
+        self.assertTrue( (otherview.readBlocks() != self.testobject.readBlocks()).all() )
+
+    def test_surface(self):
+        self.assertTrue( (self.testobject.getSurface() == -1).all() )
+        self.testobject.blocks[3, 4, 0:10] = MAT_STONE
+        self.testobject.blocks[3, 4, 20] = MAT_LEAVES
+        surface = self.testobject.getSurface()
+        self.assertEqual(surface[3, 4], 20)
+        self.assertEqual(surface[4, 3], -1)
+        self.assertEqual(findSurface(self.testobject.readBlocks()[3, 4], rangetop = 19), 9)
+        # a surface we've been told about should stick around until somebody writes blocks again
+        self.testobject.setSurface( numpy.zeros((CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS)) )
+        self.assertEqual(self.testobject.getSurface()[3, 4], 0)
+        self.testobject.blocks[0, 0, 0] = MAT_AIR # writing blocks makes the chunk forget the surface
+        self.assertEqual(self.testobject.getSurface()[3, 4], 20)
         
 class LayerTestCase(unittest.TestCase):
     """
@@ -112,6 +133,13 @@ class LayerTestCase(unittest.TestCase):
             pass
         else:
             self.fail("filter getChunk should fail on bad input ")
+
+    def test_getchunks(self):
+        blocks = self.testobject.getChunks(-1, 2, 1, 5)
+        self.assertEqual(blocks.shape, (2, 3) + CHUNK_SHAPE)
+        self.assertEqual(blocks.dtype, CHUNK_DTYPE)
+        self.assertEqual(self.testobject.getChunks(0, 0, 0, 3).shape, (0, 3) + CHUNK_SHAPE)
+        self.assertRaises(RuntimeError, self.testobject.getChunks, 1, 0, 0, 1)
             
 class FilterTestCase(LayerTestCase):
     """
@@ -9,12 +9,15 @@ Go ahead. Break a subclass. I dare you.
 import unittest
 
 # Dependencies
-from layer import Layer
+from layer import Layer, TopSoilFilter
 from constants import *
 import test_baseclasses
+import test_extendedlayers
+import runbenchmarks
+import numpy
 
 # Modules to test
-from landmark import Landmark
+from landmark import Stamp, Landmark, LandmarkGenerator, OreGenerator, StaticTreeLandmark, CubicOreLandmark
 
 
 class LandmarkTestCase(test_baseclasses.FilterTestCase):
@@ -52,7 +55,150 @@ class LandmarkTestCase(test_baseclasses.FilterTestCase):
             pass
         else:
             self.fail("isLandmarkInChunk should fail on non-number input")
-            
-        
-        
-        
+
+    def test_stampToChunk(self):
+        # ragged rows, transparent holes, and offsets hanging off every side of the chunk
+        pattern = [[[MAT_WOOD, MAT_TRANSPARENT, MAT_LEAVES]], [[MAT_LEAVES], [MAT_TRANSPARENT, MAT_WOOD]], []]
+        for inputstamp in [pattern, StaticTreeLandmark.statictree]:
+            compiled = Stamp(inputstamp)
+            for offset in [(0, 0, 0), (-2, -1, 70), (14, 15, CHUNK_HEIGHT_IN_BLOCKS - 2), (-9, 3, -1), (16, 0, 0)]:
+                expected = test_extendedlayers.TerrainLayer().getChunk(0, 0).blocks
+                runbenchmarks.stamploop(inputstamp, expected, *offset)
+                for stamp in [inputstamp, compiled]:
+                    blocks = test_extendedlayers.TerrainLayer().getChunk(0, 0).blocks
+                    self.testobject.stampToChunk(stamp, blocks, *offset)
+                    self.assertTrue( numpy.array_equal(blocks, expected) )
+
+class LandmarkGeneratorTestCase(unittest.TestCase):
+    def build(self):
+        terrain = TopSoilFilter(test_extendedlayers.TerrainLayer(), replaceid = MAT_GRASS)
+        return LandmarkGenerator(terrain, 1234, landmarklist = [StaticTreeLandmark(None), CubicOreLandmark(None, ore = MAT_GOLDORE, sizey = 60)],
+                                 density = 3000, rangebottom = 40, rangetop = 100)
+
+    def spawnlist(self, spawns, landmarks = None):
+        """
+        Turn a list of (SpawnTable, start, stop) ranges into a list of Landmarks, making each one only once.
+        """
+        if landmarks is None: landmarks = {}
+        marks = []
+        for (table, start, stop) in spawns:
+            for ix in xrange(start, stop):
+                if not (id(table), ix) in landmarks:
+                    landmarks[ (id(table), ix) ] = table.getLandmark(ix)
+                marks.append( landmarks[ (id(table), ix) ] )
+        return marks
+
+    def test_matches_chain(self):
+        generator = self.build()
+        chained = self.build()
+        landmarks = {}
+        coords = [ (cx, cz) for cx in xrange(-2, 2) for cz in xrange(-2, 2) ]
+        for (cx, cz) in coords + list(reversed(coords)):
+            # the old way: a Landmark for each spawn, linked up as a chain of filters.
+            graph = chained.inputlayer
+            for mark in self.spawnlist(chained.getSpawnsTouchingChunk(cx, cz), landmarks):
+                mark.setInputLayer(graph)
+                graph = mark
+            expected = graph.getChunk(cx, cz).readBlocks()
+            self.assertTrue( (generator.getChunk(cx, cz).readBlocks() == expected).all() )
+        # and the drawing state ended up the same
+        for (cx, cz) in coords:
+            self.assertEqual( [mark.drawcancelled for mark in self.spawnlist(chained.getSpawnsTouchingChunk(cx, cz), landmarks)],
+                              [bool(table.drawcancelled[ix]) for (table, start, stop) in generator.getSpawnsTouchingChunk(cx, cz)
+                                                              for ix in xrange(start, stop)] )
+
+    def test_editchunk_landmark(self):
+        # a landmark written the plain way: editChunk() only, looking at the ground through self.inputlayer
+        class PillarLandmark(Landmark):
+            def editChunk(self, cornerblockx, cornerblockz, terrainchunk):
+                ground = self.findHighestGround()
+                relx, relz = self.x - cornerblockx, self.z - cornerblockz
+                if ground is not None and 0 <= relx < CHUNK_WIDTH_IN_BLOCKS and 0 <= relz < CHUNK_WIDTH_IN_BLOCKS:
+                    terrainchunk.blocks[relx, relz, ground[0]:ground[0] + 3] = MAT_WOOD
+        terrain = test_extendedlayers.TerrainLayer()
+        generator = LandmarkGenerator(terrain, 77, landmarklist = [PillarLandmark(None)], density = 3000)
+        landmarks = {}
+        for (cx, cz) in sorted( generator.getSpawnsInRegion(0, 0).originchunks )[:3]:
+            graph = generator.inputlayer
+            for mark in self.spawnlist(generator.getSpawnsTouchingChunk(cx, cz), landmarks):
+                mark.setInputLayer(graph)
+                graph = mark
+            blocks = generator.getChunk(cx, cz).readBlocks()
+            self.assertTrue( (blocks == graph.getChunk(cx, cz).readBlocks()).all() )
+            self.assertTrue( (blocks == MAT_WOOD).any() )
+        # the spawns' landmarks are only copies: the one in the landmark list never gets hooked up to anything
+        self.assertEqual( generator.landmarklist[0].inputlayer, None )
+
+    def test_spawn_index(self):
+        generator = LandmarkGenerator(test_extendedlayers.TerrainLayer(), 99, density = 2000,
+                                      landmarklist = [CubicOreLandmark(None), CubicOreLandmark(None, sizex = 40, sizez = 3)])
+        chunkviewrange = 2 # a viewrange of 20 blocks, rounded up to chunks
+        for (cx, cz) in [ (0, 0), (-1, 0), (31, 32), (-33, 5) ]:
+            # probe every chunk around us, just like we used to
+            expected = []
+            for chunkx in xrange(cx - chunkviewrange, cx + chunkviewrange + 1):
+                for chunkz in xrange(cz - chunkviewrange, cz + chunkviewrange + 1):
+                    spawns = generator.getSpawnsInChunk(chunkx, chunkz)
+                    if spawns is not None:
+                        table, start, stop = spawns
+                        expected.extend( (id(table), ix) for ix in xrange(start, stop) )
+                        # every spawn really is in the chunk it's filed under
+                        self.assertTrue( ((table.x[start:stop] / CHUNK_WIDTH_IN_BLOCKS) == chunkx).all() )
+                        self.assertTrue( ((table.z[start:stop] / CHUNK_WIDTH_IN_BLOCKS) == chunkz).all() )
+            spawns = generator.getSpawnsTouchingChunk(cx, cz)
+            self.assertEqual( [(id(table), ix) for (table, start, stop) in spawns for ix in xrange(start, stop)], expected )
+            self.assertTrue( any(lm.isLandmarkInChunk(cx, cz) for lm in self.spawnlist(spawns)) )
+
+    def test_spawn_table(self):
+        generator = self.build()
+        table = generator.getSpawnsInRegion(0, -1)
+        self.assertEqual( len(table), generator.density )
+        self.assertEqual( sum(stop - start for (start, stop) in table.originchunks.values()), len(table) )
+        self.assertTrue( ((table.z >= -REGION_WIDTH_IN_CHUNKS * CHUNK_WIDTH_IN_BLOCKS) & (table.z < 0)).all() )
+        self.assertTrue( ((table.y >= generator.rangebottom) & (table.y <= generator.rangetop)).all() )
+        lm = table.getLandmark(5)
+        self.assertTrue( isinstance(lm, generator.landmarklist[table.typeix[5]].__class__) )
+        self.assertEqual( (lm.x, lm.z, lm.y), (table.x[5], table.z[5], table.y[5]) )
+
+class OreGeneratorTestCase(unittest.TestCase):
+    def test_matches_chain(self):
+        # plenty of big, overlapping deposits, in front of the ones drawn after them
+        orespecs = [ {"ore": MAT_COALORE, "seed": 5, "density": 0.7, "sizex": 5, "sizez": 4, "sizey": 6, "spawns": 6000, "rangebottom": 1, "rangetop": 60},
+                     {"ore": MAT_IRONORE, "seed": 6, "density": 0.5, "sizex": 3, "sizez": 3, "sizey": 3, "spawns": 9000, "rangebottom": 1, "rangetop": 60},
+                     {"ore": MAT_GOLDORE, "seed": 4} ]
+        for statelessrng in [False, True]:
+            oregen = OreGenerator(test_extendedlayers.TerrainLayer(), orespecs, statelessrng = statelessrng)
+            chained = runbenchmarks.chainores(test_extendedlayers.TerrainLayer(), orespecs, statelessrng = statelessrng)
+            for (cx, cz) in [ (0, 0), (-1, 0), (0, -1), (31, 32), (5, -40) ]:
+                blocks = oregen.getChunk(cx, cz).readBlocks()
+                self.assertTrue( numpy.array_equal(blocks, chained.getChunk(cx, cz).readBlocks()) )
+                for ore in [MAT_COALORE, MAT_IRONORE]:
+                    self.assertTrue( (blocks == ore).any() )
+
+    def test_last_ore_wins(self):
+        # the same deposits twice over: the second ore should cover up every block of the first
+        orespecs = [ {"ore": MAT_COALORE, "seed": 8, "spawns": 5000}, {"ore": MAT_DIAMONDORE, "seed": 8, "spawns": 5000} ]
+        for statelessrng in [False, True]:
+            blocks = OreGenerator(test_extendedlayers.TerrainLayer(), orespecs, statelessrng = statelessrng).getChunk(3, 4).readBlocks()
+            self.assertTrue( (blocks == MAT_DIAMONDORE).any() )
+            self.assertFalse( (blocks == MAT_COALORE).any() )
+
+    def test_bounded(self):
+        # one chunk in each of lots of regions: we should only remember the last few regions' spawns.
+        orespecs = [ {"ore": MAT_COALORE, "seed": 5, "spawns": 500}, {"ore": MAT_IRONORE, "seed": 6, "spawns": 500} ]
+        coords = [ (rx * REGION_WIDTH_IN_CHUNKS + 16, rz * REGION_WIDTH_IN_CHUNKS + 16) for rx in xrange(-3, 3) for rz in xrange(-3, 3) ]
+        for statelessrng in [False, True]:
+            oregen = OreGenerator(test_extendedlayers.TerrainLayer(), orespecs, statelessrng = statelessrng, regioncachecapacity = 4)
+            first = dict( (coord, oregen.getChunk(*coord).readBlocks().copy()) for coord in coords )
+            for spawner in oregen.spawners:
+                self.assertFalse( isinstance(spawner, Layer) ) # no half-built filters hanging about
+                self.assertTrue( len(spawner.worldspawns) <= 4 )
+                self.assertTrue( len(spawner.regionfootprints) <= 4 )
+                self.assertTrue( spawner.worldspawns.evictions > 0 )
+            # regions we've forgotten come back just the same
+            for coord in coords:
+                self.assertTrue( numpy.array_equal(oregen.getChunk(*coord).readBlocks(), first[coord]) )
+
+    def test_bad_specs(self):
+        for orespecs in [ [{"seed": 5}], [{"ore": MAT_COALORE, "sizw": 5}] ]:
+            self.assertRaises( RuntimeError, OreGenerator, test_extendedlayers.TerrainLayer(), orespecs )
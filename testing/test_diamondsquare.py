@@ -92,6 +92,25 @@ class DiamondSquare2dTestCase(unittest.TestCase):
             for col in row:
                 self.assertTrue( isvalidheight( col ), "Not a valid height value or was not filled:" + str(col) )
 
+    def test_ndarray(self):
+        m = [[-1 for col in xrange(6)] for row in xrange(9)]; m[4][2] = 0.25
+        arr = numpy.array(m, dtype = float)
+        filled = diamondsquare2D( m, seed = 1234, volatility = 0.4 )
+        self.assertTrue( (filled == numpy.array(m)).all() )
+        self.assertTrue( diamondsquare2D( arr, seed = 1234, volatility = 0.4 ) is arr )
+        self.assertTrue( (arr == filled).all() )
+        self.assertEqual( arr[4, 2], 0.25 )
+
+    def test_batch(self):
+        arrs = numpy.zeros( (3, 9, 9) ) - 1
+        arrs[:, 0, 0] = 0.5
+        arrs[1, 8, 8] = 0.75
+        arrs[2, 4, 4] = 0.1
+        expected = [ diamondsquare2D( arr.tolist(), seed = 99, volatility = 0.3 ) for arr in arrs ]
+        diamondsquare2Dbatch( arrs, seed = 99, volatility = 0.3 )
+        for arr, single in zip(arrs, expected):
+            self.assertTrue( (arr == single).all() )
+
     def test_bad_inputs(self):
         size = ( 2**(3) ) + 1
         m = [[-1 for col in xrange(size)] for row in xrange(size)]
@@ -206,6 +225,21 @@ class DiamondSquare1dTestCase(unittest.TestCase):
         for row in m:
             self.assertTrue( isvalidheight( row ), "Not a valid height value or was not filled:" + str(row) )
 
+    def test_batch(self):
+        arrs = numpy.zeros( (4, 17) ) - 1
+        arrs[:, 0] = 0.5
+        arrs[1, 16] = 0.75
+        arrs[2, 8] = 0.1
+        for statelessrng in [False, True]:
+            seeds = [7, 8, 9, 7]
+            expected = [ diamondsquare1D( arr.tolist(), seed = seed, volatility = 0.3, statelessrng = statelessrng ) for arr, seed in zip(arrs, seeds) ]
+            filled = diamondsquare1Dbatch( arrs.copy(), seed = seeds, volatility = 0.3, statelessrng = statelessrng )
+            for arr, single in zip(filled, expected):
+                self.assertTrue( (arr == single).all() )
+            # one seed for every edge
+            filled = diamondsquare1Dbatch( arrs.copy(), seed = 7, volatility = 0.3, statelessrng = statelessrng )
+            self.assertTrue( (filled[0] == expected[0]).all() )
+
     def test_bad_inputs(self):
         size = ( 2**(3) ) + 1
         m = [-1 for row in xrange(size)]
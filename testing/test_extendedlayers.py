@@ -9,30 +9,414 @@ Go ahead. Break a subclass. I dare you.
 import unittest
 
 # Dependencies
+import random
+import numpy
 from constants import *
 import test_baseclasses
+import runbenchmarks
 
 # Modules to test
 from layer import *
+from layer import Chunk, findSurface
+
+class TerrainLayer(Layer):
+    """
+    A bumpy stone landscape with a few floating blocks, for testing filters against.
+    """
+    def getChunk(self, cx, cz):
+        chunk = Chunk(cx, cz)
+        blocks = chunk.blocks
+        for x in xrange(CHUNK_WIDTH_IN_BLOCKS):
+            for z in xrange(CHUNK_WIDTH_IN_BLOCKS):
+                blocks[x, z, 0:50 + (x * 7 + z * 3) % 40] = MAT_STONE
+        blocks[2, 2, 120] = MAT_LEAVES
+        blocks[5, 5, 100:105] = MAT_DIRT
+        return chunk
+
+class RandomLayer(Layer):
+    """
+    Chunks full of random blocks drawn from a handful of materials.
+    """
+    def getChunk(self, cx, cz):
+        chunk = Chunk(cx, cz)
+        materials = numpy.array([MAT_AIR, MAT_AIR, MAT_STONE, MAT_DIRT, MAT_WATER], dtype = CHUNK_DTYPE)
+        chunk.blocks = materials[ numpy.random.randint(0, len(materials), CHUNK_SHAPE) ]
+        return chunk
+
+class StaticLayer(Layer):
+    """
+    Hands out copies of the same chunk, wherever you ask for it.
+    """
+    chunk = None
+    def __init__(self, chunk):
+        self.chunk = chunk
+
+    def getChunk(self, cx, cz):
+        return self.chunk.copy()
+
+class RandomMask(LayerMask2d):
+    """
+    A different random heightmap for every chunk, but the same one each time you ask for it.
+    """
+    def getChunkHeights(self, cx, cz):
+        return numpy.random.RandomState( (cx * 7919 + cz) & 0xFFFF ).random_sample( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+
+def validate_getchunks(testcase, layer, cx0 = -2, cz0 = -1, cx1 = 1, cz1 = 2):
+    blocks = layer.getChunks(cx0, cz0, cx1, cz1)
+    testcase.assertEqual(blocks.shape, (cx1 - cx0, cz1 - cz0) + CHUNK_SHAPE)
+    for cx in xrange(cx0, cx1):
+        for cz in xrange(cz0, cz1):
+            testcase.assertTrue( (blocks[cx - cx0, cz - cz0] == layer.getChunk(cx, cz).readBlocks()).all() )
+
+def validate_surface(testcase, chunk):
+    testcase.assertTrue( (chunk.getSurface() == findSurface(chunk.readBlocks())).all() )
 
 class WaterLevelFilterTestCase(test_baseclasses.FilterTestCase):
     def setUp(self):
         self.testobject = self.construct(WaterLevelFilter)
+
+    def test_surface(self):
+        validate_surface(self, WaterLevelFilter(TerrainLayer(), rangetop = 70).getChunk(0, 0))
+        validate_surface(self, WaterLevelFilter(TerrainLayer(), findid = MAT_STONE, replaceid = MAT_AIR).getChunk(0, 0))
+        validate_surface(self, WaterLevelFilter(TerrainLayer(), rangetop = -5).getChunk(0, 0))
+
+    def test_matches_loop(self):
+        for (rangebottom, rangetop, findid, replaceid) in [(0, 64, MAT_AIR, MAT_WATER), (61, 66, MAT_DIRT, MAT_STONE), 
+                                                           (0, 0, MAT_STONE, MAT_BEDROCK), (100, 200, MAT_STONE, MAT_AIR),
+                                                           (0, -5, MAT_AIR, MAT_WATER), (0, -1, MAT_STONE, MAT_AIR)]:
+            chunk = RandomLayer().getChunk(0, 0)
+            expected = chunk.copy()
+            runbenchmarks.waterlevelloop(expected.blocks, rangebottom, rangetop, findid, replaceid)
+            wlfilter = WaterLevelFilter(StaticLayer(chunk), rangebottom, rangetop, findid, replaceid)
+            self.assertTrue( (wlfilter.getChunk(0, 0).readBlocks() == expected.readBlocks()).all() )
             
+class RemapFilterTestCase(test_baseclasses.FilterTestCase):
+    rules = [(0, 64, MAT_AIR, MAT_WATER), (61, 66, MAT_DIRT, MAT_STONE), (0, 0, MAT_STONE, MAT_BEDROCK), 
+             (30, 90, MAT_STONE, MAT_DIRT), (30, 90, MAT_DIRT, MAT_STONE), (10, 40, MAT_WATER, MAT_AIR)]
+
+    def setUp(self):
+        self.testobject = self.construct(RemapFilter)
+
+    def construct(self, thisclass):
+        return test_baseclasses.FilterTestCase.construct(self, lambda layer: thisclass(layer, self.rules))
+
+    def test_matches_chain(self):
+        materials = [MAT_AIR, MAT_STONE, MAT_DIRT, MAT_WATER, MAT_GRASS, MAT_SNOW]
+        for rules in [self.rules, self.rules[:3], [(20, 100, findid, replaceid) for findid, replaceid in zip(materials, materials[1:])]]:
+            chunk = RandomLayer().getChunk(0, 0)
+            chained = StaticLayer(chunk)
+            for rule in rules:
+                chained = WaterLevelFilter(chained, *rule)
+            fused = RemapFilter(StaticLayer(chunk), rules)
+            fusedchunk = fused.getChunk(0, 0)
+            self.assertTrue( (fusedchunk.readBlocks() == chained.getChunk(0, 0).readBlocks()).all() )
+            validate_surface(self, fusedchunk)
+
+    def test_fuse(self):
+        chunk = RandomLayer().getChunk(0, 0)
+        pipeline = WaterLevelFilter(StaticLayer(chunk), 0, 0, MAT_STONE, MAT_BEDROCK)
+        pipeline = WaterLevelFilter(pipeline, 10, 20, MAT_AIR, MAT_WATER)
+        pipeline = Filter(pipeline)
+        pipeline = WaterLevelFilter(pipeline, 61, 66, MAT_DIRT, MAT_STONE)
+        pipeline = WaterLevelFilter(pipeline)
+        expected = pipeline.getChunk(0, 0)
+        fused = fuseRemapFilters(pipeline)
+        self.assertEqual(type(fused), RemapFilter)
+        self.assertEqual(type(fused.inputlayer), Filter)
+        self.assertEqual(type(fused.inputlayer.inputlayer), RemapFilter)
+        self.assertEqual(type(fused.inputlayer.inputlayer.inputlayer), StaticLayer)
+        self.assertTrue( (fused.getChunk(0, 0).readBlocks() == expected.readBlocks()).all() )
+
 class TopSoilFilterTestCase(test_baseclasses.FilterTestCase):
     def setUp(self):
         self.testobject = self.construct(TopSoilFilter)
+
+    def test_surface(self):
+        validate_surface(self, TopSoilFilter(TerrainLayer(), rangetop = 110).getChunk(0, 0))
+        validate_surface(self, TopSoilFilter(TerrainLayer(), rangetop = 110, thickness = -3).getChunk(0, 0))
+
+    def test_matches_loop(self):
+        for (rangebottom, rangetop, findid, replaceid, thickness, airid) in [(0, 127, MAT_STONE, MAT_DIRT, 4, MAT_AIR), 
+                                                                             (20, 85, MAT_DIRT, MAT_GRASS, 1, MAT_AIR),
+                                                                             (0, 100, MAT_STONE, MAT_DIRT, -3, MAT_AIR),
+                                                                             (0, 127, MAT_STONE, MAT_AIR, 2, MAT_WATER)]:
+            chunk = RandomLayer().getChunk(0, 0)
+            expected = chunk.copy()
+            runbenchmarks.topsoilloop(expected.blocks, rangebottom, rangetop, findid, replaceid, thickness, airid)
+            tsfilter = TopSoilFilter(StaticLayer(chunk), rangebottom, rangetop, findid, replaceid, thickness, airid)
+            self.assertTrue( (tsfilter.getChunk(0, 0).readBlocks() == expected.readBlocks()).all() )
             
 class SnowCoverFilterTestCase(test_baseclasses.FilterTestCase):
     def setUp(self):
         self.testobject = self.construct(SnowCoverFilter)
 
+    def test_surface(self):
+        validate_surface(self, SnowCoverFilter(TerrainLayer(), rangetop = 110, thickness = 2).getChunk(0, 0))
+
+    def test_matches_loop(self):
+        for (rangebottom, rangetop, snowid, thickness, airid) in [(0, 120, MAT_SNOW, 1, MAT_AIR), (82, 95, MAT_SNOW, 3, MAT_AIR),
+                                                                  (0, 120, MAT_AIR, 2, MAT_STONE)]:
+            chunk = RandomLayer().getChunk(0, 0)
+            expected = chunk.copy()
+            runbenchmarks.snowcoverloop(expected.blocks, rangebottom, rangetop, snowid, thickness, airid)
+            scfilter = SnowCoverFilter(StaticLayer(chunk), rangebottom, rangetop, snowid, thickness, airid)
+            self.assertTrue( (scfilter.getChunk(0, 0).readBlocks() == expected.readBlocks()).all() )
+
 class CacheFilterTestCase(test_baseclasses.FilterTestCase):
     def setUp(self):
         self.testobject = self.construct(CacheFilter)
             
+    def test_copyonwrite(self):
+        first = self.testobject.getChunk(0, 0)
+        first.blocks.fill(MAT_STONE)
+        second = self.testobject.getChunk(0, 0)
+        self.assertTrue( (second.readBlocks() == MAT_AIR).all() )
+
+    def test_eviction(self):
+        self.testobject = CacheFilter(Layer(), capacity = 2)
+        for cx in xrange(3):
+            self.testobject.getChunk(cx, 0)
+        self.testobject.getChunk(0, 0)
+        stats = self.testobject.getStats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual(stats["misses"], 4)
+        self.assertEqual(stats["evictions"], 2)
+
     def test_persistence(self):
         print
         print "Please implement cache persistence testing soon!"
         pass
         
+
+class FusedFilterTestCase(test_baseclasses.FilterTestCase):
+    def setUp(self):
+        self.testobject = self.construct(FusedFilter)
+
+    def construct(self, thisclass):
+        stages = [WaterLevelFilter(None), SnowCoverFilter(None)]
+        return test_baseclasses.FilterTestCase.construct(self, lambda layer: thisclass(layer, stages))
+
+class CompilePipelineTestCase(unittest.TestCase):
+    def test_compile(self):
+        chunk = RandomLayer().getChunk(0, 0)
+        pipeline = StaticLayer(chunk)
+        pipeline = CacheFilter(pipeline, capacity = 5)
+        pipeline = Filter(pipeline)
+        pipeline = CacheFilter(pipeline, capacity = 10)
+        pipeline = TopSoilFilter(pipeline, rangetop = 110)
+        pipeline = WaterLevelFilter(pipeline, 61, 66, MAT_DIRT, MAT_STONE)
+        pipeline = Filter(pipeline)
+        pipeline = WaterLevelFilter(pipeline)
+        pipeline = SnowCoverFilter(pipeline, rangetop = 120)
+        pipeline = Filter(pipeline)
+        expected = pipeline.getChunk(0, 0)
+        compiled = compilePipeline(pipeline)
+        self.assertEqual(type(compiled), FusedFilter)
+        self.assertEqual([type(stage) for stage in compiled.stages], [TopSoilFilter, RemapFilter, SnowCoverFilter])
+        self.assertEqual(compiled.stages[1].rules, [(61, 66, MAT_DIRT, MAT_STONE), (0, CHUNK_HEIGHT_IN_BLOCKS / 2, MAT_AIR, MAT_WATER)])
+        self.assertEqual(type(compiled.inputlayer), CacheFilter)
+        self.assertEqual(compiled.inputlayer.cache.capacity, 10)
+        self.assertEqual(type(compiled.inputlayer.inputlayer), StaticLayer)
+        self.assertTrue( (compiled.getChunk(0, 0).readBlocks() == expected.readBlocks()).all() )
+
+class GetChunksTestCase(unittest.TestCase):
+    def setUp(self):
+        self.source = CacheFilter(RandomLayer()) # so every chunk stays the same between calls
+
+    def test_filters(self):
+        for makefilter in [lambda layer: WaterLevelFilter(layer, 10, 70),
+                           lambda layer: WaterLevelFilter(layer, 0, 127, MAT_STONE, MAT_AIR),
+                           lambda layer: RemapFilter(layer, RemapFilterTestCase.rules),
+                           lambda layer: TopSoilFilter(layer, rangetop = 110),
+                           lambda layer: TopSoilFilter(layer, 0, 100, MAT_STONE, MAT_DIRT, -3),
+                           lambda layer: SnowCoverFilter(layer, rangetop = 120, thickness = 2),
+                           lambda layer: FusedFilter(layer, [TopSoilFilter(None), WaterLevelFilter(None), SnowCoverFilter(None)]),
+                           lambda layer: CacheFilter(layer),
+                           InPlaceFilter, Filter]:
+            validate_getchunks(self, makefilter(self.source))
+
+    def test_processchunk_fallback(self):
+        class ShiftFilter(InPlaceFilter):
+            def processChunk(self, chunk):
+                chunk.blocks[:, :, chunk.cx % 16] = MAT_BEDROCK
+                return chunk
+        validate_getchunks(self, ShiftFilter(self.source))
+
+    def test_masks(self):
+        for mask in [RandomMask(), MaskFilter2d(RandomMask()), ThresholdMaskFilter2d(RandomMask(), 0.25, 0.75),
+                     BlendMaskFilter2d(RandomMask(), LayerMask2d(), blendscale = 0.3),
+                     BlendMaskFilter2d(RandomMask(), LayerMask2d(), alphamask = RandomMask()),
+                     (RandomMask() * 0.5 + ThresholdMaskFilter2d(RandomMask(), 0.25, 0.75) * 0.5).clip(0.1, 0.9)]:
+            heights = mask.getChunksHeights(-2, -1, 1, 2)
+            self.assertEqual(heights.shape, (3, 3, CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS))
+            for cx in xrange(-2, 1):
+                for cz in xrange(-1, 2):
+                    self.assertTrue( (heights[cx + 2, cz + 1] == numpy.asarray(mask.getChunkHeights(cx, cz))).all() )
+            validate_getchunks(self, HeightMaskRenderFilter(mask, MAT_STONE, 34, 94))
+
+class DSLayerMask2dTestCase(unittest.TestCase):
+    def test_regionmode(self):
+        chunkmode = DSLayerMask2d(1234, chunkvolatility = 0.25, regionvolatility = 0.8, chunkinitdepth = 1)
+        regionmode = DSLayerMask2d(1234, chunkvolatility = 0.25, regionvolatility = 0.8, chunkinitdepth = 1, regionmode = True)
+        # chunks on either side of a region seam should come out just like they do in chunk mode
+        for (cx, cz) in [(REGION_WIDTH_IN_CHUNKS - 1, 3), (REGION_WIDTH_IN_CHUNKS, 3), (REGION_WIDTH_IN_CHUNKS + 7, 0)]:
+            heights = regionmode.getChunkHeights(cx, cz)
+            self.assertEqual( heights.shape, (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+            self.assertTrue( (heights == numpy.array(chunkmode.getChunkHeights(cx, cz))).all() )
+            self.assertRaises( ValueError, heights.fill, 0.0 ) # views into the cached region can't be changed
+        heights = regionmode.getChunksHeights(REGION_WIDTH_IN_CHUNKS - 2, 1, REGION_WIDTH_IN_CHUNKS + 1, 3)
+        self.assertTrue( (heights == chunkmode.getChunksHeights(REGION_WIDTH_IN_CHUNKS - 2, 1, REGION_WIDTH_IN_CHUNKS + 1, 3)).all() )
+
+    def test_caches(self):
+        mask = DSLayerMask2d(1234, chunkcachecapacity = 2, regioncachecapacity = 1)
+        first = mask.getChunkHeights(0, 0)
+        self.assertTrue( mask.getChunkHeights(0, 0) is first )
+        mask.getChunkHeights(1, 0)
+        mask.getChunkHeights(-1, 0) # in another region, and pushes chunk (0, 0) out
+        regenerated = mask.getChunkHeights(0, 0)
+        self.assertFalse( regenerated is first )
+        self.assertTrue( (regenerated == first).all() )
+        stats = mask.getStats()
+        self.assertEqual( (stats["chunkheights"]["hits"], stats["chunkheights"]["misses"]), (1, 4) )
+        self.assertEqual( stats["chunkheights"]["entries"], 2 )
+        self.assertEqual( stats["regioncorners"]["entries"], 1 )
+        self.assertEqual( stats["regioncorners"]["evictions"], 2 )
+
+    def test_edgecache(self):
+        striplength = 5
+        mask = DSLayerMask2d(1234, edgecachecapacity = 3 * striplength + 2)
+        for cx in xrange(3):
+            for cz in xrange(striplength):
+                mask.getChunkHeights(cx, cz)
+        # every edge between the 4 x 6 chunk corners we touched gets generated exactly once
+        stats = mask.getStats()["chunkedges"]
+        self.assertEqual( stats["misses"], 4 * striplength + 3 * (striplength + 1) )
+        self.assertEqual( stats["hits"], 4 * 3 * striplength - stats["misses"] )
+
+    def test_regioncorners(self):
+        regionsouths, regionwests = numpy.mgrid[-3:4, -2:3]
+        for statelessrng in [False, True]:
+            mask = DSLayerMask2d(1234, statelessrng = statelessrng)
+            corners = mask.getRegionCorners(regionsouths, regionwests)
+            self.assertEqual( corners.shape, regionsouths.shape )
+            for rs, rw, corner in zip(regionsouths.ravel(), regionwests.ravel(), corners.ravel()):
+                self.assertEqual( corner, mask.getregioncorner( (int(rs), int(rw)) ) )
+            # broadcasting a single row against a column of regions
+            self.assertTrue( (mask.getRegionCorners(regionsouths[:, :1], regionwests[:1, :]) == corners).all() )
+        self.assertRaises( RuntimeError, mask.getRegionCorners, [0.5], [1] )
+
+class CountingMask(RandomMask):
+    """
+    A RandomMask which counts how many times it's been asked for heights, and hands out read-only arrays.
+    """
+    calls = 0
+    def getChunkHeights(self, cx, cz):
+        self.calls += 1
+        heights = RandomMask.getChunkHeights(self, cx, cz)
+        heights.flags.writeable = False
+        return heights
+
+class MaskExpressionTestCase(unittest.TestCase):
+    def test_arithmetic(self):
+        first, second = RandomMask(), LayerMask2d( numpy.random.random( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) ) )
+        a, b = first.getChunkHeights(3, 4), second.getChunkHeights(3, 4)
+        for expression, expected in [ (first + second, a + b), (first - 0.5, a - 0.5), (2 - first, 2 - a), (first * second, a * b),
+                                      (3 * second, 3 * b), (first / 2, a / 2.0), (1 / (second + 1), 1 / (b + 1)), (-first, -a),
+                                      (first.minimum(second), numpy.minimum(a, b)), (first.maximum(0.5), numpy.maximum(a, 0.5)),
+                                      ((first * 3 - 1).clip(0.0, second), numpy.clip(a * 3 - 1, 0.0, b)) ]:
+            heights = expression.getChunkHeights(3, 4)
+            self.assertEqual( heights.shape, (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+            self.assertTrue( (heights == expected).all() )
+
+    def test_shared_subexpressions(self):
+        mask = CountingMask()
+        shared = mask * 2
+        expression = (shared + shared) * shared - mask
+        a = RandomMask().getChunkHeights(1, 1)
+        heights = expression.getChunkHeights(1, 1)
+        self.assertEqual( mask.calls, 1 ) # and it's read-only, so nothing overwrote it either
+        self.assertTrue( (heights == (a * 2 + a * 2) * (a * 2) - a).all() )
+        out = numpy.empty( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        self.assertTrue( expression.getChunkHeights(1, 1, out = out) is out )
+        self.assertTrue( (out == heights).all() )
+
+    def test_nodes(self):
+        mask = CountingMask()
+        blend = BlendMaskFilter2d(mask, LayerMask2d(), alphamask = ThresholdMaskFilter2d(mask, 0.5))
+        a = RandomMask().getChunkHeights(5, 6)
+        alpha = ( (0.5 <= a) & (a <= 1.0) ).astype(float)
+        self.assertTrue( (blend.getChunkHeights(5, 6) == a * (1.0 - alpha) + 1.0 * alpha).all() )
+        self.assertEqual( mask.calls, 1 )
+        self.assertTrue( ((blend + 1).getChunkHeights(5, 6) == blend.getChunkHeights(5, 6) + 1).all() )
+
+class ThresholdMaskFilter2dTestCase(unittest.TestCase):
+    def test_nonmutating(self):
+        initial = RandomMask().getChunkHeights(0, 0)
+        source = LayerMask2d(initial)
+        threshold = ThresholdMaskFilter2d(source, 0.25, 0.75)
+        expected = ( (0.25 <= initial) & (initial <= 0.75) ).astype(float)
+        self.assertTrue( (threshold.getChunkHeights(0, 0) == expected).all() )
+        self.assertTrue( (source.getChunkHeights(0, 0) == initial).all() )
+        # and again over a cached, read-only input
+        self.assertTrue( (ThresholdMaskFilter2d(DSLayerMask2d(1234)).getChunkHeights(0, 0) <= 1.0).all() )
+        out = numpy.empty( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        self.assertTrue( threshold.getChunkHeights(0, 0, out = out) is out )
+        self.assertTrue( (out == expected).all() )
+
+class CacheMaskFilter2dTestCase(unittest.TestCase):
+    def test_cache(self):
+        mask = CountingMask()
+        cache = CacheMaskFilter2d(mask, capacity = 2)
+        first = cache.getChunkHeights(0, 0)
+        self.assertTrue( (first == RandomMask().getChunkHeights(0, 0)).all() )
+        self.assertFalse( first.flags.writeable )
+        # two consumers of the same cached mask only ask the input once
+        (cache + cache * 2).getChunkHeights(0, 0)
+        ThresholdMaskFilter2d(cache).getChunkHeights(0, 0)
+        self.assertEqual( mask.calls, 1 )
+        cache.getChunkHeights(0, 1)
+        cache.getChunkHeights(0, 2) # pushes chunk (0, 0) out
+        cache.getChunkHeights(0, 0)
+        self.assertEqual( mask.calls, 4 )
+        self.assertEqual( cache.getStats()["evictions"], 2 )
+
+    def test_writable_input(self):
+        heights = numpy.random.random( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        class WritableMask(LayerMask2d):
+            def getChunkHeights(self, cx, cz):
+                return heights
+        cached = CacheMaskFilter2d(WritableMask()).getChunkHeights(0, 0)
+        self.assertTrue( heights.flags.writeable ) # we didn't lock up somebody else's array
+        heights[0, 0] = 5.0
+        self.assertNotEqual( cached[0, 0], 5.0 )
+
+class BlendMaskFilter2dTestCase(unittest.TestCase):
+    def test_matches_loop(self):
+        first, second, alpha = RandomMask(), RandomMask(), RandomMask()
+        expected = runbenchmarks.blendloop(first.getChunkHeights(1, 2), second.getChunkHeights(3, 4), alpha.getChunkHeights(5, 6))
+        blend = BlendMaskFilter2d(LayerMask2d(first.getChunkHeights(1, 2)), LayerMask2d(second.getChunkHeights(3, 4).tolist()),
+                                  alphamask = LayerMask2d(alpha.getChunkHeights(5, 6)))
+        heights = blend.getChunkHeights(0, 0)
+        self.assertEqual( (heights.dtype, heights.shape), (numpy.dtype(float), (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS)) )
+        self.assertTrue( (heights == numpy.array(expected)).all() )
+        # blending into a buffer we already have
+        out = numpy.empty( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        self.assertTrue( blend.getChunkHeights(0, 0, out = out) is out )
+        self.assertTrue( (out == heights).all() )
+
+    def test_blendscale(self):
+        blend = BlendMaskFilter2d(LayerMask2d(), RandomMask(), blendscale = 0.25)
+        heights = blend.getChunkHeights(2, 3)
+        self.assertTrue( (heights == 0.75 + RandomMask().getChunkHeights(2, 3) * 0.25).all() )
+
+class HeightMaskRenderFilterTestCase(unittest.TestCase):
+    def test_matches_loop(self):
+        heights = numpy.random.random( (CHUNK_WIDTH_IN_BLOCKS, CHUNK_WIDTH_IN_BLOCKS) )
+        heights[0, 0] = 0.0
+        heights[1, 1] = 1.0
+        expected = Chunk(3, 4)
+        runbenchmarks.heightmaskrenderloop(heights, expected.blocks, MAT_STONE, 34, 94)
+        chunk = HeightMaskRenderFilter(LayerMask2d(heights), MAT_STONE, 34, 94).getChunk(3, 4)
+        test_baseclasses.validate_chunk_fields(chunk)
+        self.assertTrue( (chunk.readBlocks() == expected.readBlocks()).all() )
+        validate_surface(self, chunk)
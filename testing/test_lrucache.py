@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""
+
+Unit testing for the lrucache module
+
+"""
+
+import unittest
+
+# Dependencies
+import numpy
+
+# Modules to test
+from lrucache import LRUCache
+
+class LRUCacheTestCase(unittest.TestCase):
+    """
+    LRUCache is a bounded dictionary-like cache:
+    - it should never hold more than capacity entries or maxbytes bytes
+    - it should throw away the least recently used entry first
+    - it should count hits, misses and evictions
+    """
+    def test_capacity(self):
+        cache = LRUCache(capacity = 2)
+        cache["a"] = 1
+        cache["b"] = 2
+        self.assertEqual(cache["a"], 1) # "b" is now the least recently used
+        cache["c"] = 3
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("a" in cache)
+        self.assertFalse("b" in cache)
+        self.assertTrue("c" in cache)
+        self.assertEqual(cache.get("b"), None)
+        stats = cache.getStats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+
+    def test_maxbytes(self):
+        cache = LRUCache(maxbytes = 250)
+        for key in xrange(4):
+            cache[key] = numpy.zeros(100, dtype = 'uint8')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.nbytes, 200)
+        self.assertEqual(cache.evictions, 2)
+        del cache[3]
+        self.assertEqual(cache.nbytes, 100)
+
+    def test_bad_inputs(self):
+        self.assertRaises(ValueError, LRUCache, 0)
+        self.assertRaises(ValueError, LRUCache, None, -1)
+        self.assertRaises(KeyError, LRUCache().__getitem__, "missing")
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+"""
+
+Unit testing for the noise module
+
+"""
+
+import unittest
+
+# Dependencies
+import random
+import numpy
+from layer import DSLayerMask2d
+
+# Modules to test
+from noise import *
+
+class NoiseTestCase(unittest.TestCase):
+    """
+    hashrandom and hashrandint are stateless random number sources:
+    - the same seed, purpose and coordinates should always give the same value
+    - changing any of them should give a different value
+    - arrays of coordinates should give the same values as asking one at a time
+    - values should land in range, like random.random() and random.randint()
+    """
+    def test_repeatable(self):
+        self.assertEqual( hashrandom(1234, NOISE_ORE, 5, -6, 7), hashrandom(1234, NOISE_ORE, 5, -6, 7) )
+        self.assertEqual( type(hashrandom(1234, NOISE_ORE, 5)), float )
+        values = set([ hashrandom(1234, NOISE_ORE, 5, -6, 7), hashrandom(1235, NOISE_ORE, 5, -6, 7), hashrandom(1234, NOISE_DSFILL, 5, -6, 7),
+                       hashrandom(1234, NOISE_ORE, 5, -6, 8), hashrandom(1234, NOISE_ORE, -6, 5, 7), hashrandom(1234, NOISE_ORE, 5, -6, 7.0) ])
+        self.assertEqual( len(values), 6 )
+
+    def test_arrays(self):
+        xs, zs = numpy.indices( (8, 8) ) - 4
+        values = hashrandom(99, NOISE_REGIONCORNER, xs, zs)
+        self.assertEqual( values.shape, (8, 8) )
+        for x, z in [(0, 0), (3, 5), (7, 1)]:
+            self.assertEqual( values[x, z], hashrandom(99, NOISE_REGIONCORNER, xs[x, z], zs[x, z]) )
+        # broadcasting a scalar coordinate against an array
+        self.assertTrue( (hashrandom(99, NOISE_REGIONCORNER, -4, zs[0]) == values[0]).all() )
+
+    def test_range(self):
+        values = hashrandom("seed", NOISE_DSFILL, numpy.arange(10000))
+        self.assertTrue( (0.0 <= values).all() and (values < 1.0).all() )
+        self.assertAlmostEqual( values.mean(), 0.5, places = 1 )
+        ints = hashrandint(None, NOISE_SPAWNY, 3, 9, numpy.arange(10000))
+        self.assertEqual( sorted(set(ints.tolist())), range(3, 10) )
+        self.assertEqual( type(hashrandint(None, NOISE_SPAWNY, 3, 9, 0)), int )
+
+    def test_stateless_heightmap(self):
+        random.seed(5)
+        state = random.getstate()
+        first = numpy.array( DSLayerMask2d(1234, statelessrng = True).getChunkHeights(40, -3) )
+        self.assertEqual( random.getstate(), state )
+        random.seed(6)
+        second = numpy.array( DSLayerMask2d(1234, statelessrng = True).getChunkHeights(40, -3) )
+        self.assertTrue( (first == second).all() )
+        self.assertTrue( (0.0 <= first).all() and (first <= 1.0).all() )